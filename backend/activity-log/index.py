@@ -0,0 +1,678 @@
+"""
+Business: Журнал действий - пакетная запись событий через COPY и выборка по окну времени, типу и пользователю
+Args: event с httpMethod, body, queryStringParameters
+Returns: HTTP response с числом записанных событий или страницей журнала
+"""
+
+import csv
+import functools
+import io
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+CHANGES_CHANNEL = 'mdc_changes'
+LOG_MAX_BATCH = int(os.environ.get('ACTIVITY_LOG_MAX_BATCH', '5000'))
+LOG_MAX_PAGE = 500
+LOG_DEFAULT_PAGE = 100
+LOG_DEFAULT_WINDOW_HOURS = 24
+LOG_RETENTION_DAYS = int(os.environ.get('ACTIVITY_LOG_RETENTION_DAYS', '90'))
+LOG_MAINTAIN_INTERVAL = float(os.environ.get('ACTIVITY_LOG_MAINTAIN_INTERVAL', '3600'))
+LOG_MAINTAIN_LOCK_ID = 48049794
+# Часы клиента могут спешить: время из будущего дальше этого допуска заменяется серверным
+LOG_MAX_CLOCK_SKEW = timedelta(minutes=5)
+# Поля события -> длина VARCHAR колонки: длинная строка отклоняется до COPY, а не обрывает весь пакет
+LOG_TEXT_LIMITS = {'type': 50, 'userId': 50, 'userName': 255, 'crewName': 50}
+
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+FUNCTION_NAME = 'activity-log'
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') != '0'
+SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '0'))  # 0 - медленные запросы не логируются
+DB_WARMUP = os.environ.get('DB_WARMUP', '1') != '0'
+DB_PREPARE = os.environ.get('DB_PREPARE', '1') != '0'  # 0 - для пулеров в режиме транзакций
+
+SCHEMA = 't_p48049793_mobile_digital_compu'
+
+LOG_COLUMNS = ('log_time', 'log_type', 'message', 'user_id', 'user_name', 'crew_id', 'crew_name', 'details')
+LOG_COPY_SQL = f"COPY {SCHEMA}.activity_log ({', '.join(LOG_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+
+# Запись идёт через COPY, а выборка - с литералами окна времени, чтобы секции отсекались при планировании,
+# поэтому горячих запросов для PREPARE здесь нет
+PREPARED_STATEMENTS: Dict[str, Tuple[str, Tuple]] = {}
+
+# monotonic() отсчитывается от загрузки хоста: с 0.0 обслуживание секций пропускалось бы первый час аптайма
+_last_maintain = float('-inf')
+
+
+_request = threading.local()
+
+
+class RequestTimer:
+    '''
+    Замер одного вызова handler: время фаз connect / execute / fetch / serialize (мс) и число запросов к БД.
+    Текущий замер лежит в thread-local - пул и курсоры пишут в него без передачи через аргументы.
+    Имя функции и порог медленного запроса берутся из замера: в server/app.py курсор подключения
+    из общего пула принадлежит другому модулю
+    '''
+
+    def __init__(self, request_id: Optional[str]):
+        self.request_id = request_id
+        self.function = FUNCTION_NAME
+        self.slow_query_ms = SLOW_QUERY_MS
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {'connect': 0.0, 'execute': 0.0, 'fetch': 0.0, 'serialize': 0.0}
+        self.queries = 0
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] += seconds * 1000
+
+    def server_timing(self, total_ms: float) -> str:
+        metrics = [f'{name};dur={ms:.1f}' for name, ms in self.phases.items() if ms]
+        metrics.append(f'total;dur={total_ms:.1f}')
+        metrics.append(f'db;desc="{self.queries} queries"')
+        return ', '.join(metrics)
+
+
+@contextmanager
+def request_phase(phase: str) -> Iterator[None]:
+    """Добавляет время блока к фазе текущего запроса; вне handler ничего не делает"""
+    timer = getattr(_request, 'timer', None)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.add(phase, time.perf_counter() - started)
+
+
+def log_slow_query(query: Any, vars: Any, ms: float) -> None:
+    timer = getattr(_request, 'timer', None)
+    sql = query.decode(errors='replace') if isinstance(query, bytes) else str(query)
+    print(json.dumps({
+        'log': 'slow-query', 'function': timer.function if timer else FUNCTION_NAME,
+        'request_id': timer.request_id if timer else None,
+        'ms': round(ms, 1), 'sql': ' '.join(sql.split())[:2000], 'params': repr(vars)[:1000]
+    }, ensure_ascii=False))
+
+
+_timed_cursors: Dict[type, type] = {}
+
+
+def timed_cursor(factory: type) -> type:
+    """Подкласс курсора: execute/fetch идут в замер текущего запроса, медленные запросы - в лог"""
+    if factory not in _timed_cursors:
+        class TimedCursor(factory):
+            def execute(self, query, vars=None):
+                timer = getattr(_request, 'timer', None)
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    elapsed = time.perf_counter() - started
+                    if timer is not None:
+                        timer.queries += 1
+                        timer.add('execute', elapsed)
+                    threshold = timer.slow_query_ms if timer is not None else SLOW_QUERY_MS
+                    if threshold and elapsed * 1000 >= threshold:
+                        log_slow_query(query, vars, elapsed * 1000)
+
+            def copy_expert(self, sql, file, *args, **kwargs):
+                timer = getattr(_request, 'timer', None)
+                started = time.perf_counter()
+                try:
+                    return super().copy_expert(sql, file, *args, **kwargs)
+                finally:
+                    if timer is not None:
+                        timer.queries += 1
+                        timer.add('execute', time.perf_counter() - started)
+
+            def fetchone(self):
+                with request_phase('fetch'):
+                    return super().fetchone()
+
+            def fetchmany(self, *args, **kwargs):
+                with request_phase('fetch'):
+                    return super().fetchmany(*args, **kwargs)
+
+            def fetchall(self):
+                with request_phase('fetch'):
+                    return super().fetchall()
+
+        _timed_cursors[factory] = TimedCursor
+    return _timed_cursors[factory]
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    """Подключение пула: курсор с любым cursor_factory оборачивается в timed_cursor; prepared - имена PREPARE"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+        return super().cursor(*args, cursor_factory=timed_cursor(factory), **kwargs)
+
+
+def prepare_sql(name: str) -> str:
+    """Текст PREPARE для горячего запроса: плейсхолдеры psycopg2 заменяются на $1..$n"""
+    sql, params = PREPARED_STATEMENTS[name]
+    if params and isinstance(params[0], tuple):
+        placeholders: Any = {param: f'${i}' for i, (param, _) in enumerate(params, 1)}
+        types = [param_type for _, param_type in params]
+    else:
+        placeholders = tuple(f'${i}' for i in range(1, len(params) + 1))
+        types = list(params)
+    type_list = f" ({', '.join(types)})" if types else ''
+    return f'PREPARE {name}{type_list} AS {sql % placeholders}'
+
+
+def prepare_statements(conn) -> None:
+    '''
+    PREPARE всех горячих запросов на новом подключении пула, вне транзакции.
+    Ошибка (например, таблицы ещё нет) не мешает подключению - запрос подготовится при первом вызове
+    '''
+    if not DB_PREPARE:
+        return
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for name in PREPARED_STATEMENTS:
+                if name in conn.prepared:
+                    continue
+                try:
+                    cur.execute(prepare_sql(name))
+                    conn.prepared.add(name)
+                except psycopg2.ProgrammingError as e:
+                    print(f'[prepare] {name} postponed: {e}')
+    finally:
+        conn.autocommit = autocommit
+
+
+def execute_prepared(cur, name: str, args: Any) -> None:
+    '''
+    Горячий запрос по имени: EXECUTE name(...) вместо полного текста - Postgres не разбирает его заново,
+    а после нескольких вызовов берёт закэшированный generic-план.
+    При DB_PREPARE=0 или на подключении не из пула - обычным текстом
+    '''
+    sql, params = PREPARED_STATEMENTS[name]
+    prepared = getattr(cur.connection, 'prepared', None)
+    if not DB_PREPARE or prepared is None:
+        cur.execute(sql, args)
+        return
+    if name not in prepared:
+        cur.execute(prepare_sql(name))
+        prepared.add(name)
+    if isinstance(args, dict):
+        args = [args[param] for param, _ in params]
+    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(args))})" if args else f'EXECUTE {name}', args or None)
+
+
+def instrumented(func):
+    '''
+    Обёртка handler: замер фаз, заголовок Server-Timing в ответе и строка JSON-лога на каждый вызов
+    с request_id из context
+    '''
+    @functools.wraps(func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        timer = RequestTimer(getattr(context, 'request_id', None))
+        _request.timer = timer
+        response: Optional[Dict[str, Any]] = None
+        try:
+            response = func(event, context)
+            return response
+        finally:
+            _request.timer = None
+            total_ms = (time.perf_counter() - timer.started) * 1000
+            if response is not None:
+                headers = response.setdefault('headers', {})
+                headers['Server-Timing'] = timer.server_timing(total_ms)
+                headers['Timing-Allow-Origin'] = '*'
+                exposed = headers.get('Access-Control-Expose-Headers')
+                headers['Access-Control-Expose-Headers'] = f'{exposed}, Server-Timing' if exposed else 'Server-Timing'
+            if REQUEST_LOG:
+                print(json.dumps({
+                    'log': 'request', 'function': FUNCTION_NAME, 'request_id': timer.request_id,
+                    'method': event.get('httpMethod'), 'status': response.get('statusCode') if response else 500,
+                    'total_ms': round(total_ms, 1), 'queries': timer.queries,
+                    'cache': response.get('headers', {}).get('X-Cache') if response else None,
+                    **{f'{name}_ms': round(ms, 1) for name, ms in timer.phases.items()}
+                }))
+    return wrapper
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить подключение из пула за DB_POOL_TIMEOUT секунд"""
+
+
+class ConnectionPool:
+    '''
+    Пул подключений к БД, живущий на уровне модуля между тёплыми вызовами.
+    Функции деплоятся изолированно, поэтому пул есть в каждой из них.
+    Args: dsn - строка подключения, min_size/max_size - границы пула,
+          timeout - сколько ждать свободное подключение (сек),
+          ping_after - после скольких секунд простоя проверять подключение
+    '''
+
+    def __init__(self, dsn: str, min_size: int, max_size: int, timeout: float, ping_after: float):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._idle: List[Tuple[Any, float]] = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self.stats: Dict[str, float] = {
+            'created': 0, 'reused': 0, 'discarded': 0,
+            'waits': 0, 'wait_ms': 0.0, 'max_wait_ms': 0.0, 'timeouts': 0
+        }
+        for _ in range(min(self.min_size, self.max_size)):
+            self._size += 1
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory=TimedConnection)
+        prepare_statements(conn)
+        self.stats['created'] += 1
+        return conn
+
+    def _is_healthy(self, conn, idle_since: float) -> bool:
+        """Проверка подключения: дешёвая всегда, SELECT 1 - только после долгого простоя"""
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close_quietly(self, conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        started = time.monotonic()
+        while True:
+            with self._cond:
+                waited = False
+                while not self._idle and self._size >= self.max_size:
+                    waited = True
+                    remaining = self.timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        self.stats['timeouts'] += 1
+                        print(f'[db-pool] timeout after {self.timeout}s, stats={self.stats}')
+                        raise PoolTimeout(f'No free DB connection after {self.timeout}s')
+                    self._cond.wait(remaining)
+                if waited:
+                    wait_ms = (time.monotonic() - started) * 1000
+                    self.stats['waits'] += 1
+                    self.stats['wait_ms'] += wait_ms
+                    self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], wait_ms)
+                    print(f'[db-pool] waited {wait_ms:.1f}ms for connection, stats={self.stats}')
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                else:
+                    self._size += 1
+                    conn, idle_since = None, 0.0
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            if self._is_healthy(conn, idle_since):
+                self.stats['reused'] += 1
+                return conn
+
+            # Подключение умерло (рестарт БД, idle timeout) - выбрасываем и пробуем снова
+            self._close_quietly(conn)
+            with self._cond:
+                self._size -= 1
+                self.stats['discarded'] += 1
+                self._cond.notify()
+
+    def putconn(self, conn, broken: bool = False) -> None:
+        if not broken and not conn.closed:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+        with self._cond:
+            if broken or conn.closed:
+                self._close_quietly(conn)
+                self._size -= 1
+                self.stats['discarded'] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Ленивая инициализация пула при первом запросе"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                dsn = os.environ.get('DATABASE_URL')
+                if not dsn:
+                    raise ValueError('DATABASE_URL not set')
+                _pool = ConnectionPool(dsn, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_PING_AFTER)
+    return _pool
+
+
+@contextmanager
+def db_connection() -> Iterator[Any]:
+    """Подключение из пула; при сетевой ошибке подключение выбрасывается, а не возвращается в пул"""
+    with request_phase('connect'):
+        pool = get_pool()
+        conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        pool.putconn(conn, broken=broken)
+
+
+def bad_request(message: str) -> Dict[str, Any]:
+    return {
+        'statusCode': 400,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': message}),
+        'isBase64Encoded': False
+    }
+
+
+def json_response(status: int, body: str) -> Dict[str, Any]:
+    """Ответ с готовым JSON-текстом"""
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def parse_time(value: Any) -> Optional[datetime]:
+    '''
+    ISO-время в наивное UTC, как хранится log_time и считаются границы секций; время без зоны считается UTC
+    Raises: ValueError, если value - не строка ISO-времени
+    '''
+    if value is None or value == '':
+        return None
+    if not isinstance(value, str):
+        raise ValueError('время - строка ISO 8601')
+    # Date.toISOString() даёт суффикс Z, который fromisoformat до Python 3.11 не понимает
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def event_text(item: Dict[str, Any], field: str, required: bool = False) -> Optional[str]:
+    '''
+    Строковое поле события: не строка, пустая обязательная строка, длиннее колонки или с символом NUL
+    (его не примет COPY) - ValueError
+    '''
+    value = item.get(field)
+    if value is None and not required:
+        return None
+    limit = LOG_TEXT_LIMITS.get(field)
+    if not isinstance(value, str) or (required and not value) or (limit and len(value) > limit) or '\x00' in value:
+        size = f' до {limit} символов' if limit else ''
+        raise ValueError(f"{field} - {'непустая ' if required else ''}строка{size} без символа NUL")
+    return value
+
+
+def parse_event(item: Any, now: datetime) -> Optional[Tuple]:
+    '''
+    Событие фронтенда (ActivityLog без id) в строку COPY по LOG_COLUMNS
+    Returns: кортеж значений или None, если событие старше срока хранения
+    Raises: ValueError для некорректного события - тип и длина каждого поля проверяются здесь,
+            чтобы одно событие не обрывало COPY всего пакета
+    '''
+    if not isinstance(item, dict):
+        raise ValueError('событие должно быть объектом')
+    log_type = event_text(item, 'type', required=True)
+    message = event_text(item, 'description', required=True)
+
+    try:
+        log_time = parse_time(item.get('timestamp')) or now
+    except ValueError:
+        raise ValueError('timestamp - строка ISO 8601') from None
+    if log_time > now + LOG_MAX_CLOCK_SKEW:
+        log_time = now
+    if log_time < now - timedelta(days=LOG_RETENTION_DAYS):
+        return None
+
+    crew_id = item.get('crewId')
+    if crew_id is not None and (isinstance(crew_id, bool) or not isinstance(crew_id, int)
+                                or not -2 ** 31 <= crew_id < 2 ** 31):
+        raise ValueError('crewId - целое число')
+    details = item.get('details')
+    if details is not None and not isinstance(details, str):
+        details = json.dumps(details, ensure_ascii=False)
+    if details is not None and '\x00' in details:
+        raise ValueError('details без символа NUL')
+    return (log_time, log_type, message, event_text(item, 'userId'), event_text(item, 'userName'),
+            crew_id, event_text(item, 'crewName'), details)
+
+
+def maintain(cur, force: bool = False) -> Optional[Any]:
+    '''
+    Обслуживание секций (activity_log_maintain из V0009): не чаще LOG_MAINTAIN_INTERVAL на процесс,
+    между процессами - advisory lock. force ждёт блокировку - когда без новой секции запись невозможна
+    Returns: {created, dropped}; None - пропущено по интервалу или блокировку держит другой процесс
+    '''
+    global _last_maintain
+    now = time.monotonic()
+    if not force and now - _last_maintain < LOG_MAINTAIN_INTERVAL:
+        return None
+    _last_maintain = now
+    if force:
+        cur.execute(f'SELECT {SCHEMA}.activity_log_maintain(%s) FROM (SELECT pg_advisory_xact_lock(%s)) l',
+                    (LOG_RETENTION_DAYS, LOG_MAINTAIN_LOCK_ID))
+    else:
+        cur.execute(f'SELECT CASE WHEN pg_try_advisory_xact_lock(%s) THEN {SCHEMA}.activity_log_maintain(%s) END',
+                    (LOG_MAINTAIN_LOCK_ID, LOG_RETENTION_DAYS))
+    result = cur.fetchone()[0]
+    if result:
+        print(f'[activity-log] maintain {json.dumps(result)}')
+    return result
+
+
+def copy_rows(cur, rows: List[Tuple]) -> None:
+    """Пакет строк одним COPY в CSV; строка попадает в секцию своего месяца"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    try:
+        buffer.seek(0)
+        cur.copy_expert(LOG_COPY_SQL, buffer)
+    except psycopg2.errors.CheckViolation:
+        # Нет секции под время события - обслуживания давно не было; создаём секции и повторяем
+        maintain(cur, force=True)
+        buffer.seek(0)
+        cur.copy_expert(LOG_COPY_SQL, buffer)
+
+
+@instrumented
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: API журнала действий
+    Args: event с httpMethod, body, queryStringParameters
+          POST {events: [...]} или одно событие - запись пакетом через COPY;
+          POST ?action=maintain - создать будущие и удалить устаревшие секции (для расписания);
+          GET ?from&to&type&user_id&limit&before_time&before_id - окно времени (по умолчанию сутки),
+          новые первыми, страницы по (before_time, before_id)
+    Returns: JSON {written, expired, rejected: [{index, error}]}, {created, dropped} или {logs, next};
+             одно событие без events при ошибке - 400
+    '''
+    method: str = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    params = event.get('queryStringParameters', {}) or {}
+
+    try:
+        with db_connection() as conn:
+            # COPY и запросы - отдельные statements, каждый атомарен сам по себе
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                return handle_request(cur, method, params, event)
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+
+def handle_request(cur, method: str, params: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    if method == 'POST':
+        if params.get('action') == 'maintain':
+            return json_response(200, json.dumps(maintain(cur, force=True)))
+
+        body = json.loads(event.get('body', '{}'))
+        items = body.get('events') if isinstance(body, dict) and 'events' in body else [body]
+        if not isinstance(items, list) or len(items) > LOG_MAX_BATCH:
+            return bad_request(f'events - список до {LOG_MAX_BATCH} событий')
+
+        # Некорректное событие пакета отклоняется само по себе, остальные записываются
+        single = not (isinstance(body, dict) and 'events' in body)
+        now = utc_now()
+        rows = []
+        rejected = []
+        for index, item in enumerate(items):
+            try:
+                row = parse_event(item, now)
+            except ValueError as e:
+                if single:
+                    return bad_request(str(e))
+                rejected.append({'index': index, 'error': str(e)})
+                continue
+            if row is not None:
+                rows.append(row)
+
+        if rows:
+            maintain(cur)
+            copy_rows(cur, rows)
+            cur.execute('SELECT pg_notify(%s, %s)', (CHANGES_CHANNEL, json.dumps(
+                {'entity': 'activity_log', 'id': None, 'count': len(rows)})))
+        return json_response(200, json.dumps({
+            'written': len(rows), 'expired': len(items) - len(rows) - len(rejected), 'rejected': rejected
+        }, ensure_ascii=False))
+
+    if method == 'GET':
+        try:
+            to_time = parse_time(params.get('to')) or utc_now()
+            from_time = parse_time(params.get('from')) or to_time - timedelta(hours=LOG_DEFAULT_WINDOW_HOURS)
+            before_time = parse_time(params.get('before_time'))
+            before_id = int(params['before_id']) if params.get('before_id') else None
+            limit = max(1, min(int(params.get('limit', LOG_DEFAULT_PAGE)), LOG_MAX_PAGE))
+        except ValueError:
+            return bad_request('from, to, before_time - ISO время; before_id и limit - числа')
+        if (before_time is None) != (before_id is None):
+            return bad_request('before_time и before_id передаются вместе')
+
+        # Окно времени подставляется литералами - лишние секции отсекаются ещё при планировании.
+        # Порядок (log_time, id) DESC совпадает с индексами: PK, (log_type, ...) и (user_id, ...)
+        cur.execute(f'''
+            WITH page AS (
+                SELECT l.*, row_number() OVER (ORDER BY l.log_time DESC, l.id DESC) AS n
+                FROM {SCHEMA}.activity_log l
+                WHERE l.log_time >= %(from)s AND l.log_time < %(to)s
+                  AND (%(type)s::text IS NULL OR l.log_type = %(type)s)
+                  AND (%(user_id)s::text IS NULL OR l.user_id = %(user_id)s)
+                  AND (%(before_id)s::bigint IS NULL OR (l.log_time, l.id) < (%(before_time)s, %(before_id)s))
+                ORDER BY l.log_time DESC, l.id DESC
+                LIMIT %(fetch)s
+            )
+            SELECT json_build_object(
+                'logs', COALESCE((
+                    SELECT json_agg(json_build_object(
+                        'id', p.id,
+                        'timestamp', p.log_time,
+                        'type', p.log_type,
+                        'userId', p.user_id,
+                        'userName', p.user_name,
+                        'crewId', p.crew_id,
+                        'crewName', p.crew_name,
+                        'description', p.message,
+                        'details', p.details
+                    ) ORDER BY p.log_time DESC, p.id DESC)
+                    FROM page p WHERE p.n <= %(limit)s
+                ), '[]'::json),
+                'next', (
+                    SELECT json_build_object('beforeTime', p.log_time, 'beforeId', p.id) FROM page p
+                    WHERE p.n = %(limit)s AND EXISTS (SELECT 1 FROM page WHERE n > %(limit)s)
+                )
+            )::text
+        ''', {'from': from_time, 'to': to_time, 'type': params.get('type') or None,
+              'user_id': params.get('user_id') or None, 'before_time': before_time, 'before_id': before_id,
+              'limit': limit, 'fetch': limit + 1})
+        return json_response(200, cur.fetchone()[0])
+
+    return json_response(405, json.dumps({'error': 'Метод не поддерживается'}))
+
+
+def warm_up() -> None:
+    '''
+    Подготовка экземпляра при импорте модуля, до первого запроса: пул открывает подключение
+    '''
+    started = time.perf_counter()
+    try:
+        with db_connection():
+            pass
+        print(f'[warm-up] {(time.perf_counter() - started) * 1000:.1f}ms')
+    except Exception as e:
+        print(f'[warm-up] skipped: {e}')
+
+
+if DB_WARMUP and os.environ.get('DATABASE_URL'):
+    warm_up()
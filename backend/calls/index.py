@@ -0,0 +1,665 @@
+"""
+Business: Очередь вызовов - список с фильтрами и страницами, создание, смена статуса и выдача следующего вызова юниту
+Args: event с httpMethod, body, queryStringParameters
+Returns: HTTP response с вызовами в JSON
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+CHANGES_CHANNEL = 'mdc_changes'
+CALLS_MAX_PAGE = 200
+CALLS_DEFAULT_PAGE = 50
+CALL_PRIORITIES = ('code99', 'code3', 'code2')
+CALL_STATUSES = ('pending', 'dispatched', 'completed')
+
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+FUNCTION_NAME = 'calls'
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') != '0'
+SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '0'))  # 0 - медленные запросы не логируются
+DB_WARMUP = os.environ.get('DB_WARMUP', '1') != '0'
+DB_PREPARE = os.environ.get('DB_PREPARE', '1') != '0'  # 0 - для пулеров в режиме транзакций
+
+SCHEMA = 't_p48049793_mobile_digital_compu'
+
+# Вызов в JSON - те же поля, что у Call во фронтенде
+CALL_JSON = '''json_build_object(
+    'id', c.id,
+    'callNumber', c.call_number,
+    'time', c.call_time,
+    'address', c.address,
+    'type', c.call_type,
+    'priority', c.priority,
+    'status', c.status,
+    'assignedCrewId', c.assigned_crew_id,
+    'completedAt', c.completed_at
+)'''
+
+# Горячие запросы: готовятся через PREPARE на каждом подключении пула и выполняются по имени.
+# Очередь ожидающих вызовов в порядке выдачи - по частичному индексу idx_calls_pending_queue
+CALLS_QUEUE_SQL = f'''
+    SELECT json_build_object('calls', COALESCE(json_agg({CALL_JSON} ORDER BY c.priority_rank DESC, c.call_time, c.id), '[]'::json))::text
+    FROM (
+        SELECT * FROM {SCHEMA}.calls
+        WHERE status = 'pending'
+        ORDER BY priority_rank DESC, call_time, id
+        LIMIT %s
+    ) c
+'''
+# Выдача следующего вызова: SKIP LOCKED - параллельные юниты не ждут друг друга и не получают один вызов
+CALLS_CLAIM_SQL = f'''
+    WITH next AS (
+        SELECT id FROM {SCHEMA}.calls
+        WHERE status = 'pending' AND priority_rank >= %s
+        ORDER BY priority_rank DESC, call_time, id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    ), c AS (
+        UPDATE {SCHEMA}.calls
+        SET status = 'dispatched', assigned_crew_id = %s
+        FROM next
+        WHERE calls.id = next.id
+        RETURNING calls.*
+    )
+    SELECT {CALL_JSON}::text, pg_notify(%s, json_build_object('entity', 'call', 'id', c.id)::text)
+    FROM c
+'''
+# имя: (SQL с плейсхолдерами psycopg2, типы параметров по порядку)
+PREPARED_STATEMENTS: Dict[str, Tuple[str, Tuple]] = {
+    'calls_queue': (CALLS_QUEUE_SQL, ('int',)),
+    'calls_claim': (CALLS_CLAIM_SQL, ('int', 'int', 'text')),
+}
+
+
+_request = threading.local()
+
+
+class RequestTimer:
+    '''
+    Замер одного вызова handler: время фаз connect / execute / fetch / serialize (мс) и число запросов к БД.
+    Текущий замер лежит в thread-local - пул и курсоры пишут в него без передачи через аргументы.
+    Имя функции и порог медленного запроса берутся из замера: в server/app.py курсор подключения
+    из общего пула принадлежит другому модулю
+    '''
+
+    def __init__(self, request_id: Optional[str]):
+        self.request_id = request_id
+        self.function = FUNCTION_NAME
+        self.slow_query_ms = SLOW_QUERY_MS
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {'connect': 0.0, 'execute': 0.0, 'fetch': 0.0, 'serialize': 0.0}
+        self.queries = 0
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] += seconds * 1000
+
+    def server_timing(self, total_ms: float) -> str:
+        metrics = [f'{name};dur={ms:.1f}' for name, ms in self.phases.items() if ms]
+        metrics.append(f'total;dur={total_ms:.1f}')
+        metrics.append(f'db;desc="{self.queries} queries"')
+        return ', '.join(metrics)
+
+
+@contextmanager
+def request_phase(phase: str) -> Iterator[None]:
+    """Добавляет время блока к фазе текущего запроса; вне handler ничего не делает"""
+    timer = getattr(_request, 'timer', None)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.add(phase, time.perf_counter() - started)
+
+
+def log_slow_query(query: Any, vars: Any, ms: float) -> None:
+    timer = getattr(_request, 'timer', None)
+    sql = query.decode(errors='replace') if isinstance(query, bytes) else str(query)
+    print(json.dumps({
+        'log': 'slow-query', 'function': timer.function if timer else FUNCTION_NAME,
+        'request_id': timer.request_id if timer else None,
+        'ms': round(ms, 1), 'sql': ' '.join(sql.split())[:2000], 'params': repr(vars)[:1000]
+    }, ensure_ascii=False))
+
+
+_timed_cursors: Dict[type, type] = {}
+
+
+def timed_cursor(factory: type) -> type:
+    """Подкласс курсора: execute/fetch идут в замер текущего запроса, медленные запросы - в лог"""
+    if factory not in _timed_cursors:
+        class TimedCursor(factory):
+            def execute(self, query, vars=None):
+                timer = getattr(_request, 'timer', None)
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    elapsed = time.perf_counter() - started
+                    if timer is not None:
+                        timer.queries += 1
+                        timer.add('execute', elapsed)
+                    threshold = timer.slow_query_ms if timer is not None else SLOW_QUERY_MS
+                    if threshold and elapsed * 1000 >= threshold:
+                        log_slow_query(query, vars, elapsed * 1000)
+
+            def copy_expert(self, sql, file, *args, **kwargs):
+                timer = getattr(_request, 'timer', None)
+                started = time.perf_counter()
+                try:
+                    return super().copy_expert(sql, file, *args, **kwargs)
+                finally:
+                    if timer is not None:
+                        timer.queries += 1
+                        timer.add('execute', time.perf_counter() - started)
+
+            def fetchone(self):
+                with request_phase('fetch'):
+                    return super().fetchone()
+
+            def fetchmany(self, *args, **kwargs):
+                with request_phase('fetch'):
+                    return super().fetchmany(*args, **kwargs)
+
+            def fetchall(self):
+                with request_phase('fetch'):
+                    return super().fetchall()
+
+        _timed_cursors[factory] = TimedCursor
+    return _timed_cursors[factory]
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    """Подключение пула: курсор с любым cursor_factory оборачивается в timed_cursor; prepared - имена PREPARE"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+        return super().cursor(*args, cursor_factory=timed_cursor(factory), **kwargs)
+
+
+def prepare_sql(name: str) -> str:
+    """Текст PREPARE для горячего запроса: плейсхолдеры psycopg2 заменяются на $1..$n"""
+    sql, params = PREPARED_STATEMENTS[name]
+    if params and isinstance(params[0], tuple):
+        placeholders: Any = {param: f'${i}' for i, (param, _) in enumerate(params, 1)}
+        types = [param_type for _, param_type in params]
+    else:
+        placeholders = tuple(f'${i}' for i in range(1, len(params) + 1))
+        types = list(params)
+    type_list = f" ({', '.join(types)})" if types else ''
+    return f'PREPARE {name}{type_list} AS {sql % placeholders}'
+
+
+def prepare_statements(conn) -> None:
+    '''
+    PREPARE всех горячих запросов на новом подключении пула, вне транзакции.
+    Ошибка (например, таблицы ещё нет) не мешает подключению - запрос подготовится при первом вызове
+    '''
+    if not DB_PREPARE:
+        return
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for name in PREPARED_STATEMENTS:
+                if name in conn.prepared:
+                    continue
+                try:
+                    cur.execute(prepare_sql(name))
+                    conn.prepared.add(name)
+                except psycopg2.ProgrammingError as e:
+                    print(f'[prepare] {name} postponed: {e}')
+    finally:
+        conn.autocommit = autocommit
+
+
+def execute_prepared(cur, name: str, args: Any) -> None:
+    '''
+    Горячий запрос по имени: EXECUTE name(...) вместо полного текста - Postgres не разбирает его заново,
+    а после нескольких вызовов берёт закэшированный generic-план.
+    При DB_PREPARE=0 или на подключении не из пула - обычным текстом
+    '''
+    sql, params = PREPARED_STATEMENTS[name]
+    prepared = getattr(cur.connection, 'prepared', None)
+    if not DB_PREPARE or prepared is None:
+        cur.execute(sql, args)
+        return
+    if name not in prepared:
+        cur.execute(prepare_sql(name))
+        prepared.add(name)
+    if isinstance(args, dict):
+        args = [args[param] for param, _ in params]
+    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(args))})" if args else f'EXECUTE {name}', args or None)
+
+
+def instrumented(func):
+    '''
+    Обёртка handler: замер фаз, заголовок Server-Timing в ответе и строка JSON-лога на каждый вызов
+    с request_id из context
+    '''
+    @functools.wraps(func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        timer = RequestTimer(getattr(context, 'request_id', None))
+        _request.timer = timer
+        response: Optional[Dict[str, Any]] = None
+        try:
+            response = func(event, context)
+            return response
+        finally:
+            _request.timer = None
+            total_ms = (time.perf_counter() - timer.started) * 1000
+            if response is not None:
+                headers = response.setdefault('headers', {})
+                headers['Server-Timing'] = timer.server_timing(total_ms)
+                headers['Timing-Allow-Origin'] = '*'
+                exposed = headers.get('Access-Control-Expose-Headers')
+                headers['Access-Control-Expose-Headers'] = f'{exposed}, Server-Timing' if exposed else 'Server-Timing'
+            if REQUEST_LOG:
+                print(json.dumps({
+                    'log': 'request', 'function': FUNCTION_NAME, 'request_id': timer.request_id,
+                    'method': event.get('httpMethod'), 'status': response.get('statusCode') if response else 500,
+                    'total_ms': round(total_ms, 1), 'queries': timer.queries,
+                    'cache': response.get('headers', {}).get('X-Cache') if response else None,
+                    **{f'{name}_ms': round(ms, 1) for name, ms in timer.phases.items()}
+                }))
+    return wrapper
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить подключение из пула за DB_POOL_TIMEOUT секунд"""
+
+
+class ConnectionPool:
+    '''
+    Пул подключений к БД, живущий на уровне модуля между тёплыми вызовами.
+    Функции деплоятся изолированно, поэтому пул есть в каждой из них.
+    Args: dsn - строка подключения, min_size/max_size - границы пула,
+          timeout - сколько ждать свободное подключение (сек),
+          ping_after - после скольких секунд простоя проверять подключение
+    '''
+
+    def __init__(self, dsn: str, min_size: int, max_size: int, timeout: float, ping_after: float):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._idle: List[Tuple[Any, float]] = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self.stats: Dict[str, float] = {
+            'created': 0, 'reused': 0, 'discarded': 0,
+            'waits': 0, 'wait_ms': 0.0, 'max_wait_ms': 0.0, 'timeouts': 0
+        }
+        for _ in range(min(self.min_size, self.max_size)):
+            self._size += 1
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory=TimedConnection)
+        prepare_statements(conn)
+        self.stats['created'] += 1
+        return conn
+
+    def _is_healthy(self, conn, idle_since: float) -> bool:
+        """Проверка подключения: дешёвая всегда, SELECT 1 - только после долгого простоя"""
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close_quietly(self, conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        started = time.monotonic()
+        while True:
+            with self._cond:
+                waited = False
+                while not self._idle and self._size >= self.max_size:
+                    waited = True
+                    remaining = self.timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        self.stats['timeouts'] += 1
+                        print(f'[db-pool] timeout after {self.timeout}s, stats={self.stats}')
+                        raise PoolTimeout(f'No free DB connection after {self.timeout}s')
+                    self._cond.wait(remaining)
+                if waited:
+                    wait_ms = (time.monotonic() - started) * 1000
+                    self.stats['waits'] += 1
+                    self.stats['wait_ms'] += wait_ms
+                    self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], wait_ms)
+                    print(f'[db-pool] waited {wait_ms:.1f}ms for connection, stats={self.stats}')
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                else:
+                    self._size += 1
+                    conn, idle_since = None, 0.0
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            if self._is_healthy(conn, idle_since):
+                self.stats['reused'] += 1
+                return conn
+
+            # Подключение умерло (рестарт БД, idle timeout) - выбрасываем и пробуем снова
+            self._close_quietly(conn)
+            with self._cond:
+                self._size -= 1
+                self.stats['discarded'] += 1
+                self._cond.notify()
+
+    def putconn(self, conn, broken: bool = False) -> None:
+        if not broken and not conn.closed:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+        with self._cond:
+            if broken or conn.closed:
+                self._close_quietly(conn)
+                self._size -= 1
+                self.stats['discarded'] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Ленивая инициализация пула при первом запросе"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                dsn = os.environ.get('DATABASE_URL')
+                if not dsn:
+                    raise ValueError('DATABASE_URL not set')
+                _pool = ConnectionPool(dsn, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_PING_AFTER)
+    return _pool
+
+
+@contextmanager
+def db_connection() -> Iterator[Any]:
+    """Подключение из пула; при сетевой ошибке подключение выбрасывается, а не возвращается в пул"""
+    with request_phase('connect'):
+        pool = get_pool()
+        conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        pool.putconn(conn, broken=broken)
+
+
+
+def bad_request(message: str) -> Dict[str, Any]:
+    return {
+        'statusCode': 400,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': message}),
+        'isBase64Encoded': False
+    }
+
+
+def json_response(status: int, body: str) -> Dict[str, Any]:
+    """Ответ с готовым JSON-текстом (собран в Postgres)"""
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+def priority_rank(priority: str) -> int:
+    """Ранг как в колонке calls.priority_rank (V0008)"""
+    return len(CALL_PRIORITIES) - CALL_PRIORITIES.index(priority)
+
+
+@instrumented
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: API очереди вызовов
+    Args: event с httpMethod, body, queryStringParameters
+          GET ?status&priority&unit_id&before_id&limit - история, новые первыми, страницы по id;
+          GET ?view=queue&limit - ожидающие вызовы в порядке выдачи;
+          POST {address, type, priority, callNumber?} - новый вызов;
+          POST ?action=claim {unitId, minPriority?} - выдать юниту следующий ожидающий вызов;
+          PUT {id, status?, assignedCrewId?} - смена статуса; DELETE ?id
+    Returns: JSON с вызовами
+    '''
+    method: str = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    params = event.get('queryStringParameters', {}) or {}
+
+    try:
+        with db_connection() as conn:
+            # Каждый запрос - один statement, отдельные BEGIN/COMMIT не нужны
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                return handle_request(cur, method, params, event)
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+
+def handle_request(cur, method: str, params: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    if method == 'GET':
+        try:
+            limit = max(1, min(int(params.get('limit', CALLS_DEFAULT_PAGE)), CALLS_MAX_PAGE))
+            unit_id = int(params['unit_id']) if params.get('unit_id') else None
+            before_id = int(params['before_id']) if params.get('before_id') else None
+        except ValueError:
+            return bad_request('limit, unit_id и before_id - числа')
+
+        if params.get('view') == 'queue':
+            execute_prepared(cur, 'calls_queue', (limit,))
+            return json_response(200, cur.fetchone()[0])
+
+        status = params.get('status') or None
+        priority = params.get('priority') or None
+        if status is not None and status not in CALL_STATUSES:
+            return bad_request(f"status - одно из: {', '.join(CALL_STATUSES)}")
+        if priority is not None and priority not in CALL_PRIORITIES:
+            return bad_request(f"priority - одно из: {', '.join(CALL_PRIORITIES)}")
+
+        # Фильтры подставляются литералами, и планировщик отбрасывает неиспользованные условия,
+        # поэтому этот запрос не готовится через PREPARE (generic-план не видит значений)
+        cur.execute(f'''
+            WITH page AS (
+                SELECT c.*, row_number() OVER (ORDER BY c.id DESC) AS n
+                FROM {SCHEMA}.calls c
+                WHERE (%(status)s::text IS NULL OR c.status = %(status)s)
+                  AND (%(priority)s::text IS NULL OR c.priority = %(priority)s)
+                  AND (%(unit_id)s::int IS NULL OR c.assigned_crew_id = %(unit_id)s)
+                  AND (%(before_id)s::int IS NULL OR c.id < %(before_id)s)
+                ORDER BY c.id DESC
+                LIMIT %(fetch)s
+            )
+            SELECT json_build_object(
+                'calls', COALESCE((
+                    SELECT json_agg({CALL_JSON} ORDER BY c.id DESC) FROM page c WHERE c.n <= %(limit)s
+                ), '[]'::json),
+                'nextBeforeId', (
+                    SELECT c.id FROM page c
+                    WHERE c.n = %(limit)s AND EXISTS (SELECT 1 FROM page WHERE n > %(limit)s)
+                )
+            )::text
+        ''', {'status': status, 'priority': priority, 'unit_id': unit_id, 'before_id': before_id,
+              'limit': limit, 'fetch': limit + 1})
+        return json_response(200, cur.fetchone()[0])
+
+    if method == 'POST':
+        body = json.loads(event.get('body', '{}'))
+
+        if params.get('action') == 'claim':
+            try:
+                unit_id = int(body.get('unitId'))
+            except (TypeError, ValueError):
+                return bad_request('Нужен числовой unitId')
+            min_priority = body.get('minPriority')
+            if min_priority is not None and min_priority not in CALL_PRIORITIES:
+                return bad_request(f"minPriority - одно из: {', '.join(CALL_PRIORITIES)}")
+
+            try:
+                execute_prepared(cur, 'calls_claim', (priority_rank(min_priority) if min_priority else 0,
+                                                      unit_id, CHANGES_CHANNEL))
+            except psycopg2.errors.ForeignKeyViolation:
+                return json_response(404, json.dumps({'error': 'Юнит не найден'}))
+            row = cur.fetchone()
+            # Очередь пуста - не ошибка: юнит просто остаётся свободным
+            return json_response(200, f'{{"call": {row[0] if row else "null"}}}')
+
+        address = body.get('address')
+        call_type = body.get('type')
+        priority = body.get('priority')
+        if not address or not call_type:
+            return bad_request('Нужны address и type')
+        if priority not in CALL_PRIORITIES:
+            return bad_request(f"priority - одно из: {', '.join(CALL_PRIORITIES)}")
+
+        # id берётся из последовательности заранее, чтобы номер вызова по умолчанию был C-<id>
+        call_number = body.get('callNumber') or None
+        try:
+            cur.execute(f'''
+                WITH n AS (
+                    SELECT nextval(pg_get_serial_sequence('{SCHEMA}.calls', 'id')) AS id
+                ), c AS (
+                    INSERT INTO {SCHEMA}.calls (id, call_number, address, call_type, priority)
+                    SELECT n.id, COALESCE(%s, 'C-' || n.id), %s, %s, %s FROM n
+                    RETURNING *
+                )
+                SELECT {CALL_JSON}::text, pg_notify(%s, json_build_object('entity', 'call', 'id', c.id)::text)
+                FROM c
+            ''', (call_number, address, call_type, priority, CHANGES_CHANNEL))
+        except psycopg2.errors.UniqueViolation:
+            return json_response(409, json.dumps({'error': 'Вызов с таким номером уже есть', 'callNumber': call_number}))
+        return json_response(201, cur.fetchone()[0])
+
+    if method == 'PUT':
+        body = json.loads(event.get('body', '{}'))
+        try:
+            call_id = int(body.get('id'))
+            crew_id = int(body['assignedCrewId']) if body.get('assignedCrewId') is not None else None
+        except (TypeError, ValueError):
+            return bad_request('Нужны числовые id и assignedCrewId')
+        status = body.get('status') or None
+        if status is not None and status not in CALL_STATUSES:
+            return bad_request(f"status - одно из: {', '.join(CALL_STATUSES)}")
+
+        # completed_at ставится при завершении и сбрасывается, если вызов вернули в работу
+        try:
+            cur.execute(f'''
+                WITH c AS (
+                    UPDATE {SCHEMA}.calls
+                    SET status = COALESCE(%s, status),
+                        assigned_crew_id = CASE WHEN %s THEN %s ELSE assigned_crew_id END,
+                        completed_at = CASE
+                            WHEN COALESCE(%s, status) = 'completed' THEN COALESCE(completed_at, CURRENT_TIMESTAMP)
+                        END
+                    WHERE id = %s
+                    RETURNING *
+                )
+                SELECT {CALL_JSON}::text, pg_notify(%s, json_build_object('entity', 'call', 'id', c.id)::text)
+                FROM c
+            ''', (status, 'assignedCrewId' in body, crew_id, status, call_id, CHANGES_CHANNEL))
+        except psycopg2.errors.ForeignKeyViolation:
+            return json_response(404, json.dumps({'error': 'Юнит не найден'}))
+        row = cur.fetchone()
+        if row is None:
+            return json_response(404, json.dumps({'error': 'Вызов не найден'}))
+        return json_response(200, row[0])
+
+    if method == 'DELETE':
+        try:
+            call_id = int(params.get('id'))
+        except (TypeError, ValueError):
+            return bad_request('Нужен числовой id')
+
+        cur.execute(f'''
+            WITH c AS (
+                DELETE FROM {SCHEMA}.calls WHERE id = %s RETURNING id
+            )
+            SELECT id, pg_notify(%s, json_build_object('entity', 'call', 'id', id)::text) FROM c
+        ''', (call_id, CHANGES_CHANNEL))
+        if cur.fetchone() is None:
+            return json_response(404, json.dumps({'error': 'Вызов не найден'}))
+        return json_response(200, json.dumps({'message': 'Вызов удалён'}))
+
+    return json_response(405, json.dumps({'error': 'Метод не поддерживается'}))
+
+
+def warm_up() -> None:
+    '''
+    Подготовка экземпляра при импорте модуля, до первого запроса: пул открывает подключение и готовит
+    на нём горячие запросы - PREPARE разбирает их, и бэкенд Postgres загружает метаданные calls
+    '''
+    started = time.perf_counter()
+    try:
+        with db_connection():
+            pass
+        print(f'[warm-up] {(time.perf_counter() - started) * 1000:.1f}ms')
+    except Exception as e:
+        print(f'[warm-up] skipped: {e}')
+
+
+if DB_WARMUP and os.environ.get('DATABASE_URL'):
+    warm_up()
@@ -4,24 +4,603 @@ Args: event с httpMethod, path, body, queryStringParameters
 Returns: HTTP response с данными онлайн-пользователей, смен или экипажей
 """
 
+import functools
 import json
 import os
-from datetime import datetime, timedelta
-from typing import Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Iterator, List, Optional, Tuple
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.extensions
 
-def get_db_connection():
-    """Получение подключения к БД"""
-    dsn = os.environ.get('DATABASE_URL')
-    if not dsn:
-        raise ValueError('DATABASE_URL not set')
-    return psycopg2.connect(dsn)
+CHANGES_CHANNEL = 'mdc_changes'
+ONLINE_TTL_SECONDS = int(os.environ.get('ONLINE_TTL_SECONDS', '10'))
+SWEEP_MIN_INTERVAL = float(os.environ.get('SWEEP_MIN_INTERVAL', '60'))
+SWEEP_LOCK_ID = 48049793
+HEARTBEAT_MIN_INTERVAL = float(os.environ.get('HEARTBEAT_MIN_INTERVAL', '3'))
+MAX_HEARTBEAT_BATCH = int(os.environ.get('MAX_HEARTBEAT_BATCH', '500'))
 
+# Запись heartbeat пропускается, если сохранённый моложе HEARTBEAT_MIN_INTERVAL и профиль не менялся
+HEARTBEAT_UPSERT_CONFLICT = f"""
+    ON CONFLICT (user_id)
+    DO UPDATE SET
+        full_name = EXCLUDED.full_name,
+        role = EXCLUDED.role,
+        email = EXCLUDED.email,
+        last_heartbeat = CURRENT_TIMESTAMP
+    WHERE online_users.last_heartbeat < CURRENT_TIMESTAMP - make_interval(secs => {HEARTBEAT_MIN_INTERVAL})
+       OR (online_users.full_name, online_users.role, online_users.email)
+          IS DISTINCT FROM (EXCLUDED.full_name, EXCLUDED.role, EXCLUDED.email)
+    RETURNING user_id, full_name, role, email, last_heartbeat
+"""
+
+# Горячие запросы: готовятся через PREPARE на каждом подключении пула и выполняются по имени
+USERS_LIST_SQL = """
+    SELECT COALESCE(json_agg(u ORDER BY u.last_heartbeat DESC), '[]')::text AS body
+    FROM (
+        SELECT user_id, full_name, role, email, last_heartbeat
+        FROM online_users
+        WHERE last_heartbeat >= CURRENT_TIMESTAMP - make_interval(secs => %s)
+    ) u
+"""
+HEARTBEAT_UPSERT_SQL = """
+    INSERT INTO online_users (user_id, full_name, role, email, last_heartbeat)
+    VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+""" + HEARTBEAT_UPSERT_CONFLICT
+SHIFTS_LIST_SQL = """
+    SELECT COALESCE(json_agg(s ORDER BY s.start_time DESC), '[]')::text AS body
+    FROM (
+        SELECT id, dispatcher_id, dispatcher_name, start_time, is_active
+        FROM dispatcher_shifts
+        WHERE is_active = TRUE
+    ) s
+"""
+ACTIVE_SHIFT_SQL = """
+    SELECT id FROM dispatcher_shifts
+    WHERE dispatcher_id = %s AND is_active = TRUE
+"""
+# имя: (SQL с плейсхолдерами psycopg2, типы параметров по порядку)
+PREPARED_STATEMENTS: Dict[str, Tuple[str, Tuple]] = {
+    'users_list': (USERS_LIST_SQL, ('int',)),
+    'heartbeat_upsert': (HEARTBEAT_UPSERT_SQL, ('text', 'text', 'text', 'text')),
+    'shifts_list': (SHIFTS_LIST_SQL, ()),
+    'active_shift': (ACTIVE_SHIFT_SQL, ('text',)),
+}
+
+# monotonic() отсчитывается от загрузки хоста: с 0.0 первая очистка на свежей машине получила бы 429
+_last_sweep = float('-inf')
+
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+FUNCTION_NAME = 'online-users'
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') != '0'
+SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '0'))  # 0 - медленные запросы не логируются
+DB_WARMUP = os.environ.get('DB_WARMUP', '1') != '0'
+DB_PREPARE = os.environ.get('DB_PREPARE', '1') != '0'  # 0 - для пулеров в режиме транзакций
+
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '16'))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', str(4 * 1024 * 1024)))
+# TTL кэша списков по ресурсам (сек): онлайн-список меняется чаще всего
+CACHE_TTLS = {'users': 0.3, 'shifts': 1.0, 'crews': 0.5}
+
+
+_request = threading.local()
+
+
+class RequestTimer:
+    '''
+    Замер одного вызова handler: время фаз connect / execute / fetch / serialize (мс) и число запросов к БД.
+    Текущий замер лежит в thread-local - пул и курсоры пишут в него без передачи через аргументы.
+    Имя функции и порог медленного запроса берутся из замера: в server/app.py курсор подключения
+    из общего пула принадлежит другому модулю
+    '''
+
+    def __init__(self, request_id: Optional[str]):
+        self.request_id = request_id
+        self.function = FUNCTION_NAME
+        self.slow_query_ms = SLOW_QUERY_MS
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {'connect': 0.0, 'execute': 0.0, 'fetch': 0.0, 'serialize': 0.0}
+        self.queries = 0
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] += seconds * 1000
+
+    def server_timing(self, total_ms: float) -> str:
+        metrics = [f'{name};dur={ms:.1f}' for name, ms in self.phases.items() if ms]
+        metrics.append(f'total;dur={total_ms:.1f}')
+        metrics.append(f'db;desc="{self.queries} queries"')
+        return ', '.join(metrics)
+
+
+@contextmanager
+def request_phase(phase: str) -> Iterator[None]:
+    """Добавляет время блока к фазе текущего запроса; вне handler ничего не делает"""
+    timer = getattr(_request, 'timer', None)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.add(phase, time.perf_counter() - started)
+
+
+def log_slow_query(query: Any, vars: Any, ms: float) -> None:
+    timer = getattr(_request, 'timer', None)
+    sql = query.decode(errors='replace') if isinstance(query, bytes) else str(query)
+    print(json.dumps({
+        'log': 'slow-query', 'function': timer.function if timer else FUNCTION_NAME,
+        'request_id': timer.request_id if timer else None,
+        'ms': round(ms, 1), 'sql': ' '.join(sql.split())[:2000], 'params': repr(vars)[:1000]
+    }, ensure_ascii=False))
+
+
+_timed_cursors: Dict[type, type] = {}
+
+
+def timed_cursor(factory: type) -> type:
+    """Подкласс курсора: execute/fetch идут в замер текущего запроса, медленные запросы - в лог"""
+    if factory not in _timed_cursors:
+        class TimedCursor(factory):
+            def execute(self, query, vars=None):
+                timer = getattr(_request, 'timer', None)
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    elapsed = time.perf_counter() - started
+                    if timer is not None:
+                        timer.queries += 1
+                        timer.add('execute', elapsed)
+                    threshold = timer.slow_query_ms if timer is not None else SLOW_QUERY_MS
+                    if threshold and elapsed * 1000 >= threshold:
+                        log_slow_query(query, vars, elapsed * 1000)
+
+            def copy_expert(self, sql, file, *args, **kwargs):
+                timer = getattr(_request, 'timer', None)
+                started = time.perf_counter()
+                try:
+                    return super().copy_expert(sql, file, *args, **kwargs)
+                finally:
+                    if timer is not None:
+                        timer.queries += 1
+                        timer.add('execute', time.perf_counter() - started)
+
+            def fetchone(self):
+                with request_phase('fetch'):
+                    return super().fetchone()
+
+            def fetchmany(self, *args, **kwargs):
+                with request_phase('fetch'):
+                    return super().fetchmany(*args, **kwargs)
+
+            def fetchall(self):
+                with request_phase('fetch'):
+                    return super().fetchall()
+
+        _timed_cursors[factory] = TimedCursor
+    return _timed_cursors[factory]
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    """Подключение пула: курсор с любым cursor_factory оборачивается в timed_cursor; prepared - имена PREPARE"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+        return super().cursor(*args, cursor_factory=timed_cursor(factory), **kwargs)
+
+
+def prepare_sql(name: str) -> str:
+    """Текст PREPARE для горячего запроса: плейсхолдеры psycopg2 заменяются на $1..$n"""
+    sql, params = PREPARED_STATEMENTS[name]
+    if params and isinstance(params[0], tuple):
+        placeholders: Any = {param: f'${i}' for i, (param, _) in enumerate(params, 1)}
+        types = [param_type for _, param_type in params]
+    else:
+        placeholders = tuple(f'${i}' for i in range(1, len(params) + 1))
+        types = list(params)
+    type_list = f" ({', '.join(types)})" if types else ''
+    return f'PREPARE {name}{type_list} AS {sql % placeholders}'
+
+
+def prepare_statements(conn) -> None:
+    '''
+    PREPARE всех горячих запросов на новом подключении пула, вне транзакции.
+    Ошибка (например, таблицы ещё нет) не мешает подключению - запрос подготовится при первом вызове
+    '''
+    if not DB_PREPARE:
+        return
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for name in PREPARED_STATEMENTS:
+                if name in conn.prepared:
+                    continue
+                try:
+                    cur.execute(prepare_sql(name))
+                    conn.prepared.add(name)
+                except psycopg2.ProgrammingError as e:
+                    print(f'[prepare] {name} postponed: {e}')
+    finally:
+        conn.autocommit = autocommit
+
+
+def execute_prepared(cur, name: str, args: Any) -> None:
+    '''
+    Горячий запрос по имени: EXECUTE name(...) вместо полного текста - Postgres не разбирает его заново,
+    а после нескольких вызовов берёт закэшированный generic-план.
+    При DB_PREPARE=0 или на подключении не из пула - обычным текстом
+    '''
+    sql, params = PREPARED_STATEMENTS[name]
+    prepared = getattr(cur.connection, 'prepared', None)
+    if not DB_PREPARE or prepared is None:
+        cur.execute(sql, args)
+        return
+    if name not in prepared:
+        cur.execute(prepare_sql(name))
+        prepared.add(name)
+    if isinstance(args, dict):
+        args = [args[param] for param, _ in params]
+    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(args))})" if args else f'EXECUTE {name}', args or None)
+
+
+def instrumented(func):
+    '''
+    Обёртка handler: замер фаз, заголовок Server-Timing в ответе и строка JSON-лога на каждый вызов
+    с request_id из context
+    '''
+    @functools.wraps(func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        timer = RequestTimer(getattr(context, 'request_id', None))
+        _request.timer = timer
+        response: Optional[Dict[str, Any]] = None
+        try:
+            response = func(event, context)
+            return response
+        finally:
+            _request.timer = None
+            total_ms = (time.perf_counter() - timer.started) * 1000
+            if response is not None:
+                headers = response.setdefault('headers', {})
+                headers['Server-Timing'] = timer.server_timing(total_ms)
+                headers['Timing-Allow-Origin'] = '*'
+                exposed = headers.get('Access-Control-Expose-Headers')
+                headers['Access-Control-Expose-Headers'] = f'{exposed}, Server-Timing' if exposed else 'Server-Timing'
+            if REQUEST_LOG:
+                print(json.dumps({
+                    'log': 'request', 'function': FUNCTION_NAME, 'request_id': timer.request_id,
+                    'method': event.get('httpMethod'), 'status': response.get('statusCode') if response else 500,
+                    'total_ms': round(total_ms, 1), 'queries': timer.queries,
+                    'cache': response.get('headers', {}).get('X-Cache') if response else None,
+                    **{f'{name}_ms': round(ms, 1) for name, ms in timer.phases.items()}
+                }))
+    return wrapper
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить подключение из пула за DB_POOL_TIMEOUT секунд"""
+
+
+class ConnectionPool:
+    '''
+    Пул подключений к БД, живущий на уровне модуля между тёплыми вызовами.
+    Функции деплоятся изолированно, поэтому пул есть в каждой из них.
+    Args: dsn - строка подключения, min_size/max_size - границы пула,
+          timeout - сколько ждать свободное подключение (сек),
+          ping_after - после скольких секунд простоя проверять подключение
+    '''
+
+    def __init__(self, dsn: str, min_size: int, max_size: int, timeout: float, ping_after: float):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._idle: List[Tuple[Any, float]] = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self.stats: Dict[str, float] = {
+            'created': 0, 'reused': 0, 'discarded': 0,
+            'waits': 0, 'wait_ms': 0.0, 'max_wait_ms': 0.0, 'timeouts': 0
+        }
+        for _ in range(min(self.min_size, self.max_size)):
+            self._size += 1
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory=TimedConnection)
+        prepare_statements(conn)
+        self.stats['created'] += 1
+        return conn
+
+    def _is_healthy(self, conn, idle_since: float) -> bool:
+        """Проверка подключения: дешёвая всегда, SELECT 1 - только после долгого простоя"""
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close_quietly(self, conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        started = time.monotonic()
+        while True:
+            with self._cond:
+                waited = False
+                while not self._idle and self._size >= self.max_size:
+                    waited = True
+                    remaining = self.timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        self.stats['timeouts'] += 1
+                        print(f'[db-pool] timeout after {self.timeout}s, stats={self.stats}')
+                        raise PoolTimeout(f'No free DB connection after {self.timeout}s')
+                    self._cond.wait(remaining)
+                if waited:
+                    wait_ms = (time.monotonic() - started) * 1000
+                    self.stats['waits'] += 1
+                    self.stats['wait_ms'] += wait_ms
+                    self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], wait_ms)
+                    print(f'[db-pool] waited {wait_ms:.1f}ms for connection, stats={self.stats}')
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                else:
+                    self._size += 1
+                    conn, idle_since = None, 0.0
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            if self._is_healthy(conn, idle_since):
+                self.stats['reused'] += 1
+                return conn
+
+            # Подключение умерло (рестарт БД, idle timeout) - выбрасываем и пробуем снова
+            self._close_quietly(conn)
+            with self._cond:
+                self._size -= 1
+                self.stats['discarded'] += 1
+                self._cond.notify()
+
+    def putconn(self, conn, broken: bool = False) -> None:
+        if not broken and not conn.closed:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+        with self._cond:
+            if broken or conn.closed:
+                self._close_quietly(conn)
+                self._size -= 1
+                self.stats['discarded'] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Ленивая инициализация пула при первом запросе"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                dsn = os.environ.get('DATABASE_URL')
+                if not dsn:
+                    raise ValueError('DATABASE_URL not set')
+                _pool = ConnectionPool(dsn, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_PING_AFTER)
+    return _pool
+
+
+@contextmanager
+def db_connection() -> Iterator[Any]:
+    """Подключение из пула; при сетевой ошибке подключение выбрасывается, а не возвращается в пул"""
+    with request_phase('connect'):
+        pool = get_pool()
+        conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        pool.putconn(conn, broken=broken)
+
+
+class ResponseCache:
+    '''
+    Ограниченный LRU-кэш ответов на чтение внутри тёплого процесса.
+    Запись в том же процессе сбрасывает затронутые ключи, остальные процессы догоняют по TTL.
+    Чтение берёт generation() до запроса к БД и передаёт его в put: если запись сбросила ключ,
+    пока шёл запрос, прочитанная до неё строка в кэш не попадёт
+    Args: max_entries - предел числа записей, max_bytes - предел суммарного размера значений
+    '''
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[Tuple, Tuple[float, int, Any]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Поколение - счётчик сбросов; префикс -> поколение его последнего сброса.
+        # Словарь ограничен: при переполнении он очищается, а все чтения, начатые раньше, считаются устаревшими
+        self._generation = 0
+        self._invalidated: Dict[Tuple, int] = {}
+        self._floor = 0
+        self.stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'stale_puts': 0}
+
+    def get(self, key: Tuple) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[2]
+
+    def generation(self) -> int:
+        """Текущее поколение - берётся до запроса к БД, результат которого пойдёт в put"""
+        with self._lock:
+            return self._generation
+
+    def put(self, key: Tuple, value: Any, size: int, ttl: float, generation: Optional[int] = None) -> None:
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and self._invalidated_since(key, generation):
+                self.stats['stale_puts'] += 1
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+    def invalidate(self, *prefix: Any) -> None:
+        """Сброс всех записей, ключ которых начинается с prefix; идущие чтения prefix устаревают"""
+        with self._lock:
+            self._generation += 1
+            if len(self._invalidated) >= self.max_entries:
+                self._invalidated.clear()
+                self._floor = self._generation
+            self._invalidated[prefix] = self._generation
+            for key in [k for k in self._entries if k[:len(prefix)] == prefix]:
+                self._drop(key)
+                self.stats['invalidations'] += 1
+
+    def _invalidated_since(self, key: Tuple, generation: int) -> bool:
+        """Сбрасывался ли key или любой его префикс после поколения generation"""
+        if generation < self._floor:
+            return True
+        return any(self._invalidated.get(key[:i], -1) > generation for i in range(len(key) + 1))
+
+    def _drop(self, key: Tuple) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+_cache = ResponseCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
+
+
+class SingleFlight:
+    '''
+    Схлопывание одинаковых одновременных чтений внутри процесса: первый запрос с ключом
+    выполняет загрузку, остальные с тем же ключом ждут её результат (или исключение)
+    вместо собственного подключения и запроса к БД.
+    Запись отвязывает идущие чтения через forget - пришедшие после неё запросы начнут новое
+    '''
+
+    def __init__(self):
+        self._flights: Dict[Tuple, '_Flight'] = {}
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {'leaders': 0, 'coalesced': 0, 'errors': 0}
+
+    def do(self, key: Tuple, load: Callable[[], Any]) -> Tuple[Any, bool]:
+        '''
+        Returns: (результат load, True - если результат получен от чужого запроса)
+        '''
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            self.stats['leaders' if leader else 'coalesced'] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            flight.result = load()
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            self.stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    def forget(self, *prefix: Any) -> None:
+        """Отвязка идущих чтений, ключ которых начинается с prefix; ждущие их запросы получат результат"""
+        with self._lock:
+            for key in [k for k in self._flights if k[:len(prefix)] == prefix]:
+                del self._flights[key]
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+_flights = SingleFlight()
+
+
+def invalidate(*prefix: Any) -> None:
+    """После записи: сброс кэша и отвязка чтений, начатых до неё"""
+    _cache.invalidate(*prefix)
+    _flights.forget(*prefix)
+
+
+def dumps(obj: Any) -> str:
+    """Сериализация ответов-строк, которые собираются в Python; даты - в ISO, как у json из Postgres"""
+    with request_phase('serialize'):
+        return json.dumps(obj, default=lambda o: o.isoformat() if hasattr(o, 'isoformat') else str(o))
+
+
+def notify_change(cur, entity: str, entity_id: Any) -> None:
+    """NOTIFY для long-poll подписчиков функции storage; уходит вместе с коммитом"""
+    cur.execute("SELECT pg_notify(%s, %s)", (CHANGES_CHANNEL, json.dumps({'entity': entity, 'id': entity_id})))
+
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     params = event.get('queryStringParameters', {}) or {}
-    resource = params.get('resource', 'users')  # 'users', 'shifts' или 'crews'
+    resource = params.get('resource', 'users')  # 'users', 'shifts', 'crews' или 'sweep'
     
     # CORS preflight
     if method == 'OPTIONS':
@@ -37,44 +616,115 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    if method == 'GET' and resource in CACHE_TTLS:
+        cached = _cache.get(('list', resource))
+        if cached is not None:
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'X-Cache': 'HIT'},
+                'body': cached,
+                'isBase64Encoded': False
+            }
+    
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+        if method == 'GET' and resource in CACHE_TTLS:
+            # Промах при всплеске одинаковых опросов: один запрос к БД на процесс, остальные ждут его ответ.
+            # Общий ответ копируется - заголовки каждого запроса дописываются отдельно
+            response, shared = _flights.do(('list', resource), lambda: read_list(resource, params, event))
+            headers = dict(response['headers'])
+            if shared:
+                headers['X-Cache'] = 'COALESCED'
+            return dict(response, headers=headers)
+        with db_connection() as conn:
+            return handle_resource(conn, method, resource, params, event)
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+
+def read_list(resource: str, params: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    """GET списка ресурса из CACHE_TTLS на подключении из пула"""
+    with db_connection() as conn:
+        return handle_resource(conn, 'GET', resource, params, event)
+
+
+def cached_list(resource: str, body: str, generation: int) -> Dict[str, Any]:
+    '''
+    Ответ со списком ресурса; тело кладётся в кэш процесса на CACHE_TTLS[resource],
+    если с поколения generation (взятого до запроса) список не сбрасывала запись
+    '''
+    _cache.put(('list', resource), body, len(body), CACHE_TTLS[resource], generation)
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'X-Cache': 'MISS'
+        },
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+def handle_resource(conn, method: str, resource: str, params: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    # psycopg2.extras (+logging) уже загружен в warm_up; без warm-up - здесь, на первом запросе
+    from psycopg2.extras import RealDictCursor
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
         
         # ===== ОНЛАЙН ПОЛЬЗОВАТЕЛИ =====
         if resource == 'users':
             # GET - получить всех онлайн пользователей
+            # Устаревшие записи не удаляются здесь, а отфильтровываются по idx_online_users_heartbeat;
+            # чистка - отдельный resource=sweep
+            # Списки собираются в JSON на стороне Postgres и отдаются текстом без разбора в Python
             if method == 'GET':
-                cutoff_time = datetime.now() - timedelta(seconds=10)
-                cur.execute(
-                    "DELETE FROM online_users WHERE last_heartbeat < %s",
-                    (cutoff_time,)
-                )
-                conn.commit()
-                
-                cur.execute("""
-                    SELECT user_id, full_name, role, email, last_heartbeat
-                    FROM online_users
-                    ORDER BY last_heartbeat DESC
-                """)
-                users = cur.fetchall()
+                generation = _cache.generation()
+                execute_prepared(cur, 'users_list', (ONLINE_TTL_SECONDS,))
                 
-                cur.close()
-                conn.close()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps([dict(u) for u in users], default=str),
-                    'isBase64Encoded': False
-                }
+                return cached_list('users', cur.fetchone()['body'], generation)
             
             # POST - добавить/обновить пользователя (heartbeat)
             if method == 'POST':
                 body_data = json.loads(event.get('body', '{}'))
+                
+                # Пакет heartbeat-ов {heartbeats: [{user_id, full_name, role, email}, ...]} одним INSERT
+                if 'heartbeats' in body_data:
+                    heartbeats = body_data['heartbeats']
+                    fields = ('user_id', 'full_name', 'role', 'email')
+                    if (not isinstance(heartbeats, list) or len(heartbeats) > MAX_HEARTBEAT_BATCH
+                            or not all(isinstance(h, dict) and all(h.get(f) for f in fields) for h in heartbeats)):
+                        return {
+                            'statusCode': 400,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': f'heartbeats must be a list of up to {MAX_HEARTBEAT_BATCH} complete entries'}),
+                            'isBase64Encoded': False
+                        }
+                    
+                    # Одна строка не может обновиться дважды в одном INSERT - оставляем последний heartbeat
+                    latest = {h['user_id']: tuple(h[f] for f in fields) for h in heartbeats}
+                    written = []
+                    if latest:
+                        from psycopg2.extras import execute_values
+                        written = execute_values(cur, """
+                            INSERT INTO online_users (user_id, full_name, role, email, last_heartbeat)
+                            VALUES %s
+                        """ + HEARTBEAT_UPSERT_CONFLICT, list(latest.values()),
+                            template='(%s, %s, %s, %s, CURRENT_TIMESTAMP)', page_size=MAX_HEARTBEAT_BATCH, fetch=True)
+                    conn.commit()
+                    if written:
+                        invalidate('list', 'users')
+                    
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'written': len(written), 'skipped': len(latest) - len(written)}),
+                        'isBase64Encoded': False
+                    }
+                
                 user_id = body_data.get('user_id')
                 full_name = body_data.get('full_name')
                 role = body_data.get('role')
@@ -88,22 +738,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                cur.execute("""
-                    INSERT INTO online_users (user_id, full_name, role, email, last_heartbeat)
-                    VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
-                    ON CONFLICT (user_id)
-                    DO UPDATE SET
-                        full_name = EXCLUDED.full_name,
-                        role = EXCLUDED.role,
-                        email = EXCLUDED.email,
-                        last_heartbeat = CURRENT_TIMESTAMP
-                    RETURNING user_id, full_name, role, email, last_heartbeat
-                """, (user_id, full_name, role, email))
+                execute_prepared(cur, 'heartbeat_upsert', (user_id, full_name, role, email))
                 
+                # Нет строки - запись пропущена: свежий heartbeat уже сохранён
                 result = cur.fetchone()
                 conn.commit()
-                cur.close()
-                conn.close()
+                if result is None:
+                    result = {'user_id': user_id, 'full_name': full_name, 'role': role, 'email': email, 'skipped': True}
+                else:
+                    result = dict(result, skipped=False)
+                    invalidate('list', 'users')
                 
                 return {
                     'statusCode': 200,
@@ -111,7 +755,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps(dict(result), default=str),
+                    'body': dumps(result),
                     'isBase64Encoded': False
                 }
             
@@ -129,8 +773,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 cur.execute("DELETE FROM online_users WHERE user_id = %s", (user_id,))
                 conn.commit()
-                cur.close()
-                conn.close()
+                invalidate('list', 'users')
                 
                 return {
                     'statusCode': 200,
@@ -142,30 +785,64 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
         
+        # ===== ЧИСТКА УСТАРЕВШИХ ОНЛАЙН ПОЛЬЗОВАТЕЛЕЙ =====
+        # Вызывается по таймеру; не чаще SWEEP_MIN_INTERVAL в процессе и одним процессом за раз
+        if resource == 'sweep':
+            # Удаление - только POST: GET из браузера или предзагрузки не должен чистить таблицу
+            if method != 'POST':
+                return {
+                    'statusCode': 405,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*',
+                                'Allow': 'POST'},
+                    'body': json.dumps({'error': 'Sweep requires POST'}),
+                    'isBase64Encoded': False
+                }
+            global _last_sweep
+            now = time.monotonic()
+            if now - _last_sweep < SWEEP_MIN_INTERVAL:
+                retry_after = int(SWEEP_MIN_INTERVAL - (now - _last_sweep)) + 1
+                return {
+                    'statusCode': 429,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*',
+                                'Retry-After': str(retry_after)},
+                    'body': json.dumps({'error': 'Sweep rate limited', 'retry_after': retry_after}),
+                    'isBase64Encoded': False
+                }
+            _last_sweep = now
+            
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s) AS locked", (SWEEP_LOCK_ID,))
+            if not cur.fetchone()['locked']:
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'deleted': 0, 'skipped': True}),
+                    'isBase64Encoded': False
+                }
+            
+            cur.execute("""
+                DELETE FROM online_users
+                WHERE last_heartbeat < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            """, (ONLINE_TTL_SECONDS,))
+            deleted = cur.rowcount
+            conn.commit()
+            if deleted:
+                invalidate('list', 'users')
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'deleted': deleted, 'skipped': False}),
+                'isBase64Encoded': False
+            }
+        
         # ===== СМЕНЫ ДИСПЕТЧЕРОВ =====
         if resource == 'shifts':
             # GET - получить активные смены
             if method == 'GET':
-                cur.execute("""
-                    SELECT id, dispatcher_id, dispatcher_name, start_time, is_active
-                    FROM dispatcher_shifts
-                    WHERE is_active = TRUE
-                    ORDER BY start_time DESC
-                """)
-                shifts = cur.fetchall()
-                
-                cur.close()
-                conn.close()
+                generation = _cache.generation()
+                execute_prepared(cur, 'shifts_list', ())
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps([dict(s) for s in shifts], default=str),
-                    'isBase64Encoded': False
-                }
+                return cached_list('shifts', cur.fetchone()['body'], generation)
             
             # POST - начать смену
             if method == 'POST':
@@ -182,16 +859,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     }
                 
                 # Проверяем, есть ли уже активная смена
-                cur.execute("""
-                    SELECT id FROM dispatcher_shifts
-                    WHERE dispatcher_id = %s AND is_active = TRUE
-                """, (dispatcher_id,))
+                execute_prepared(cur, 'active_shift', (dispatcher_id,))
                 
                 existing = cur.fetchone()
                 
                 if existing:
-                    cur.close()
-                    conn.close()
                     return {
                         'statusCode': 200,
                         'headers': {
@@ -210,9 +882,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 """, (dispatcher_id, dispatcher_name))
                 
                 result = cur.fetchone()
+                notify_change(cur, 'shift', dispatcher_id)
                 conn.commit()
-                cur.close()
-                conn.close()
+                invalidate('list', 'shifts')
                 
                 return {
                     'statusCode': 200,
@@ -220,7 +892,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps(dict(result), default=str),
+                    'body': dumps(dict(result)),
                     'isBase64Encoded': False
                 }
             
@@ -242,9 +914,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     WHERE dispatcher_id = %s AND is_active = TRUE
                 """, (dispatcher_id,))
                 
+                if cur.rowcount == 0:
+                    conn.rollback()
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Active shift not found'}),
+                        'isBase64Encoded': False
+                    }
+                
+                notify_change(cur, 'shift', dispatcher_id)
                 conn.commit()
-                cur.close()
-                conn.close()
+                invalidate('list', 'shifts')
                 
                 return {
                     'statusCode': 200,
@@ -260,25 +941,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if resource == 'crews':
             # GET - получить все экипажи
             if method == 'GET':
+                generation = _cache.generation()
                 cur.execute("""
-                    SELECT id, unit_name, status, location, last_update
-                    FROM t_p48049793_mobile_digital_compu.crews
-                    ORDER BY unit_name
+                    SELECT COALESCE(json_agg(c ORDER BY c.unit_name), '[]')::text AS body
+                    FROM (
+                        SELECT id, unit_name, status, location, last_update
+                        FROM t_p48049793_mobile_digital_compu.units
+                    ) c
                 """)
-                crews = cur.fetchall()
-                
-                cur.close()
-                conn.close()
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps([dict(c) for c in crews], default=str),
-                    'isBase64Encoded': False
-                }
+                return cached_list('crews', cur.fetchone()['body'], generation)
             
             # POST - создать новый экипаж
             if method == 'POST':
@@ -296,16 +968,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     }
                 
                 cur.execute("""
-                    INSERT INTO t_p48049793_mobile_digital_compu.crews 
+                    INSERT INTO t_p48049793_mobile_digital_compu.units 
                     (unit_name, status, location, last_update)
                     VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
                     RETURNING id, unit_name, status, location, last_update
                 """, (unit_name, status, location))
                 
                 result = cur.fetchone()
+                # Экипажи и юниты - одна таблица, подписчики слушают 'unit'
+                notify_change(cur, 'unit', result['id'])
                 conn.commit()
-                cur.close()
-                conn.close()
+                invalidate('list', 'crews')
                 
                 return {
                     'statusCode': 201,
@@ -313,7 +986,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps(dict(result), default=str),
+                    'body': dumps(dict(result)),
                     'isBase64Encoded': False
                 }
             
@@ -347,17 +1020,26 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 params_list.append(crew_id)
                 
                 query = f"""
-                    UPDATE t_p48049793_mobile_digital_compu.crews
+                    UPDATE t_p48049793_mobile_digital_compu.units
                     SET {', '.join(update_fields)}
                     WHERE id = %s
                     RETURNING id, unit_name, status, location, last_update
                 """
                 
+                # Смену статуса/location в историю и сводки пишет триггер units_status_track (V0012)
                 cur.execute(query, params_list)
                 result = cur.fetchone()
+                if result is None:
+                    conn.rollback()
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Crew not found'}),
+                        'isBase64Encoded': False
+                    }
+                notify_change(cur, 'unit', crew_id)
                 conn.commit()
-                cur.close()
-                conn.close()
+                invalidate('list', 'crews')
                 
                 return {
                     'statusCode': 200,
@@ -365,7 +1047,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps(dict(result), default=str),
+                    'body': dumps(dict(result)),
                     'isBase64Encoded': False
                 }
         
@@ -375,11 +1057,24 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Method not allowed'}),
             'isBase64Encoded': False
         }
-        
+
+
+def warm_up() -> None:
+    '''
+    Подготовка экземпляра при импорте модуля, до первого запроса: пул открывает подключение и готовит
+    на нём горячие запросы - PREPARE разбирает их, и бэкенд Postgres загружает метаданные таблиц
+    '''
+    started = time.perf_counter()
+    try:
+        # RealDictCursor нужен каждому запросу: psycopg2.extras грузится здесь, а не на первом запросе.
+        # Без warm-up импорт остаётся отложенным до handle_resource
+        import psycopg2.extras  # noqa: F401
+        with db_connection():
+            pass
+        print(f'[warm-up] {(time.perf_counter() - started) * 1000:.1f}ms')
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
\ No newline at end of file
+        print(f'[warm-up] skipped: {e}')
+
+
+if DB_WARMUP and os.environ.get('DATABASE_URL'):
+    warm_up()
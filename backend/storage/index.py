@@ -1,12 +1,712 @@
+import base64
+import functools
 import json
 import os
+import selectors
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Iterator, List, Optional, Tuple
 import psycopg2
-from typing import Dict, Any, Optional
+import psycopg2.errors
+import psycopg2.extensions
 
+MAX_BATCH_KEYS = int(os.environ.get('STORAGE_MAX_BATCH_KEYS', '100'))
+MAX_PATCH_OPS = int(os.environ.get('STORAGE_MAX_PATCH_OPS', '50'))
+SCAN_PAGE_SIZE = 100
+MAX_SCAN_PAGE = int(os.environ.get('STORAGE_MAX_SCAN_PAGE', '500'))
+# Записи берут номер версии под разделяемой advisory-блокировкой до коммита. Обход по префиксу читает
+# последний номер, только если получил исключительную без ожидания (scan_safe_version): тогда все записи
+# с номерами не больше него закоммичены, и nextSince не пропускает запись, получившую номер раньше,
+# а закоммиченную позже
+STORAGE_VERSION_LOCK_ID = 48049795
+SCAN_SAFE_POINT_TRIES = 5
+SCAN_SAFE_POINT_RETRY = 0.005  # сек между попытками - записи короче
+CHANGES_CHANNEL = 'mdc_changes'
+LONG_POLL_TIMEOUT = float(os.environ.get('LONG_POLL_TIMEOUT', '25'))
+CHANGE_FEED_BUFFER = 1000
+
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+FUNCTION_NAME = 'storage'
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') != '0'
+SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '0'))  # 0 - медленные запросы не логируются
+DB_WARMUP = os.environ.get('DB_WARMUP', '1') != '0'
+DB_PREPARE = os.environ.get('DB_PREPARE', '1') != '0'  # 0 - для пулеров в режиме транзакций
+
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '256'))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+CACHE_TTL = float(os.environ.get('STORAGE_CACHE_TTL_MS', '300')) / 1000
+
+# Ответы длиннее порога сжимаются по Accept-Encoding клиента: br, если установлен brotli, иначе gzip
+COMPRESS_MIN_BYTES = int(os.environ.get('STORAGE_COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_GZIP_LEVEL = 6
+COMPRESS_BROTLI_QUALITY = 5
+# Тело ответа для версии ключа не меняется, поэтому сжатое живёт в кэше дольше значения
+COMPRESS_CACHE_TTL = 30
+
+# Горячие запросы: готовятся через PREPARE на каждом подключении пула и выполняются по имени
+SQL_GET_KEY = '''
+    SELECT version, CASE WHEN version = %s THEN NULL ELSE value::text END
+    FROM mdc_storage WHERE key = %s
+'''
+SQL_SET_KEY = f'''
+    WITH up AS (
+        INSERT INTO mdc_storage (key, value, updated_at)
+        SELECT %s::text, %s::jsonb, CURRENT_TIMESTAMP
+        FROM (SELECT pg_advisory_xact_lock_shared({STORAGE_VERSION_LOCK_ID})) l
+        ON CONFLICT (key) DO UPDATE 
+        SET value = EXCLUDED.value, updated_at = CURRENT_TIMESTAMP,
+            version = nextval('mdc_storage_version_seq')
+        RETURNING key, version
+    )
+    SELECT version, pg_notify(%s, json_build_object(
+        'entity', 'storage', 'id', key, 'version', version)::text)
+    FROM up
+'''
+# Страница ключей с префиксом по индексу text_pattern_ops (V0013): диапазон [prefix, upper) побайтово,
+# продолжение после after - keyset, без OFFSET. Без value запрос читает только индекс (index-only scan)
+SQL_SCAN_PREFIX = '''
+    SELECT key, version{value}
+    FROM mdc_storage
+    WHERE key ~>=~ %(prefix)s AND key ~<~ %(upper)s AND key ~>~ %(after)s AND version > %(since)s
+    ORDER BY key USING ~<~
+    LIMIT %(limit)s
+'''
+SCAN_PARAMS = (('prefix', 'text'), ('upper', 'text'), ('after', 'text'), ('since', 'bigint'), ('limit', 'int'))
+# имя: (SQL с плейсхолдерами psycopg2, типы параметров по порядку)
+PREPARED_STATEMENTS: Dict[str, Tuple[str, Tuple]] = {
+    'mdc_get_key': (SQL_GET_KEY, ('bigint', 'text')),
+    'mdc_set_key': (SQL_SET_KEY, ('text', 'jsonb', 'text')),
+    'mdc_scan_keys': (SQL_SCAN_PREFIX.format(value=''), SCAN_PARAMS),
+    'mdc_scan_values': (SQL_SCAN_PREFIX.format(value=', value::text'), SCAN_PARAMS),
+}
+
+
+_request = threading.local()
+
+
+class RequestTimer:
+    '''
+    Замер одного вызова handler: время фаз connect / execute / fetch / serialize (мс) и число запросов к БД.
+    Текущий замер лежит в thread-local - пул и курсоры пишут в него без передачи через аргументы.
+    Имя функции и порог медленного запроса берутся из замера: в server/app.py курсор подключения
+    из общего пула принадлежит другому модулю
+    '''
+
+    def __init__(self, request_id: Optional[str]):
+        self.request_id = request_id
+        self.function = FUNCTION_NAME
+        self.slow_query_ms = SLOW_QUERY_MS
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {'connect': 0.0, 'execute': 0.0, 'fetch': 0.0, 'serialize': 0.0}
+        self.queries = 0
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] += seconds * 1000
+
+    def server_timing(self, total_ms: float) -> str:
+        metrics = [f'{name};dur={ms:.1f}' for name, ms in self.phases.items() if ms]
+        metrics.append(f'total;dur={total_ms:.1f}')
+        metrics.append(f'db;desc="{self.queries} queries"')
+        return ', '.join(metrics)
+
+
+@contextmanager
+def request_phase(phase: str) -> Iterator[None]:
+    """Добавляет время блока к фазе текущего запроса; вне handler ничего не делает"""
+    timer = getattr(_request, 'timer', None)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.add(phase, time.perf_counter() - started)
+
+
+def log_slow_query(query: Any, vars: Any, ms: float) -> None:
+    timer = getattr(_request, 'timer', None)
+    sql = query.decode(errors='replace') if isinstance(query, bytes) else str(query)
+    print(json.dumps({
+        'log': 'slow-query', 'function': timer.function if timer else FUNCTION_NAME,
+        'request_id': timer.request_id if timer else None,
+        'ms': round(ms, 1), 'sql': ' '.join(sql.split())[:2000], 'params': repr(vars)[:1000]
+    }, ensure_ascii=False))
+
+
+_timed_cursors: Dict[type, type] = {}
+
+
+def timed_cursor(factory: type) -> type:
+    """Подкласс курсора: execute/fetch идут в замер текущего запроса, медленные запросы - в лог"""
+    if factory not in _timed_cursors:
+        class TimedCursor(factory):
+            def execute(self, query, vars=None):
+                timer = getattr(_request, 'timer', None)
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    elapsed = time.perf_counter() - started
+                    if timer is not None:
+                        timer.queries += 1
+                        timer.add('execute', elapsed)
+                    threshold = timer.slow_query_ms if timer is not None else SLOW_QUERY_MS
+                    if threshold and elapsed * 1000 >= threshold:
+                        log_slow_query(query, vars, elapsed * 1000)
+
+            def copy_expert(self, sql, file, *args, **kwargs):
+                timer = getattr(_request, 'timer', None)
+                started = time.perf_counter()
+                try:
+                    return super().copy_expert(sql, file, *args, **kwargs)
+                finally:
+                    if timer is not None:
+                        timer.queries += 1
+                        timer.add('execute', time.perf_counter() - started)
+
+            def fetchone(self):
+                with request_phase('fetch'):
+                    return super().fetchone()
+
+            def fetchmany(self, *args, **kwargs):
+                with request_phase('fetch'):
+                    return super().fetchmany(*args, **kwargs)
+
+            def fetchall(self):
+                with request_phase('fetch'):
+                    return super().fetchall()
+
+        _timed_cursors[factory] = TimedCursor
+    return _timed_cursors[factory]
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    """Подключение пула: курсор с любым cursor_factory оборачивается в timed_cursor; prepared - имена PREPARE"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+        return super().cursor(*args, cursor_factory=timed_cursor(factory), **kwargs)
+
+
+def prepare_sql(name: str) -> str:
+    """Текст PREPARE для горячего запроса: плейсхолдеры psycopg2 заменяются на $1..$n"""
+    sql, params = PREPARED_STATEMENTS[name]
+    if params and isinstance(params[0], tuple):
+        placeholders: Any = {param: f'${i}' for i, (param, _) in enumerate(params, 1)}
+        types = [param_type for _, param_type in params]
+    else:
+        placeholders = tuple(f'${i}' for i in range(1, len(params) + 1))
+        types = list(params)
+    type_list = f" ({', '.join(types)})" if types else ''
+    return f'PREPARE {name}{type_list} AS {sql % placeholders}'
+
+
+def prepare_statements(conn) -> None:
+    '''
+    PREPARE всех горячих запросов на новом подключении пула, вне транзакции.
+    Ошибка (например, таблицы ещё нет) не мешает подключению - запрос подготовится при первом вызове
+    '''
+    if not DB_PREPARE:
+        return
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for name in PREPARED_STATEMENTS:
+                if name in conn.prepared:
+                    continue
+                try:
+                    cur.execute(prepare_sql(name))
+                    conn.prepared.add(name)
+                except psycopg2.ProgrammingError as e:
+                    print(f'[prepare] {name} postponed: {e}')
+    finally:
+        conn.autocommit = autocommit
+
+
+def execute_prepared(cur, name: str, args: Any) -> None:
+    '''
+    Горячий запрос по имени: EXECUTE name(...) вместо полного текста - Postgres не разбирает его заново,
+    а после нескольких вызовов берёт закэшированный generic-план.
+    При DB_PREPARE=0 или на подключении не из пула - обычным текстом
+    '''
+    sql, params = PREPARED_STATEMENTS[name]
+    prepared = getattr(cur.connection, 'prepared', None)
+    if not DB_PREPARE or prepared is None:
+        cur.execute(sql, args)
+        return
+    if name not in prepared:
+        cur.execute(prepare_sql(name))
+        prepared.add(name)
+    if isinstance(args, dict):
+        args = [args[param] for param, _ in params]
+    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(args))})" if args else f'EXECUTE {name}', args or None)
+
+
+def instrumented(func):
+    '''
+    Обёртка handler: замер фаз, заголовок Server-Timing в ответе и строка JSON-лога на каждый вызов
+    с request_id из context
+    '''
+    @functools.wraps(func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        timer = RequestTimer(getattr(context, 'request_id', None))
+        _request.timer = timer
+        response: Optional[Dict[str, Any]] = None
+        try:
+            response = func(event, context)
+            return response
+        finally:
+            _request.timer = None
+            total_ms = (time.perf_counter() - timer.started) * 1000
+            if response is not None:
+                headers = response.setdefault('headers', {})
+                headers['Server-Timing'] = timer.server_timing(total_ms)
+                headers['Timing-Allow-Origin'] = '*'
+                exposed = headers.get('Access-Control-Expose-Headers')
+                headers['Access-Control-Expose-Headers'] = f'{exposed}, Server-Timing' if exposed else 'Server-Timing'
+            if REQUEST_LOG:
+                print(json.dumps({
+                    'log': 'request', 'function': FUNCTION_NAME, 'request_id': timer.request_id,
+                    'method': event.get('httpMethod'), 'status': response.get('statusCode') if response else 500,
+                    'total_ms': round(total_ms, 1), 'queries': timer.queries,
+                    'cache': response.get('headers', {}).get('X-Cache') if response else None,
+                    **{f'{name}_ms': round(ms, 1) for name, ms in timer.phases.items()}
+                }))
+    return wrapper
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить подключение из пула за DB_POOL_TIMEOUT секунд"""
+
+
+class ConnectionPool:
+    '''
+    Пул подключений к БД, живущий на уровне модуля между тёплыми вызовами.
+    Функции деплоятся изолированно, поэтому пул есть в каждой из них.
+    Args: dsn - строка подключения, min_size/max_size - границы пула,
+          timeout - сколько ждать свободное подключение (сек),
+          ping_after - после скольких секунд простоя проверять подключение
+    '''
+
+    def __init__(self, dsn: str, min_size: int, max_size: int, timeout: float, ping_after: float):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._idle: List[Tuple[Any, float]] = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self.stats: Dict[str, float] = {
+            'created': 0, 'reused': 0, 'discarded': 0,
+            'waits': 0, 'wait_ms': 0.0, 'max_wait_ms': 0.0, 'timeouts': 0
+        }
+        for _ in range(min(self.min_size, self.max_size)):
+            self._size += 1
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory=TimedConnection)
+        prepare_statements(conn)
+        self.stats['created'] += 1
+        return conn
+
+    def _is_healthy(self, conn, idle_since: float) -> bool:
+        """Проверка подключения: дешёвая всегда, SELECT 1 - только после долгого простоя"""
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close_quietly(self, conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        started = time.monotonic()
+        while True:
+            with self._cond:
+                waited = False
+                while not self._idle and self._size >= self.max_size:
+                    waited = True
+                    remaining = self.timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        self.stats['timeouts'] += 1
+                        print(f'[db-pool] timeout after {self.timeout}s, stats={self.stats}')
+                        raise PoolTimeout(f'No free DB connection after {self.timeout}s')
+                    self._cond.wait(remaining)
+                if waited:
+                    wait_ms = (time.monotonic() - started) * 1000
+                    self.stats['waits'] += 1
+                    self.stats['wait_ms'] += wait_ms
+                    self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], wait_ms)
+                    print(f'[db-pool] waited {wait_ms:.1f}ms for connection, stats={self.stats}')
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                else:
+                    self._size += 1
+                    conn, idle_since = None, 0.0
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            if self._is_healthy(conn, idle_since):
+                self.stats['reused'] += 1
+                return conn
+
+            # Подключение умерло (рестарт БД, idle timeout) - выбрасываем и пробуем снова
+            self._close_quietly(conn)
+            with self._cond:
+                self._size -= 1
+                self.stats['discarded'] += 1
+                self._cond.notify()
+
+    def putconn(self, conn, broken: bool = False) -> None:
+        if not broken and not conn.closed:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+        with self._cond:
+            if broken or conn.closed:
+                self._close_quietly(conn)
+                self._size -= 1
+                self.stats['discarded'] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Ленивая инициализация пула при первом запросе"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                dsn = os.environ.get('DATABASE_URL')
+                if not dsn:
+                    raise ValueError('DATABASE_URL not set')
+                _pool = ConnectionPool(dsn, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_PING_AFTER)
+    return _pool
+
+
+@contextmanager
+def db_connection() -> Iterator[Any]:
+    """Подключение из пула; при сетевой ошибке подключение выбрасывается, а не возвращается в пул"""
+    with request_phase('connect'):
+        pool = get_pool()
+        conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        pool.putconn(conn, broken=broken)
+
+
+class ResponseCache:
+    '''
+    Ограниченный LRU-кэш ответов на чтение внутри тёплого процесса.
+    Запись в том же процессе сбрасывает затронутые ключи, остальные процессы догоняют по TTL.
+    Чтение берёт generation() до запроса к БД и передаёт его в put: если запись сбросила ключ,
+    пока шёл запрос, прочитанная до неё строка в кэш не попадёт
+    Args: max_entries - предел числа записей, max_bytes - предел суммарного размера значений
+    '''
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[Tuple, Tuple[float, int, Any]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Поколение - счётчик сбросов; префикс -> поколение его последнего сброса.
+        # Словарь ограничен: при переполнении он очищается, а все чтения, начатые раньше, считаются устаревшими
+        self._generation = 0
+        self._invalidated: Dict[Tuple, int] = {}
+        self._floor = 0
+        self.stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'stale_puts': 0}
+
+    def get(self, key: Tuple) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[2]
+
+    def generation(self) -> int:
+        """Текущее поколение - берётся до запроса к БД, результат которого пойдёт в put"""
+        with self._lock:
+            return self._generation
+
+    def put(self, key: Tuple, value: Any, size: int, ttl: float, generation: Optional[int] = None) -> None:
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and self._invalidated_since(key, generation):
+                self.stats['stale_puts'] += 1
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+    def invalidate(self, *prefix: Any) -> None:
+        """Сброс всех записей, ключ которых начинается с prefix; идущие чтения prefix устаревают"""
+        with self._lock:
+            self._generation += 1
+            if len(self._invalidated) >= self.max_entries:
+                self._invalidated.clear()
+                self._floor = self._generation
+            self._invalidated[prefix] = self._generation
+            for key in [k for k in self._entries if k[:len(prefix)] == prefix]:
+                self._drop(key)
+                self.stats['invalidations'] += 1
+
+    def _invalidated_since(self, key: Tuple, generation: int) -> bool:
+        """Сбрасывался ли key или любой его префикс после поколения generation"""
+        if generation < self._floor:
+            return True
+        return any(self._invalidated.get(key[:i], -1) > generation for i in range(len(key) + 1))
+
+    def _drop(self, key: Tuple) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+_cache = ResponseCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
+
+
+class SingleFlight:
+    '''
+    Схлопывание одинаковых одновременных чтений внутри процесса: первый запрос с ключом
+    выполняет загрузку, остальные с тем же ключом ждут её результат (или исключение)
+    вместо собственного подключения и запроса к БД.
+    Запись отвязывает идущие чтения через forget - пришедшие после неё запросы начнут новое
+    '''
+
+    def __init__(self):
+        self._flights: Dict[Tuple, '_Flight'] = {}
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {'leaders': 0, 'coalesced': 0, 'errors': 0}
+
+    def do(self, key: Tuple, load: Callable[[], Any]) -> Tuple[Any, bool]:
+        '''
+        Returns: (результат load, True - если результат получен от чужого запроса)
+        '''
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            self.stats['leaders' if leader else 'coalesced'] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            flight.result = load()
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            self.stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    def forget(self, *prefix: Any) -> None:
+        """Отвязка идущих чтений, ключ которых начинается с prefix; ждущие их запросы получат результат"""
+        with self._lock:
+            for key in [k for k in self._flights if k[:len(prefix)] == prefix]:
+                del self._flights[key]
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+_flights = SingleFlight()
+
+
+def invalidate(*prefix: Any) -> None:
+    """После записи: сброс кэша и отвязка чтений, начатых до неё"""
+    _cache.invalidate(*prefix)
+    _flights.forget(*prefix)
+
+
+class ChangeFeed:
+    '''
+    Одно LISTEN-подключение на процесс. Ожидающие long-poll запросы получают
+    уведомления из общего буфера и не держат подключения из пула.
+    Args: dsn - строка подключения для слушающего потока
+    '''
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self._cond = threading.Condition()
+        self._events: List[Tuple[int, Dict[str, Any]]] = []
+        self._seq = 0
+        self._listening = False
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[], None]] = []
+
+    def _run(self) -> None:
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN {CHANGES_CHANNEL}')
+                with self._cond:
+                    self._listening = True
+                    self._cond.notify_all()
+                # Не select.select: он не принимает дескрипторы больше FD_SETSIZE (1024), а в server/app.py
+                # с тысячами клиентских сокетов номер подключения к БД бывает выше
+                with selectors.DefaultSelector() as selector:
+                    selector.register(conn, selectors.EVENT_READ)
+                    while True:
+                        if not selector.select(LONG_POLL_TIMEOUT):
+                            # Тишина - проверяем, что подключение живо
+                            with conn.cursor() as cur:
+                                cur.execute('SELECT 1')
+                            continue
+                        conn.poll()
+                        if conn.notifies:
+                            self._publish([n.payload for n in conn.notifies])
+                            del conn.notifies[:]
+            except psycopg2.Error as e:
+                print(f'[change-feed] listener error, reconnecting: {e}')
+                with self._cond:
+                    self._listening = False
+                if conn is not None and not conn.closed:
+                    conn.close()
+                time.sleep(1)
+
+    def _publish(self, payloads: List[str]) -> None:
+        with self._cond:
+            for payload in payloads:
+                try:
+                    change = json.loads(payload)
+                except ValueError:
+                    continue
+                self._seq += 1
+                self._events.append((self._seq, change))
+            del self._events[:-CHANGE_FEED_BUFFER]
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+    def add_listener(self, callback: Callable[[], None]) -> None:
+        """callback вызывается из слушающего потока после каждой пачки уведомлений (для asyncio-сервера)"""
+        with self._cond:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[], None]) -> None:
+        with self._cond:
+            self._listeners.remove(callback)
+
+    def subscribe(self, timeout: float = 5) -> int:
+        """Запуск слушателя при необходимости; возвращает номер, после которого ждать изменений"""
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='mdc-change-feed', daemon=True)
+                self._thread.start()
+            self._cond.wait_for(lambda: self._listening, timeout)
+            return self._seq
+
+    def changes_after(self, topics: List[str], after_seq: int) -> List[Dict[str, Any]]:
+        """Изменения по темам с номером больше after_seq, без ожидания"""
+        with self._cond:
+            return [c for seq, c in self._events if seq > after_seq and change_matches(c, topics)]
+
+    def wait(self, topics: List[str], after_seq: int, timeout: float) -> List[Dict[str, Any]]:
+        """Блокирует до изменения по одной из тем или до таймаута (тогда пустой список)"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                matched = self.changes_after(topics, after_seq)
+                remaining = deadline - time.monotonic()
+                if matched or remaining <= 0:
+                    return matched
+                self._cond.wait(remaining)
+
+
+def change_matches(change: Dict[str, Any], topics: List[str]) -> bool:
+    """Тема 'unit' ловит любой юнит, 'unit:5' или 'storage:mdc_calls' - конкретную запись"""
+    entity = change.get('entity')
+    return any(t == entity or t == f"{entity}:{change.get('id')}" for t in topics)
+
+
+_change_feed: Optional[ChangeFeed] = None
+
+
+def get_change_feed() -> ChangeFeed:
+    global _change_feed
+    if _change_feed is None:
+        with _pool_lock:
+            if _change_feed is None:
+                _change_feed = ChangeFeed(os.environ['DATABASE_URL'])
+    return _change_feed
+
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Универсальное хранилище ключ-значение для MDC системы в PostgreSQL
-    Args: event - dict с httpMethod, queryStringParameters, body
+    Универсальное хранилище ключ-значение для MDC системы в PostgreSQL.
+    Ключи могут быть иерархическими (calls/<id>): GET ?prefix=calls/ отдаёт коллекцию страницами
+    Args: event - dict с httpMethod, queryStringParameters, body, headers (If-None-Match, Accept-Encoding)
           context - объект с request_id и другими атрибутами
     Returns: HTTP response dict
     '''
@@ -18,59 +718,520 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Methods': 'GET, POST, PATCH, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    # Подключение к БД
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cursor = conn.cursor()
+    params = event.get('queryStringParameters', {}) or {}
+    if method == 'GET' and 'watch' in params:
+        return handle_watch(params)
+    
+    # Горячие ключи отдаются из кэша процесса, не занимая подключение
+    if method == 'GET' and params.get('key'):
+        key = params['key']
+        known_version = get_known_version(event, params)
+        cached = _cache.get(('key', key))
+        if cached is not None:
+            return compress_response(event, key_response(key, cached, known_version, params, 'HIT'))
+        # Промах при всплеске одинаковых опросов: одно чтение из БД на процесс, остальные ждут его строку
+        row, shared = _flights.do(('key', key, known_version),
+                                  lambda: with_schema(read_key, key, known_version))
+        return compress_response(
+            event, key_response(key, row, known_version, params, 'COALESCED' if shared else 'MISS'))
+    
+    return compress_response(event, with_schema(handle_request, method, event))
+
+
+def with_schema(run: Callable[..., Any], *args: Any) -> Any:
+    """run(conn, *args) на подключении из пула; без схемы - создание и повтор"""
+    with db_connection() as conn:
+        # Каждый запрос - один statement, отдельные BEGIN/COMMIT не нужны
+        conn.autocommit = True
+        try:
+            return run(conn, *args)
+        except (psycopg2.errors.UndefinedTable, psycopg2.errors.UndefinedColumn):
+            # Миграции V0005/V0006 ещё не применены - создаём схему и повторяем запрос
+            ensure_schema(conn)
+            return run(conn, *args)
+
+
+def ensure_schema(conn) -> None:
+    """Резервное создание схемы; основной путь - db_migrations/V0005, V0006, V0013"""
+    with conn.cursor() as cursor:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS mdc_storage (
+                key TEXT PRIMARY KEY,
+                value JSONB NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE SEQUENCE IF NOT EXISTS mdc_storage_version_seq;
+            ALTER TABLE mdc_storage
+              ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT nextval('mdc_storage_version_seq');
+            CREATE INDEX IF NOT EXISTS idx_mdc_storage_key_pattern
+              ON mdc_storage (key text_pattern_ops) INCLUDE (version);
+        ''')
+
+
+def get_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    """Заголовок запроса без учёта регистра имени"""
+    headers = event.get('headers') or {}
+    name = name.lower()
+    for header, value in headers.items():
+        if header.lower() == name:
+            return value
+    return None
+
+
+_brotli: Any = None  # модуль brotli после первого сжатия; False - не установлен
+
+
+def brotli_module() -> Any:
+    """brotli импортируется при первом большом ответе, а не на cold start"""
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli
+
+
+def negotiate_encoding(event: Dict[str, Any]) -> Optional[str]:
+    """Сжатие по Accept-Encoding: br или gzip; q=0 запрещает кодировку, * разрешает любую"""
+    header = get_header(event, 'Accept-Encoding')
+    if not header:
+        return None
+    weights: Dict[str, float] = {}
+    for part in header.split(','):
+        name, _, param = part.partition(';')
+        param = param.strip()
+        try:
+            weights[name.strip().lower()] = float(param[2:]) if param.startswith('q=') else 1.0
+        except ValueError:
+            weights[name.strip().lower()] = 0.0
+    for encoding in ('br', 'gzip'):
+        if weights.get(encoding, weights.get('*', 0.0)) > 0 and (encoding == 'gzip' or brotli_module()):
+            return encoding
+    return None
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli_module().compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    # wbits=31 - формат gzip (заголовок и CRC) средствами zlib, без импорта модуля gzip
+    compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+def compress_response(event: Dict[str, Any], response: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Сжатие ответа 200 длиннее COMPRESS_MIN_BYTES. Двоичное тело платформа принимает в base64
+    с isBase64Encoded. Сжатое тело запоминается по ETag (версии ключа): опросы одной версии
+    из разных терминалов не сжимают его заново
+    '''
+    body = response.get('body')
+    if response.get('statusCode') != 200 or not body or len(body) < COMPRESS_MIN_BYTES:
+        return response
+    headers = response.setdefault('headers', {})
+    headers['Vary'] = 'Accept-Encoding'
+    encoding = negotiate_encoding(event)
+    if encoding is None:
+        return response
+    
+    etag = headers.get('ETag')
+    encoded = _cache.get(('compressed', etag, encoding)) if etag else None
+    if encoded is None:
+        with request_phase('serialize'):
+            encoded = base64.b64encode(compress_body(body.encode(), encoding)).decode('ascii')
+        if etag:
+            _cache.put(('compressed', etag, encoding), encoded, len(encoded), COMPRESS_CACHE_TTL)
+    headers['Content-Encoding'] = encoding
+    response['body'] = encoded
+    response['isBase64Encoded'] = True
+    return response
+
+
+def get_known_version(event: Dict[str, Any], params: Dict[str, Any]) -> Optional[int]:
+    """Версия, которая уже есть у клиента: ?since_version=N или заголовок If-None-Match"""
+    raw = params.get('since_version') or get_header(event, 'If-None-Match')
+    if not raw:
+        return None
+    # If-None-Match может содержать W/"N" или список через запятую - берём первый тег
+    tag = raw.split(',')[0].strip()
+    if tag.startswith('W/'):
+        tag = tag[2:]
+    try:
+        return int(tag.strip('"'))
+    except ValueError:
+        return None
+
+
+def parse_watch_params(params: Dict[str, Any]) -> Tuple[List[str], float, Optional[int]]:
+    '''
+    Параметры long-poll: темы из ?watch=, timeout (не больше LONG_POLL_TIMEOUT) и since_version
+    Raises: ValueError с текстом для ответа 400
+    '''
+    topics = [t for t in params['watch'].split(',') if t]
+    if not topics:
+        raise ValueError('Параметр watch должен содержать темы через запятую')
+    try:
+        timeout = min(float(params.get('timeout', LONG_POLL_TIMEOUT)), LONG_POLL_TIMEOUT)
+        since_version = int(params['since_version']) if params.get('since_version') else None
+    except ValueError:
+        raise ValueError('timeout и since_version должны быть числами') from None
+    return topics, max(timeout, 0), since_version
+
+
+def stored_changes(topics: List[str], since_version: Optional[int]) -> List[Dict[str, Any]]:
+    """Ключи storage из тем, изменённые после since_version, - закрывают окно до начала LISTEN"""
+    keys = [t.split(':', 1)[1] for t in topics if t.startswith('storage:')]
+    if not keys or since_version is None:
+        return []
+    with db_connection() as conn:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(
+                'SELECT key, version FROM mdc_storage WHERE key = ANY(%s) AND version > %s',
+                (keys, since_version)
+            )
+            return [{'entity': 'storage', 'id': k, 'version': v} for k, v in cursor.fetchall()]
+
+
+def watch_response(changes: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'changes': changes, 'timeout': not changes})
+    }
+
+
+def handle_watch(params: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Long-poll: ждёт NOTIFY по темам из ?watch=storage:mdc_calls,unit,... до timeout секунд.
+    ?since_version=N закрывает окно до начала LISTEN для ключей storage.
+    '''
+    try:
+        topics, timeout, since_version = parse_watch_params(params)
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)})
+        }
+    
+    feed = get_change_feed()
+    after_seq = feed.subscribe()
+    changes = stored_changes(topics, since_version)
+    if not changes:
+        changes = feed.wait(topics, after_seq, timeout)
+    return watch_response(changes)
+
+
+def key_response(key: str, row: Optional[Tuple[int, Optional[str]]], known_version: Optional[int],
+                 params: Dict[str, Any], cache_status: str) -> Dict[str, Any]:
+    '''
+    Ответ на GET ?key= по строке (version, value как JSON-текст или None, если версия совпала)
+    Returns: 200 со значением, 304 / 200 unchanged для актуальной версии клиента или 404
+    '''
+    if row and row[0] == known_version:
+        etag = f'"{row[0]}"'
+        if 'since_version' in params:
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*',
+                            'Access-Control-Expose-Headers': 'ETag', 'ETag': etag, 'X-Cache': cache_status},
+                'body': json.dumps({'key': key, 'version': row[0], 'unchanged': True})
+            }
+        return {
+            'statusCode': 304,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Access-Control-Expose-Headers': 'ETag', 'ETag': etag,
+                        'X-Cache': cache_status},
+            'body': ''
+        }
+    
+    if row:
+        with request_phase('serialize'):
+            body = f'{{"key": {json.dumps(key)}, "value": {row[1]}, "version": {row[0]}}}'
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*',
+                        'Access-Control-Expose-Headers': 'ETag', 'ETag': f'"{row[0]}"', 'X-Cache': cache_status},
+            'body': body
+        }
+    return {
+        'statusCode': 404,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'key': key, 'value': None})
+    }
+
+
+def build_patch_expression(ops: List[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+    '''
+    Собирает из операций одно SQL-выражение над текущим value.
+    Операции: append {value}, update {id, value} (слияние полей элемента массива),
+              remove {id}, set {path, value} (jsonb_set по пути)
+    Операция над значением не того типа (append к объекту, путь через скаляр) - DataError при выполнении
+    Returns: (SQL-выражение, параметры в порядке подстановки)
+    '''
+    expr = 'value'
+    params: List[Any] = []
+    for op in ops:
+        kind = op.get('op')
+        if kind == 'append':
+            # || с объектом молча собрал бы массив [объект, value]; jsonb_array_length падает на не-массиве,
+            # как jsonb_array_elements в update/remove
+            expr = (
+                '(SELECT a || jsonb_build_array(%s::jsonb)'
+                f' FROM (SELECT {expr} AS a) t WHERE jsonb_array_length(a) >= 0)'
+            )
+            params = [json.dumps(op.get('value'))] + params
+        elif kind == 'update' and 'id' in op and isinstance(op.get('value'), dict):
+            expr = (
+                "(SELECT COALESCE(jsonb_agg(CASE WHEN e->>'id' = %s THEN e || %s::jsonb ELSE e END ORDER BY i), '[]'::jsonb)"
+                f' FROM jsonb_array_elements({expr}) WITH ORDINALITY AS t(e, i))'
+            )
+            params = [str(op['id']), json.dumps(op['value'])] + params
+        elif kind == 'remove' and 'id' in op:
+            expr = (
+                "(SELECT COALESCE(jsonb_agg(e ORDER BY i), '[]'::jsonb)"
+                f" FROM jsonb_array_elements({expr}) WITH ORDINALITY AS t(e, i) WHERE e->>'id' IS DISTINCT FROM %s)"
+            )
+            params = params + [str(op['id'])]
+        elif kind == 'set' and isinstance(op.get('path'), list) and op['path']:
+            expr = f'jsonb_set({expr}, %s::text[], %s::jsonb, true)'
+            params = params + [[str(p) for p in op['path']], json.dumps(op.get('value'))]
+        else:
+            raise ValueError(f'Неизвестная или неполная операция: {op}')
+    return expr, params
+
+
+def prefix_upper(prefix: str) -> str:
+    '''
+    Верхняя граница ключей с префиксом в побайтовом порядке text_pattern_ops: последний символ + 1.
+    В UTF-8 порядок байтов совпадает с порядком кодовых точек, поэтому [prefix, upper) - ровно ключи с префиксом
+    '''
+    chars = prefix
+    while chars:
+        code = ord(chars[-1]) + 1
+        if 0xD800 <= code <= 0xDFFF:
+            code = 0xE000  # суррогаты не кодируются в UTF-8
+        if code <= 0x10FFFF:
+            return chars[:-1] + chr(code)
+        chars = chars[:-1]
+    raise ValueError('Префикс не ограничивает ключи')
+
+
+def parse_scan_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Параметры обхода: prefix, after (последний ключ прошлой страницы), limit, since_version, values=1
+    Raises: ValueError с текстом для ответа 400
+    '''
+    prefix = params['prefix']
+    if not prefix:
+        raise ValueError('Параметр prefix не может быть пустым')
+    try:
+        limit = int(params.get('limit') or SCAN_PAGE_SIZE)
+        since = int(params.get('since_version') or 0)
+    except ValueError:
+        raise ValueError('limit и since_version должны быть числами') from None
+    if not 1 <= limit <= MAX_SCAN_PAGE:
+        raise ValueError(f'limit должен быть от 1 до {MAX_SCAN_PAGE}')
+    return {
+        'prefix': prefix, 'upper': prefix_upper(prefix), 'after': params.get('after') or '',
+        'since': since, 'limit': limit, 'values': params.get('values') in ('1', 'true')
+    }
+
+
+def scan_safe_version(cursor, since: int) -> int:
+    '''
+    nextSince первой страницы обхода: номер версии, до которого все записи закоммичены.
+    pg_try_advisory_xact_lock не ждёт идущих записей и не ставит новые в очередь за собой; отдельный
+    statement в autocommit снимает блокировку сразу, до чтения страницы. Если записи идут все
+    SCAN_SAFE_POINT_TRIES попыток, остаётся since: следующий обход повторит часть ключей, но не пропустит
+    запись, закоммиченную позже
+    '''
+    for attempt in range(SCAN_SAFE_POINT_TRIES):
+        if attempt:
+            time.sleep(SCAN_SAFE_POINT_RETRY)
+        cursor.execute(f'''
+            SELECT CASE WHEN l.locked THEN COALESCE(pg_sequence_last_value('mdc_storage_version_seq'), 0) END
+            FROM (SELECT pg_try_advisory_xact_lock({STORAGE_VERSION_LOCK_ID}) AS locked) l
+        ''')
+        version = cursor.fetchone()[0]
+        if version is not None:
+            return max(version, since)
+    return since
+
+
+def scan_prefix(cursor, params: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    GET ?prefix=calls/ - ключи коллекции по порядку, страницами; since_version оставляет только изменённые
+    после версии, values=1 добавляет значения. Удаления ключей нет: обход сообщает только о записях
+    Returns: {prefix, items: [{key, version, value?}], next - after следующей страницы или null,
+              nextSince - since_version следующего обхода, только на первой странице}
+    '''
+    try:
+        scan = parse_scan_params(params)
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)})
+        }
+    
+    # Номер версии берётся до чтения страниц: всё, что запишется позже, попадёт в следующий обход
+    next_since = scan_safe_version(cursor, scan['since']) if not scan['after'] else None
+    
+    # Лишняя строка показывает, есть ли следующая страница
+    execute_prepared(cursor, 'mdc_scan_values' if scan['values'] else 'mdc_scan_keys',
+                     dict(scan, limit=scan['limit'] + 1))
+    rows = cursor.fetchall()
+    has_more = len(rows) > scan['limit']
+    rows = rows[:scan['limit']]
     
-    # Создание таблицы если не существует
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS mdc_storage (
-            key TEXT PRIMARY KEY,
-            value JSONB NOT NULL,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
+    with request_phase('serialize'):
+        # value приходит текстом JSON и вставляется в ответ как есть
+        if scan['values']:
+            items = ', '.join(f'{{"key": {json.dumps(row[0])}, "version": {row[1]}, "value": {row[2]}}}'
+                              for row in rows)
+        else:
+            items = ', '.join(f'{{"key": {json.dumps(row[0])}, "version": {row[1]}}}' for row in rows)
+        next_after = rows[-1][0] if has_more else None
+        body = (f'{{"prefix": {json.dumps(scan["prefix"])}, "items": [{items}], '
+                f'"next": {json.dumps(next_after)}, "nextSince": {json.dumps(next_since)}}}')
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': body
+    }
+
+
+def read_key(conn, key: str, known_version: Optional[int]) -> Optional[Tuple[int, Optional[str]]]:
+    '''
+    Строка (version, value) ключа; полное значение попадает в кэш процесса
+    Если версия у клиента актуальна, value не читается из TOAST и не сериализуется
+    '''
+    generation = _cache.generation()
+    with conn.cursor() as cursor:
+        # value приходит текстом и вставляется в ответ как есть, без json.loads/json.dumps
+        execute_prepared(cursor, 'mdc_get_key', (known_version, key))
+        row = cursor.fetchone()
+    if row and row[1] is not None:
+        _cache.put(('key', key), row, len(row[1]), CACHE_TTL, generation)
+    return row
+
+
+def handle_request(conn, method: str, event: Dict[str, Any]) -> Dict[str, Any]:
+    cursor = conn.cursor()
     
     try:
         if method == 'GET':
             # Получение значения по ключу
-            params = event.get('queryStringParameters', {})
+            params = event.get('queryStringParameters', {}) or {}
+            if 'prefix' in params:
+                return scan_prefix(cursor, params)
             key: Optional[str] = params.get('key')
             
             if not key:
                 return {
                     'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Параметр key обязателен'})
+                    'body': json.dumps({'error': 'Параметр key или prefix обязателен'})
                 }
             
-            cursor.execute('SELECT value FROM mdc_storage WHERE key = %s', (key,))
-            row = cursor.fetchone()
+            known_version = get_known_version(event, params)
+            return key_response(key, read_key(conn, key, known_version), known_version, params, 'MISS')
+        
+        elif method == 'POST':
+            body_data = json.loads(event.get('body', '{}'))
             
-            if row:
+            # Пакетное чтение: {keys: [...]} -> {values: {key: value | null}}
+            if 'keys' in body_data:
+                keys = body_data['keys']
+                if not isinstance(keys, list) or not all(isinstance(k, str) and k for k in keys):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Поле keys должно быть списком непустых строк'})
+                    }
+                if len(keys) > MAX_BATCH_KEYS:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': f'Не больше {MAX_BATCH_KEYS} ключей за запрос'})
+                    }
+                
+                # Ответ собирается в Postgres; отсутствующие ключи попадают в values как null
+                cursor.execute('''
+                    SELECT json_build_object(
+                        'values', COALESCE(json_object_agg(k.key, s.value), '{}'::json),
+                        'versions', COALESCE(json_object_agg(k.key, s.version) FILTER (WHERE s.key IS NOT NULL), '{}'::json)
+                    )::text
+                    FROM unnest(%s::text[]) AS k(key)
+                    LEFT JOIN mdc_storage s ON s.key = k.key
+                ''', (list(dict.fromkeys(keys)),))
+                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'key': key, 'value': row[0]})
+                    'body': cursor.fetchone()[0]
                 }
-            else:
+            
+            # Пакетная запись: {items: [{key, value}, ...]} одним INSERT ... ON CONFLICT
+            if 'items' in body_data:
+                items = body_data['items']
+                if not isinstance(items, list) or not all(isinstance(i, dict) and i.get('key') for i in items):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Поле items должно быть списком {key, value}'})
+                    }
+                if len(items) > MAX_BATCH_KEYS:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': f'Не больше {MAX_BATCH_KEYS} ключей за запрос'})
+                    }
+                
+                # ON CONFLICT не может обновить одну строку дважды - последнее значение побеждает
+                latest = {item['key']: json.dumps(item.get('value')) for item in items}
+                if latest:
+                    # psycopg2.extras (+logging) грузится только здесь - на cold start он не нужен
+                    from psycopg2.extras import execute_values
+                    # Канал и блокировка - константы модуля, а execute_values допускает только один %s
+                    rows = execute_values(cursor, f'''
+                        WITH up AS (
+                            INSERT INTO mdc_storage (key, value, updated_at)
+                            SELECT v.key, v.value, CURRENT_TIMESTAMP
+                            FROM (VALUES %s) v(key, value),
+                                 (SELECT pg_advisory_xact_lock_shared({STORAGE_VERSION_LOCK_ID})) l
+                            ON CONFLICT (key) DO UPDATE 
+                            SET value = EXCLUDED.value, updated_at = CURRENT_TIMESTAMP,
+                                version = nextval('mdc_storage_version_seq')
+                            RETURNING key, version
+                        )
+                        SELECT key, version, pg_notify('{CHANGES_CHANNEL}', json_build_object(
+                            'entity', 'storage', 'id', key, 'version', version)::text)
+                        FROM up
+                    ''', list(latest.items()), template='(%s::text, %s::jsonb)',
+                       page_size=MAX_BATCH_KEYS, fetch=True)
+                    versions = {row[0]: row[1] for row in rows}
+                    for written_key in versions:
+                        invalidate('key', written_key)
+                else:
+                    versions = {}
+                
                 return {
-                    'statusCode': 404,
+                    'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'key': key, 'value': None})
+                    'body': json.dumps({'success': True, 'keys': list(latest), 'versions': versions})
                 }
-        
-        elif method == 'POST':
+            
             # Сохранение значения
-            body_data = json.loads(event.get('body', '{}'))
             key: str = body_data.get('key', '')
             value: Any = body_data.get('value')
             
@@ -81,19 +1242,90 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'Поле key обязательно'})
                 }
             
-            # Upsert: вставка или обновление
-            cursor.execute('''
-                INSERT INTO mdc_storage (key, value, updated_at)
-                VALUES (%s, %s, CURRENT_TIMESTAMP)
-                ON CONFLICT (key) DO UPDATE 
-                SET value = EXCLUDED.value, updated_at = CURRENT_TIMESTAMP
-            ''', (key, json.dumps(value)))
-            conn.commit()
+            # Upsert: вставка или обновление; NOTIFY в том же statement уходит при коммите записи
+            execute_prepared(cursor, 'mdc_set_key', (key, json.dumps(value), CHANGES_CHANNEL))
+            version = cursor.fetchone()[0]
+            invalidate('key', key)
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True, 'key': key})
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*',
+                            'Access-Control-Expose-Headers': 'ETag', 'ETag': f'"{version}"'},
+                'body': json.dumps({'success': True, 'key': key, 'version': version})
+            }
+        
+        elif method == 'PATCH':
+            # Частичное изменение: {key, ops: [...], expected_version?}
+            body_data = json.loads(event.get('body', '{}'))
+            key = body_data.get('key', '')
+            ops = body_data.get('ops')
+            expected_version = body_data.get('expected_version')
+            
+            if not key or not isinstance(ops, list) or not ops or len(ops) > MAX_PATCH_OPS:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': f'Нужны key и от 1 до {MAX_PATCH_OPS} операций в ops'})
+                }
+            try:
+                expr, expr_params = build_patch_expression(ops)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e)})
+                }
+            
+            # Операции применяются в БД одним UPDATE; expected_version = NULL отключает проверку
+            try:
+                cursor.execute(f'''
+                    WITH up AS (
+                        UPDATE mdc_storage
+                        SET value = {expr}, updated_at = CURRENT_TIMESTAMP,
+                            version = nextval('mdc_storage_version_seq')
+                        FROM (SELECT pg_advisory_xact_lock_shared({STORAGE_VERSION_LOCK_ID})) l
+                        WHERE key = %s AND (%s::bigint IS NULL OR version = %s::bigint)
+                        RETURNING key, version
+                    )
+                    SELECT version, pg_notify(%s, json_build_object(
+                        'entity', 'storage', 'id', key, 'version', version)::text)
+                    FROM up
+                ''', expr_params + [key, expected_version, expected_version, CHANGES_CHANNEL])
+            except psycopg2.DataError as e:
+                # Значение не того типа или неверный путь; InvalidParameterValue - подкласс DataError.
+                # В autocommit rollback ничего не делает, вне его - снимает прерванную транзакцию
+                conn.rollback()
+                return {
+                    'statusCode': 409,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'error': f'Операции не применимы к текущему значению: {e.diag.message_primary or e}',
+                        'key': key
+                    })
+                }
+            
+            row = cursor.fetchone()
+            invalidate('key', key)
+            
+            if row is None:
+                # Строка не обновлена: ключа нет или версия уже другая
+                cursor.execute('SELECT version FROM mdc_storage WHERE key = %s', (key,))
+                current = cursor.fetchone()
+                return {
+                    'statusCode': 409 if current else 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'error': 'Версия устарела' if current else 'Ключ не найден',
+                        'key': key,
+                        'version': current[0] if current else None
+                    })
+                }
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*',
+                            'Access-Control-Expose-Headers': 'ETag', 'ETag': f'"{row[0]}"'},
+                'body': json.dumps({'success': True, 'key': key, 'version': row[0]})
             }
         
         else:
@@ -105,4 +1337,25 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cursor.close()
-        conn.close()
+
+
+def warm_up() -> None:
+    '''
+    Подготовка экземпляра при импорте модуля, до первого запроса: пул открывает подключение и готовит
+    на нём горячие запросы - PREPARE разбирает их, и бэкенд Postgres загружает метаданные mdc_storage.
+    Если миграции не применены, схема создаётся здесь, а не в первом запросе пользователя
+    '''
+    started = time.perf_counter()
+    try:
+        with db_connection() as conn:
+            if DB_PREPARE and len(conn.prepared) < len(PREPARED_STATEMENTS):
+                conn.autocommit = True
+                ensure_schema(conn)
+                prepare_statements(conn)
+        print(f'[warm-up] {(time.perf_counter() - started) * 1000:.1f}ms')
+    except Exception as e:
+        print(f'[warm-up] skipped: {e}')
+
+
+if DB_WARMUP and os.environ.get('DATABASE_URL'):
+    warm_up()
@@ -1,14 +1,1021 @@
+import functools
+import heapq
 import json
+import math
 import os
+import threading
+import time
 import psycopg2
-import psycopg2.extras
-from typing import Dict, Any
-from datetime import datetime
+import psycopg2.extensions
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Iterator, List, Optional, Tuple
+from datetime import date, datetime, timedelta
 
+CHANGES_CHANNEL = 'mdc_changes'
+UNITS_MAX_PAGE = 500
+# Запас для ?updated_since: запись с last_update чуть раньше снимка чтения может закоммититься позже
+UNITS_SINCE_OVERLAP_SECONDS = 2
+UNITS_TOMBSTONE_TTL_DAYS = 7
+UNITS_NEAREST_DEFAULT = 5
+UNITS_NEAREST_MAX = 50
+# Метров в градусе дуги большого круга (R = 6371 км)
+METERS_PER_DEGREE = 6371000 * math.pi / 180
+# Аналитика ?view=status-time по сводкам V0012; корзины времени реагирования - как в unit_status_track
+STATUS_PERIODS = ('day', 'week', 'month', 'all')
+STATUS_DEFAULT_DAYS = 30
+STATUS_MAX_DAYS = 400
+BUSY_STATUSES = ('en-route', 'on-scene')
+RESPONSE_BUCKETS = 120
+RESPONSE_MAX_SECONDS = 86400
+RESPONSE_PERCENTILES = (50, 90, 95, 99)
+
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+FUNCTION_NAME = 'units'
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') != '0'
+SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '0'))  # 0 - медленные запросы не логируются
+DB_WARMUP = os.environ.get('DB_WARMUP', '1') != '0'
+DB_PREPARE = os.environ.get('DB_PREPARE', '1') != '0'  # 0 - для пулеров в режиме транзакций
+
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '64'))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+CACHE_TTL = float(os.environ.get('UNITS_CACHE_TTL_MS', '500')) / 1000
+STATUS_CACHE_TTL = float(os.environ.get('UNITS_STATUS_CACHE_TTL_MS', '30000')) / 1000
+
+UNITS_GRID = os.environ.get('UNITS_GRID', '1') != '0'  # 0 - ближайшие юниты ищутся только в SQL
+UNITS_GRID_CELL_DEG = float(os.environ.get('UNITS_GRID_CELL_DEG', '0.01'))  # ~1.1 км по широте
+UNITS_GRID_TTL = float(os.environ.get('UNITS_GRID_TTL_MS', '1000')) / 1000
+
+SCHEMA = 't_p48049793_mobile_digital_compu'
+
+# Горячие запросы: готовятся через PREPARE на каждом подключении пула и выполняются по имени
+UNITS_LIST_SQL = f'''
+    WITH meta AS (
+        SELECT LOCALTIMESTAMP - make_interval(secs => %(overlap)s) AS next_since,
+               %(since)s::timestamptz IS NULL
+               OR %(since)s::timestamptz < CURRENT_TIMESTAMP - make_interval(days => %(ttl)s) AS full
+    ), page AS (
+        SELECT u.id, u.unit_name, u.status, u.location, u.lat, u.lon, u.last_update,
+               row_number() OVER (ORDER BY u.id) AS n
+        FROM {SCHEMA}.units u, meta
+        WHERE u.id > %(after_id)s AND (meta.full OR u.last_update > %(since)s::timestamptz)
+        ORDER BY u.id
+        LIMIT %(fetch)s
+    )
+    SELECT json_build_object(
+        'units', COALESCE((
+            SELECT json_agg(json_build_object(
+                'id', p.id,
+                'unitName', p.unit_name,
+                'status', p.status,
+                'location', p.location,
+                'lat', p.lat,
+                'lon', p.lon,
+                'lastUpdate', p.last_update,
+                'members', COALESCE((
+                    SELECT json_agg(um.member_name ORDER BY um.id)
+                    FROM {SCHEMA}.unit_members um WHERE um.unit_id = p.id
+                ), '[]'::json)
+            ) ORDER BY p.id)
+            FROM page p
+            WHERE %(limit)s::int IS NULL OR p.n <= %(limit)s
+        ), '[]'::json),
+        -- Надгробия старше UNITS_TOMBSTONE_TTL_DAYS удалены - тогда клиенту отдаётся полный список
+        'deleted', CASE WHEN meta.full OR %(after_id)s <> 0 THEN '[]'::json ELSE COALESCE((
+            SELECT json_agg(t.unit_id ORDER BY t.unit_id)
+            FROM {SCHEMA}.unit_tombstones t WHERE t.deleted_at > %(since)s::timestamptz
+        ), '[]'::json) END,
+        'full', meta.full,
+        'nextSince', meta.next_since,
+        'nextAfterId', (
+            SELECT p.id FROM page p
+            WHERE p.n = %(limit)s AND EXISTS (SELECT 1 FROM page WHERE n > %(limit)s)
+        )
+    )::text AS body
+    FROM meta
+'''
+UNITS_UPDATE_SQL = f'''
+    WITH u AS (
+        UPDATE {SCHEMA}.units
+        SET status = COALESCE(%s, status),
+            location = COALESCE(%s, location),
+            lat = COALESCE(%s, lat),
+            lon = COALESCE(%s, lon),
+            last_update = CURRENT_TIMESTAMP
+        WHERE id = %s
+        RETURNING id, unit_name, status, lat, lon
+    ), d AS (
+        DELETE FROM {SCHEMA}.unit_members
+        WHERE %s AND unit_id IN (SELECT id FROM u)
+    ), m AS (
+        INSERT INTO {SCHEMA}.unit_members (unit_id, member_name)
+        SELECT u.id, member FROM u, unnest(%s::text[]) AS member
+        WHERE %s
+    )
+    SELECT id, unit_name, status, lat, lon, pg_notify(%s, json_build_object('entity', 'unit', 'id', id)::text)
+    FROM u
+'''
+# Подбор ближайших свободных юнитов без индекса в памяти. Расстояние - равнопромежуточная проекция
+# у точки вызова, как в UnitGrid: на масштабе города расхождение с ортодромией меньше метра
+UNITS_NEAREST_SQL = f'''
+    SELECT u.id, u.unit_name, u.lat, u.lon,
+           {METERS_PER_DEGREE} * sqrt(
+               power(u.lat - %(lat)s, 2) + power((u.lon - %(lon)s) * cos(radians(%(lat)s)), 2)
+           ) AS distance
+    FROM {SCHEMA}.units u
+    WHERE u.status = 'available' AND u.lat IS NOT NULL AND u.lon IS NOT NULL
+    ORDER BY distance, u.id
+    LIMIT %(k)s
+'''
+# Время в статусе по периодам: закрытые интервалы - из сводки unit_status_daily,
+# открытые (текущий статус с status_since) раскладываются по дням на лету - в сводку они попадут при переходе
+STATUS_TIME_SQL = f'''
+    SELECT CASE WHEN %(all)s THEN %(from)s::date ELSE date_trunc(%(trunc)s, x.d)::date END AS period,
+           x.unit_id, x.status, SUM(x.seconds), SUM(x.entries)::int
+    FROM (
+        SELECT s.day::timestamp AS d, s.unit_id, s.status, s.seconds, s.entries
+        FROM {SCHEMA}.unit_status_daily s
+        WHERE s.day >= %(from)s AND s.day < %(to)s AND (%(unit_id)s::int IS NULL OR s.unit_id = %(unit_id)s)
+        UNION ALL
+        SELECT d, u.id, u.status,
+               EXTRACT(EPOCH FROM LEAST(d + INTERVAL '1 day', LOCALTIMESTAMP) - GREATEST(d, u.status_since)), 0
+        FROM {SCHEMA}.units u,
+             generate_series(date_trunc('day', GREATEST(u.status_since, %(from)s::timestamp)),
+                             LEAST(date_trunc('day', LOCALTIMESTAMP), %(to)s::timestamp - INTERVAL '1 day'),
+                             INTERVAL '1 day') d
+        WHERE u.status_since < LOCALTIMESTAMP AND (%(unit_id)s::int IS NULL OR u.id = %(unit_id)s)
+    ) x
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+'''
+STATUS_RESPONSE_SQL = f'''
+    SELECT CASE WHEN %(all)s THEN %(from)s::date ELSE date_trunc(%(trunc)s, r.day::timestamp)::date END AS period,
+           r.bucket, SUM(r.responses)::int
+    FROM {SCHEMA}.unit_response_daily r
+    WHERE r.day >= %(from)s AND r.day < %(to)s AND (%(unit_id)s::int IS NULL OR r.unit_id = %(unit_id)s)
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+'''
+# Догрузка индекса в памяти: юниты, изменённые после since, и надгробия удалённых.
+# Полная загрузка - при первом вызове и когда надгробия старше since уже удалены (как в UNITS_LIST_SQL)
+UNITS_GRID_SYNC_SQL = f'''
+    WITH meta AS (
+        SELECT LOCALTIMESTAMP - make_interval(secs => %(overlap)s) AS next_since,
+               %(since)s::timestamptz IS NULL
+               OR %(since)s::timestamptz < CURRENT_TIMESTAMP - make_interval(days => %(ttl)s) AS full
+    )
+    SELECT meta.next_since, meta.full,
+           COALESCE((
+               SELECT json_agg(json_build_array(u.id, u.unit_name, u.status, u.lat, u.lon))
+               FROM {SCHEMA}.units u
+               WHERE meta.full OR u.last_update > %(since)s::timestamptz
+           ), '[]'::json),
+           CASE WHEN meta.full THEN '[]'::json ELSE COALESCE((
+               SELECT json_agg(t.unit_id)
+               FROM {SCHEMA}.unit_tombstones t WHERE t.deleted_at > %(since)s::timestamptz
+           ), '[]'::json) END
+    FROM meta
+'''
+# имя: (SQL с плейсхолдерами psycopg2, типы параметров - по порядку или (имя, тип) для %(имя)s)
+PREPARED_STATEMENTS: Dict[str, Tuple[str, Tuple]] = {
+    'units_list': (UNITS_LIST_SQL, (('overlap', 'int'), ('since', 'timestamptz'), ('ttl', 'int'),
+                                    ('after_id', 'int'), ('limit', 'int'), ('fetch', 'int'))),
+    'units_update': (UNITS_UPDATE_SQL, ('text', 'text', 'float8', 'float8', 'int', 'boolean', 'text[]', 'boolean',
+                                        'text')),
+    'units_nearest': (UNITS_NEAREST_SQL, (('lat', 'float8'), ('lon', 'float8'), ('k', 'int'))),
+    'units_grid_sync': (UNITS_GRID_SYNC_SQL, (('overlap', 'int'), ('since', 'timestamptz'), ('ttl', 'int'))),
+}
+
+
+_request = threading.local()
+
+
+class RequestTimer:
+    '''
+    Замер одного вызова handler: время фаз connect / execute / fetch / serialize (мс) и число запросов к БД.
+    Текущий замер лежит в thread-local - пул и курсоры пишут в него без передачи через аргументы.
+    Имя функции и порог медленного запроса берутся из замера: в server/app.py курсор подключения
+    из общего пула принадлежит другому модулю
+    '''
+
+    def __init__(self, request_id: Optional[str]):
+        self.request_id = request_id
+        self.function = FUNCTION_NAME
+        self.slow_query_ms = SLOW_QUERY_MS
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {'connect': 0.0, 'execute': 0.0, 'fetch': 0.0, 'serialize': 0.0}
+        self.queries = 0
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] += seconds * 1000
+
+    def server_timing(self, total_ms: float) -> str:
+        metrics = [f'{name};dur={ms:.1f}' for name, ms in self.phases.items() if ms]
+        metrics.append(f'total;dur={total_ms:.1f}')
+        metrics.append(f'db;desc="{self.queries} queries"')
+        return ', '.join(metrics)
+
+
+@contextmanager
+def request_phase(phase: str) -> Iterator[None]:
+    """Добавляет время блока к фазе текущего запроса; вне handler ничего не делает"""
+    timer = getattr(_request, 'timer', None)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.add(phase, time.perf_counter() - started)
+
+
+def log_slow_query(query: Any, vars: Any, ms: float) -> None:
+    timer = getattr(_request, 'timer', None)
+    sql = query.decode(errors='replace') if isinstance(query, bytes) else str(query)
+    print(json.dumps({
+        'log': 'slow-query', 'function': timer.function if timer else FUNCTION_NAME,
+        'request_id': timer.request_id if timer else None,
+        'ms': round(ms, 1), 'sql': ' '.join(sql.split())[:2000], 'params': repr(vars)[:1000]
+    }, ensure_ascii=False))
+
+
+_timed_cursors: Dict[type, type] = {}
+
+
+def timed_cursor(factory: type) -> type:
+    """Подкласс курсора: execute/fetch идут в замер текущего запроса, медленные запросы - в лог"""
+    if factory not in _timed_cursors:
+        class TimedCursor(factory):
+            def execute(self, query, vars=None):
+                timer = getattr(_request, 'timer', None)
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    elapsed = time.perf_counter() - started
+                    if timer is not None:
+                        timer.queries += 1
+                        timer.add('execute', elapsed)
+                    threshold = timer.slow_query_ms if timer is not None else SLOW_QUERY_MS
+                    if threshold and elapsed * 1000 >= threshold:
+                        log_slow_query(query, vars, elapsed * 1000)
+
+            def copy_expert(self, sql, file, *args, **kwargs):
+                timer = getattr(_request, 'timer', None)
+                started = time.perf_counter()
+                try:
+                    return super().copy_expert(sql, file, *args, **kwargs)
+                finally:
+                    if timer is not None:
+                        timer.queries += 1
+                        timer.add('execute', time.perf_counter() - started)
+
+            def fetchone(self):
+                with request_phase('fetch'):
+                    return super().fetchone()
+
+            def fetchmany(self, *args, **kwargs):
+                with request_phase('fetch'):
+                    return super().fetchmany(*args, **kwargs)
+
+            def fetchall(self):
+                with request_phase('fetch'):
+                    return super().fetchall()
+
+        _timed_cursors[factory] = TimedCursor
+    return _timed_cursors[factory]
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    """Подключение пула: курсор с любым cursor_factory оборачивается в timed_cursor; prepared - имена PREPARE"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+        return super().cursor(*args, cursor_factory=timed_cursor(factory), **kwargs)
+
+
+def prepare_sql(name: str) -> str:
+    """Текст PREPARE для горячего запроса: плейсхолдеры psycopg2 заменяются на $1..$n"""
+    sql, params = PREPARED_STATEMENTS[name]
+    if params and isinstance(params[0], tuple):
+        placeholders: Any = {param: f'${i}' for i, (param, _) in enumerate(params, 1)}
+        types = [param_type for _, param_type in params]
+    else:
+        placeholders = tuple(f'${i}' for i in range(1, len(params) + 1))
+        types = list(params)
+    type_list = f" ({', '.join(types)})" if types else ''
+    return f'PREPARE {name}{type_list} AS {sql % placeholders}'
+
+
+def prepare_statements(conn) -> None:
+    '''
+    PREPARE всех горячих запросов на новом подключении пула, вне транзакции.
+    Ошибка (например, таблицы ещё нет) не мешает подключению - запрос подготовится при первом вызове
+    '''
+    if not DB_PREPARE:
+        return
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for name in PREPARED_STATEMENTS:
+                if name in conn.prepared:
+                    continue
+                try:
+                    cur.execute(prepare_sql(name))
+                    conn.prepared.add(name)
+                except psycopg2.ProgrammingError as e:
+                    print(f'[prepare] {name} postponed: {e}')
+    finally:
+        conn.autocommit = autocommit
+
+
+def execute_prepared(cur, name: str, args: Any) -> None:
+    '''
+    Горячий запрос по имени: EXECUTE name(...) вместо полного текста - Postgres не разбирает его заново,
+    а после нескольких вызовов берёт закэшированный generic-план.
+    При DB_PREPARE=0 или на подключении не из пула - обычным текстом
+    '''
+    sql, params = PREPARED_STATEMENTS[name]
+    prepared = getattr(cur.connection, 'prepared', None)
+    if not DB_PREPARE or prepared is None:
+        cur.execute(sql, args)
+        return
+    if name not in prepared:
+        cur.execute(prepare_sql(name))
+        prepared.add(name)
+    if isinstance(args, dict):
+        args = [args[param] for param, _ in params]
+    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(args))})" if args else f'EXECUTE {name}', args or None)
+
+
+def instrumented(func):
+    '''
+    Обёртка handler: замер фаз, заголовок Server-Timing в ответе и строка JSON-лога на каждый вызов
+    с request_id из context
+    '''
+    @functools.wraps(func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        timer = RequestTimer(getattr(context, 'request_id', None))
+        _request.timer = timer
+        response: Optional[Dict[str, Any]] = None
+        try:
+            response = func(event, context)
+            return response
+        finally:
+            _request.timer = None
+            total_ms = (time.perf_counter() - timer.started) * 1000
+            if response is not None:
+                headers = response.setdefault('headers', {})
+                headers['Server-Timing'] = timer.server_timing(total_ms)
+                headers['Timing-Allow-Origin'] = '*'
+                exposed = headers.get('Access-Control-Expose-Headers')
+                headers['Access-Control-Expose-Headers'] = f'{exposed}, Server-Timing' if exposed else 'Server-Timing'
+            if REQUEST_LOG:
+                print(json.dumps({
+                    'log': 'request', 'function': FUNCTION_NAME, 'request_id': timer.request_id,
+                    'method': event.get('httpMethod'), 'status': response.get('statusCode') if response else 500,
+                    'total_ms': round(total_ms, 1), 'queries': timer.queries,
+                    'cache': response.get('headers', {}).get('X-Cache') if response else None,
+                    **{f'{name}_ms': round(ms, 1) for name, ms in timer.phases.items()}
+                }))
+    return wrapper
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить подключение из пула за DB_POOL_TIMEOUT секунд"""
+
+
+class ConnectionPool:
+    '''
+    Пул подключений к БД, живущий на уровне модуля между тёплыми вызовами.
+    Функции деплоятся изолированно, поэтому пул есть в каждой из них.
+    Args: dsn - строка подключения, min_size/max_size - границы пула,
+          timeout - сколько ждать свободное подключение (сек),
+          ping_after - после скольких секунд простоя проверять подключение
+    '''
+
+    def __init__(self, dsn: str, min_size: int, max_size: int, timeout: float, ping_after: float):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._idle: List[Tuple[Any, float]] = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self.stats: Dict[str, float] = {
+            'created': 0, 'reused': 0, 'discarded': 0,
+            'waits': 0, 'wait_ms': 0.0, 'max_wait_ms': 0.0, 'timeouts': 0
+        }
+        for _ in range(min(self.min_size, self.max_size)):
+            self._size += 1
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory=TimedConnection)
+        prepare_statements(conn)
+        self.stats['created'] += 1
+        return conn
+
+    def _is_healthy(self, conn, idle_since: float) -> bool:
+        """Проверка подключения: дешёвая всегда, SELECT 1 - только после долгого простоя"""
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close_quietly(self, conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        started = time.monotonic()
+        while True:
+            with self._cond:
+                waited = False
+                while not self._idle and self._size >= self.max_size:
+                    waited = True
+                    remaining = self.timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        self.stats['timeouts'] += 1
+                        print(f'[db-pool] timeout after {self.timeout}s, stats={self.stats}')
+                        raise PoolTimeout(f'No free DB connection after {self.timeout}s')
+                    self._cond.wait(remaining)
+                if waited:
+                    wait_ms = (time.monotonic() - started) * 1000
+                    self.stats['waits'] += 1
+                    self.stats['wait_ms'] += wait_ms
+                    self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], wait_ms)
+                    print(f'[db-pool] waited {wait_ms:.1f}ms for connection, stats={self.stats}')
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                else:
+                    self._size += 1
+                    conn, idle_since = None, 0.0
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            if self._is_healthy(conn, idle_since):
+                self.stats['reused'] += 1
+                return conn
+
+            # Подключение умерло (рестарт БД, idle timeout) - выбрасываем и пробуем снова
+            self._close_quietly(conn)
+            with self._cond:
+                self._size -= 1
+                self.stats['discarded'] += 1
+                self._cond.notify()
+
+    def putconn(self, conn, broken: bool = False) -> None:
+        if not broken and not conn.closed:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+        with self._cond:
+            if broken or conn.closed:
+                self._close_quietly(conn)
+                self._size -= 1
+                self.stats['discarded'] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Ленивая инициализация пула при первом запросе"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                dsn = os.environ.get('DATABASE_URL')
+                if not dsn:
+                    raise ValueError('DATABASE_URL not set')
+                _pool = ConnectionPool(dsn, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_PING_AFTER)
+    return _pool
+
+
+class ResponseCache:
+    '''
+    Ограниченный LRU-кэш ответов на чтение внутри тёплого процесса.
+    Запись в том же процессе сбрасывает затронутые ключи, остальные процессы догоняют по TTL.
+    Чтение берёт generation() до запроса к БД и передаёт его в put: если запись сбросила ключ,
+    пока шёл запрос, прочитанная до неё строка в кэш не попадёт
+    Args: max_entries - предел числа записей, max_bytes - предел суммарного размера значений
+    '''
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[Tuple, Tuple[float, int, Any]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Поколение - счётчик сбросов; префикс -> поколение его последнего сброса.
+        # Словарь ограничен: при переполнении он очищается, а все чтения, начатые раньше, считаются устаревшими
+        self._generation = 0
+        self._invalidated: Dict[Tuple, int] = {}
+        self._floor = 0
+        self.stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'stale_puts': 0}
+
+    def get(self, key: Tuple) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[2]
+
+    def generation(self) -> int:
+        """Текущее поколение - берётся до запроса к БД, результат которого пойдёт в put"""
+        with self._lock:
+            return self._generation
+
+    def put(self, key: Tuple, value: Any, size: int, ttl: float, generation: Optional[int] = None) -> None:
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and self._invalidated_since(key, generation):
+                self.stats['stale_puts'] += 1
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+    def invalidate(self, *prefix: Any) -> None:
+        """Сброс всех записей, ключ которых начинается с prefix; идущие чтения prefix устаревают"""
+        with self._lock:
+            self._generation += 1
+            if len(self._invalidated) >= self.max_entries:
+                self._invalidated.clear()
+                self._floor = self._generation
+            self._invalidated[prefix] = self._generation
+            for key in [k for k in self._entries if k[:len(prefix)] == prefix]:
+                self._drop(key)
+                self.stats['invalidations'] += 1
+
+    def _invalidated_since(self, key: Tuple, generation: int) -> bool:
+        """Сбрасывался ли key или любой его префикс после поколения generation"""
+        if generation < self._floor:
+            return True
+        return any(self._invalidated.get(key[:i], -1) > generation for i in range(len(key) + 1))
+
+    def _drop(self, key: Tuple) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+_cache = ResponseCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
+
+
+class SingleFlight:
+    '''
+    Схлопывание одинаковых одновременных чтений внутри процесса: первый запрос с ключом
+    выполняет загрузку, остальные с тем же ключом ждут её результат (или исключение)
+    вместо собственного подключения и запроса к БД.
+    Запись отвязывает идущие чтения через forget - пришедшие после неё запросы начнут новое
+    '''
+
+    def __init__(self):
+        self._flights: Dict[Tuple, '_Flight'] = {}
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {'leaders': 0, 'coalesced': 0, 'errors': 0}
+
+    def do(self, key: Tuple, load: Callable[[], Any]) -> Tuple[Any, bool]:
+        '''
+        Returns: (результат load, True - если результат получен от чужого запроса)
+        '''
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            self.stats['leaders' if leader else 'coalesced'] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            flight.result = load()
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            self.stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    def forget(self, *prefix: Any) -> None:
+        """Отвязка идущих чтений, ключ которых начинается с prefix; ждущие их запросы получат результат"""
+        with self._lock:
+            for key in [k for k in self._flights if k[:len(prefix)] == prefix]:
+                del self._flights[key]
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+_flights = SingleFlight()
+
+
+def invalidate(*prefix: Any) -> None:
+    """После записи: сброс кэша и отвязка чтений, начатых до неё"""
+    _cache.invalidate(*prefix)
+    _flights.forget(*prefix)
+
+
+class UnitGrid:
+    '''
+    Индекс свободных юнитов в памяти процесса: равномерная сетка по широте/долготе, ячейка - cell_deg градусов.
+    Ближайшие ищутся кольцами ячеек вокруг точки, пока следующее кольцо не может быть ближе k-го найденного.
+    Свежесть: записи этого процесса применяются сразу, изменения других процессов догружаются
+    по last_update (UNITS_GRID_SYNC_SQL), когда с прошлой догрузки прошло больше ttl.
+    '''
+
+    def __init__(self, cell_deg: float, ttl: float):
+        self.cell_deg = cell_deg
+        self.ttl = ttl
+        self._cells: Dict[Tuple[int, int], Dict[int, Tuple[float, float, str]]] = {}
+        self._unit_cells: Dict[int, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._since: Optional[datetime] = None
+        self._synced = 0.0
+
+    def __len__(self) -> int:
+        return len(self._unit_cells)
+
+    def stale(self) -> bool:
+        return self._since is None or time.monotonic() - self._synced > self.ttl
+
+    def upsert(self, unit_id: int, unit_name: str, status: str, lat: Optional[float], lon: Optional[float]) -> None:
+        """Новое состояние юнита; в сетке остаются только свободные юниты с координатами"""
+        with self._lock:
+            self._remove(unit_id)
+            if status == 'available' and lat is not None and lon is not None:
+                cell = (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+                self._cells.setdefault(cell, {})[unit_id] = (lat, lon, unit_name)
+                self._unit_cells[unit_id] = cell
+
+    def remove(self, unit_id: int) -> None:
+        with self._lock:
+            self._remove(unit_id)
+
+    def _remove(self, unit_id: int) -> None:
+        cell = self._unit_cells.pop(unit_id, None)
+        if cell is not None:
+            units = self._cells[cell]
+            del units[unit_id]
+            if not units:
+                del self._cells[cell]
+
+    def sync(self, cur) -> None:
+        '''
+        Догрузка изменений из БД, если индекс устарел. Параллельные запросы не догружают одно и то же:
+        пока один поток читает изменения, остальные ждут и затем видят свежий индекс
+        '''
+        with self._sync_lock:
+            if not self.stale():
+                return
+            execute_prepared(cur, 'units_grid_sync', {
+                'overlap': UNITS_SINCE_OVERLAP_SECONDS, 'since': self._since, 'ttl': UNITS_TOMBSTONE_TTL_DAYS
+            })
+            next_since, full, units, deleted = cur.fetchone()
+            if full:
+                with self._lock:
+                    self._cells.clear()
+                    self._unit_cells.clear()
+            for unit_id, unit_name, status, lat, lon in units:
+                self.upsert(unit_id, unit_name, status, lat, lon)
+            for unit_id in deleted:
+                self.remove(unit_id)
+            self._since = next_since
+            self._synced = time.monotonic()
+
+    def nearest(self, lat: float, lon: float, k: int) -> List[Tuple[float, int, float, float, str]]:
+        '''
+        k ближайших к точке свободных юнитов
+        Returns: [(расстояние в метрах, id, lat, lon, unit_name)] по возрастанию расстояния, затем id
+        '''
+        lon_scale = math.cos(math.radians(lat))
+        center_lat = math.floor(lat / self.cell_deg)
+        center_lon = math.floor(lon / self.cell_deg)
+        best: List[Tuple[float, int, float, float, str]] = []  # max-куча через отрицание: (-d, -id, ...)
+
+        def scan(units: Dict[int, Tuple[float, float, str]]) -> None:
+            for unit_id, (unit_lat, unit_lon, unit_name) in units.items():
+                distance = METERS_PER_DEGREE * math.hypot(unit_lat - lat, (unit_lon - lon) * lon_scale)
+                item = (-distance, -unit_id, unit_lat, unit_lon, unit_name)
+                if len(best) < k:
+                    heapq.heappush(best, item)
+                elif item > best[0]:
+                    heapq.heapreplace(best, item)
+
+        with self._lock:
+            visited = 0
+            ring = 0
+            while True:
+                # Любая точка кольца ring дальше ring - 1 ячеек от точки вызова хотя бы по одной оси
+                bound = (ring - 1) * self.cell_deg * min(1.0, lon_scale) * METERS_PER_DEGREE
+                if len(best) == k and bound > -best[0][0]:
+                    break
+                if visited >= len(self._cells):
+                    break
+                if (2 * ring + 1) ** 2 > 2 * len(self._cells):
+                    # Юниты разрежены: колец просмотрено больше, чем занято ячеек, - дешевле пройти оставшиеся целиком
+                    for (cell_lat, cell_lon), units in self._cells.items():
+                        if max(abs(cell_lat - center_lat), abs(cell_lon - center_lon)) >= ring:
+                            scan(units)
+                    break
+                for cell_lat in range(center_lat - ring, center_lat + ring + 1):
+                    edge = abs(cell_lat - center_lat) == ring
+                    step = 1 if edge else 2 * ring
+                    for cell_lon in range(center_lon - ring, center_lon + ring + 1, step):
+                        units = self._cells.get((cell_lat, cell_lon))
+                        if units:
+                            visited += 1
+                            scan(units)
+                ring += 1
+
+        return sorted(((-d, -i, la, lo, name) for d, i, la, lo, name in best), key=lambda item: item[:2])
+
+
+_grid = UnitGrid(UNITS_GRID_CELL_DEG, UNITS_GRID_TTL)
+
+
+def parse_members(body: Dict[str, Any]) -> Optional[List[str]]:
+    """Список участников из тела запроса; None - если поле передано не списком строк"""
+    members = body.get('members', [])
+    if not isinstance(members, list) or not all(isinstance(m, str) for m in members):
+        return None
+    return members
+
+
+def parse_point(lat: Any, lon: Any) -> Optional[Tuple[float, float]]:
+    '''
+    Координаты из запроса; None - если не переданы обе
+    Raises: ValueError, если передана только одна или значение вне диапазона
+    '''
+    if lat is None and lon is None:
+        return None
+    if lat is None or lon is None or isinstance(lat, bool) or isinstance(lon, bool):
+        raise ValueError('lat и lon передаются вместе')
+    lat, lon = float(lat), float(lon)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError('lat в [-90, 90], lon в [-180, 180]')
+    return lat, lon
+
+
+def nearest_units(params: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    ?near=lat,lon&k - k ближайших к точке вызова свободных юнитов.
+    Свежий индекс в памяти отвечает без подключения к БД; устаревший сначала догружается,
+    при UNITS_GRID=0 поиск идёт запросом units_nearest
+    '''
+    try:
+        lat, _, lon = params['near'].partition(',')
+        point = parse_point(lat, lon or None)
+        k = max(1, min(int(params.get('k', UNITS_NEAREST_DEFAULT)), UNITS_NEAREST_MAX))
+    except ValueError as e:
+        return bad_request(f'near=lat,lon, k - число: {e}')
+
+    if not UNITS_GRID or _grid.stale():
+        with request_phase('connect'):
+            pool = get_pool()
+            conn = pool.getconn()
+        broken = False
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                if UNITS_GRID:
+                    _grid.sync(cur)
+                else:
+                    execute_prepared(cur, 'units_nearest', {'lat': point[0], 'lon': point[1], 'k': k})
+                    found = [(distance, unit_id, lat, lon, name) for unit_id, name, lat, lon, distance in cur.fetchall()]
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            pool.putconn(conn, broken=broken)
+    if UNITS_GRID:
+        found = _grid.nearest(point[0], point[1], k)
+
+    with request_phase('serialize'):
+        body = json.dumps({
+            'units': [{'id': unit_id, 'unitName': name, 'lat': lat, 'lon': lon, 'distanceM': round(distance, 1)}
+                      for distance, unit_id, lat, lon, name in found],
+            'source': 'grid' if UNITS_GRID else 'sql'
+        }, ensure_ascii=False)
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+def bucket_seconds(bucket: int) -> float:
+    """Середина логарифмической корзины width_bucket(ln(секунды), 0, ln(RESPONSE_MAX_SECONDS), RESPONSE_BUCKETS)"""
+    if bucket > RESPONSE_BUCKETS:
+        return float(RESPONSE_MAX_SECONDS)
+    return math.exp((bucket - 0.5) * math.log(RESPONSE_MAX_SECONDS) / RESPONSE_BUCKETS)
+
+
+def response_percentiles(buckets: List[Tuple[int, int]]) -> Dict[str, Any]:
+    """Число ответов и процентили (секунды, точность ~5%) по гистограмме [(корзина, число)] в порядке корзин"""
+    count = sum(n for _, n in buckets)
+    result: Dict[str, Any] = {'count': count}
+    for q in RESPONSE_PERCENTILES:
+        rank = max(1, math.ceil(q / 100 * count))
+        seen = 0
+        for bucket, n in buckets:
+            seen += n
+            if seen >= rank:
+                result[f'p{q}'] = round(bucket_seconds(bucket), 1)
+                break
+        else:
+            result[f'p{q}'] = None
+    return result
+
+
+def status_time(params: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    ?view=status-time&from&to&period&unit_id - время в статусах по юнитам и периодам
+    и процентили времени реагирования (en-route -> on-scene) по периодам.
+    Читаются только дневные сводки V0012 - год по всему парку это сотни тысяч строк, а не история
+    '''
+    try:
+        to_day = date.fromisoformat(params['to']) if params.get('to') else date.today() + timedelta(days=1)
+        from_day = date.fromisoformat(params['from']) if params.get('from') else to_day - timedelta(days=STATUS_DEFAULT_DAYS)
+        unit_id = int(params['unit_id']) if params.get('unit_id') else None
+    except ValueError:
+        return bad_request('from и to - даты YYYY-MM-DD (to не включается), unit_id - число')
+    period = params.get('period', 'day')
+    if period not in STATUS_PERIODS:
+        return bad_request(f"period - одно из: {', '.join(STATUS_PERIODS)}")
+    if not 0 < (to_day - from_day).days <= STATUS_MAX_DAYS:
+        return bad_request(f'Окно from..to - от 1 до {STATUS_MAX_DAYS} дней')
+
+    cache_key = ('status-time', from_day, to_day, period, unit_id)
+    cached = _cache.get(cache_key)
+    if cached is not None:
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'X-Cache': 'HIT'},
+            'body': cached,
+            'isBase64Encoded': False
+        }
+    query = {'from': from_day, 'to': to_day, 'all': period == 'all', 'trunc': 'day' if period == 'all' else period,
+             'unit_id': unit_id}
+    body, shared = _flights.do(cache_key, lambda: read_status_time(cache_key, query))
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*',
+                    'X-Cache': 'COALESCED' if shared else 'MISS'},
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+def read_status_time(cache_key: Tuple, query: Dict[str, Any]) -> str:
+    generation = _cache.generation()
+    with request_phase('connect'):
+        pool = get_pool()
+        conn = pool.getconn()
+    broken = False
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(STATUS_TIME_SQL, query)
+            status_rows = cur.fetchall()
+            cur.execute(STATUS_RESPONSE_SQL, query)
+            response_rows = cur.fetchall()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        pool.putconn(conn, broken=broken)
+
+    with request_phase('serialize'):
+        rows: Dict[Tuple[date, int], Dict[str, Any]] = {}
+        for period, unit_id, status, seconds, entries in status_rows:
+            row = rows.setdefault((period, unit_id), {'period': period.isoformat(), 'unitId': unit_id,
+                                                      'seconds': {}, 'entries': {}})
+            row['seconds'][status] = round(seconds, 1)
+            row['entries'][status] = entries
+        for row in rows.values():
+            total = sum(row['seconds'].values())
+            busy = sum(row['seconds'].get(status, 0) for status in BUSY_STATUSES)
+            row['busyShare'] = round(busy / total, 4) if total else None
+
+        histograms: Dict[date, List[Tuple[int, int]]] = {}
+        for period, bucket, responses in response_rows:
+            histograms.setdefault(period, []).append((bucket, responses))
+
+        body = json.dumps({
+            'from': query['from'].isoformat(),
+            'to': query['to'].isoformat(),
+            'period': 'all' if query['all'] else query['trunc'],
+            'statusTime': list(rows.values()),
+            'responseTime': [{'period': period.isoformat(), **response_percentiles(buckets)}
+                             for period, buckets in histograms.items()],
+        }, ensure_ascii=False)
+    _cache.put(cache_key, body, len(body), STATUS_CACHE_TTL, generation)
+    return body
+
+
+def read_units(cache_key: Tuple, updated_since: Optional[datetime], after_id: int,
+               limit: Optional[int]) -> str:
+    '''
+    Страница списка юнитов из БД; текст ответа попадает в кэш процесса.
+    Документ ответа целиком собирается в Postgres и отдаётся как текст без разбора в Python.
+    Участники - коррелированным подзапросом только для юнитов страницы
+    '''
+    generation = _cache.generation()
+    with request_phase('connect'):
+        pool = get_pool()
+        conn = pool.getconn()
+    broken = False
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            execute_prepared(cur, 'units_list', {
+                'overlap': UNITS_SINCE_OVERLAP_SECONDS, 'since': updated_since, 'ttl': UNITS_TOMBSTONE_TTL_DAYS,
+                'after_id': after_id, 'limit': limit, 'fetch': limit + 1 if limit else None
+            })
+            body = cur.fetchone()[0]
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        pool.putconn(conn, broken=broken)
+    _cache.put(cache_key, body, len(body), CACHE_TTL, generation)
+    return body
+
+
+def bad_request(message: str) -> Dict[str, Any]:
+    return {
+        'statusCode': 400,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': message}),
+        'isBase64Encoded': False
+    }
+
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: API для управления экипажами и их участниками
-    Args: event с httpMethod, body, queryStringParameters
+    Args: event с httpMethod, body, queryStringParameters;
+          GET ?near=lat,lon&k - ближайшие к точке вызова свободные юниты;
+          GET ?view=status-time&from&to&period&unit_id - время в статусах и время реагирования
     Returns: JSON с данными экипажей
     '''
     method: str = event.get('httpMethod', 'GET')
@@ -26,13 +1033,64 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    dsn = os.environ.get('DATABASE_URL')
-    schema = 't_p48049793_mobile_digital_compu'
+    schema = SCHEMA
+    params = event.get('queryStringParameters', {}) or {}
+    
+    if method == 'GET' and (params.get('near') or params.get('view') == 'status-time'):
+        try:
+            return nearest_units(params) if params.get('near') else status_time(params)
+        except Exception as e:
+            return {
+                'statusCode': 500,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': str(e)}),
+                'isBase64Encoded': False
+            }
+    
+    # Одинаковые опросы списка в пределах CACHE_TTL отдаются из кэша процесса без подключения к БД
+    if method == 'GET':
+        cache_key = ('units', params.get('updated_since'), params.get('after_id'), params.get('limit'))
+        cached = _cache.get(cache_key)
+        if cached is not None:
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'X-Cache': 'HIT'},
+                'body': cached,
+                'isBase64Encoded': False
+            }
+        
+        # ?updated_since=<ISO> - только изменённые юниты и id удалённых; ?after_id&limit - страницы по id
+        try:
+            updated_since = datetime.fromisoformat(params['updated_since']) if params.get('updated_since') else None
+            after_id = int(params.get('after_id', 0))
+            limit = max(1, min(int(params['limit']), UNITS_MAX_PAGE)) if params.get('limit') else None
+        except ValueError:
+            return bad_request('updated_since - ISO дата, after_id и limit - числа')
+        
+        # Промах при всплеске одинаковых опросов: один запрос к БД на процесс, остальные ждут его текст
+        try:
+            body, shared = _flights.do(cache_key, lambda: read_units(cache_key, updated_since, after_id, limit))
+        except Exception as e:
+            return {
+                'statusCode': 500,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': str(e)}),
+                'isBase64Encoded': False
+            }
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*',
+                        'X-Cache': 'COALESCED' if shared else 'MISS'},
+            'body': body,
+            'isBase64Encoded': False
+        }
     
     try:
-        conn = psycopg2.connect(dsn)
+        with request_phase('connect'):
+            pool = get_pool()
+            conn = pool.getconn()
         conn.autocommit = True
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur = conn.cursor()
     except Exception as e:
         return {
             'statusCode': 500,
@@ -41,49 +1099,35 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    broken = False
     try:
-        if method == 'GET':
-            cur.execute(f'''
-                SELECT u.id, u.unit_name, u.status, u.location, u.last_update,
-                       COALESCE(json_agg(um.member_name) FILTER (WHERE um.member_name IS NOT NULL), '[]') as members
-                FROM {schema}.units u
-                LEFT JOIN {schema}.unit_members um ON u.id = um.unit_id
-                GROUP BY u.id, u.unit_name, u.status, u.location, u.last_update
-                ORDER BY u.id
-            ''')
-            
-            units = []
-            for row in cur.fetchall():
-                units.append({
-                    'id': row['id'],
-                    'unitName': row['unit_name'],
-                    'status': row['status'],
-                    'location': row['location'],
-                    'lastUpdate': row['last_update'].isoformat() if row['last_update'] else None,
-                    'members': json.loads(row['members']) if isinstance(row['members'], str) else row['members']
-                })
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'units': units}),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'POST':
+        # Каждая мутация - один statement с data-modifying CTE: атомарно и за один round trip,
+        # NOTIFY для подписчиков storage (?watch=unit) уходит вместе с коммитом
+        if method == 'POST':
             body = json.loads(event.get('body', '{}'))
-            unit_name = body.get('unitName', '').replace("'", "''")
-            status = body.get('status', 'available')
-            location = body.get('location', '').replace("'", "''")
-            members = body.get('members', [])
-            now = datetime.now().isoformat()
+            members = parse_members(body)
+            if members is None:
+                return bad_request('members должен быть списком строк')
+            try:
+                point = parse_point(body.get('lat'), body.get('lon')) or (None, None)
+            except (TypeError, ValueError) as e:
+                return bad_request(f'Некорректные координаты: {e}')
             
-            cur.execute(f"INSERT INTO {schema}.units (unit_name, status, location, last_update) VALUES ('{unit_name}', '{status}', '{location}', '{now}') RETURNING id")
-            unit_id = cur.fetchone()['id']
-            
-            for member in members:
-                member_safe = member.replace("'", "''")
-                cur.execute(f"INSERT INTO {schema}.unit_members (unit_id, member_name) VALUES ({unit_id}, '{member_safe}')")
+            cur.execute(f'''
+                WITH u AS (
+                    INSERT INTO {schema}.units (unit_name, status, location, lat, lon, last_update)
+                    VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+                    RETURNING id
+                ), m AS (
+                    INSERT INTO {schema}.unit_members (unit_id, member_name)
+                    SELECT u.id, member FROM u, unnest(%s::text[]) AS member
+                )
+                SELECT id, pg_notify(%s, json_build_object('entity', 'unit', 'id', id)::text) FROM u
+            ''', (body.get('unitName', ''), body.get('status', 'available'), body.get('location', ''), *point,
+                  members, CHANGES_CHANNEL))
+            unit_id = cur.fetchone()[0]
+            invalidate('units')
+            _grid.upsert(unit_id, body.get('unitName', ''), body.get('status', 'available'), *point)
             
             return {
                 'statusCode': 201,
@@ -94,21 +1138,35 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         elif method == 'PUT':
             body = json.loads(event.get('body', '{}'))
-            unit_id = body.get('id')
-            now = datetime.now().isoformat()
-            
-            if body.get('status'):
-                cur.execute(f"UPDATE {schema}.units SET status = '{body['status']}', last_update = '{now}' WHERE id = {unit_id}")
+            members = parse_members(body)
+            try:
+                unit_id = int(body.get('id'))
+            except (TypeError, ValueError):
+                return bad_request('Нужен числовой id')
+            if members is None:
+                return bad_request('members должен быть списком строк')
+            try:
+                point = parse_point(body.get('lat'), body.get('lon')) or (None, None)
+            except (TypeError, ValueError) as e:
+                return bad_request(f'Некорректные координаты: {e}')
             
-            if body.get('location'):
-                location_safe = body['location'].replace("'", "''")
-                cur.execute(f"UPDATE {schema}.units SET location = '{location_safe}', last_update = '{now}' WHERE id = {unit_id}")
+            # Пустые status/location/координаты не меняют значение; состав заменяется, только если передан members.
+            # Переход статуса в историю и сводки времени в статусе пишет триггер units_status_track (V0012)
+            execute_prepared(cur, 'units_update', (body.get('status') or None, body.get('location') or None, *point,
+                                                   unit_id, 'members' in body, members, 'members' in body,
+                                                   CHANGES_CHANNEL))
             
-            if 'members' in body:
-                cur.execute(f'DELETE FROM {schema}.unit_members WHERE unit_id = {unit_id}')
-                for member in body['members']:
-                    member_safe = member.replace("'", "''")
-                    cur.execute(f"INSERT INTO {schema}.unit_members (unit_id, member_name) VALUES ({unit_id}, '{member_safe}')")
+            updated = cur.fetchone()
+            invalidate('units')
+            if updated is not None:
+                _grid.upsert(*updated[:5])
+            if updated is None:
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Юнит не найден'}),
+                    'isBase64Encoded': False
+                }
             
             return {
                 'statusCode': 200,
@@ -118,11 +1176,28 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
         
         elif method == 'DELETE':
-            params = event.get('queryStringParameters', {})
-            unit_id = params.get('id')
+            try:
+                unit_id = int(params.get('id'))
+            except (TypeError, ValueError):
+                return bad_request('Нужен числовой id')
             
-            cur.execute(f'DELETE FROM {schema}.unit_members WHERE unit_id = {unit_id}')
-            cur.execute(f'DELETE FROM {schema}.units WHERE id = {unit_id}')
+            cur.execute(f'''
+                WITH m AS (
+                    DELETE FROM {schema}.unit_members WHERE unit_id = %s
+                ), u AS (
+                    DELETE FROM {schema}.units WHERE id = %s RETURNING id
+                ), t AS (
+                    INSERT INTO {schema}.unit_tombstones (unit_id)
+                    SELECT id FROM u
+                    ON CONFLICT (unit_id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at
+                ), old AS (
+                    DELETE FROM {schema}.unit_tombstones
+                    WHERE deleted_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+                )
+                SELECT id, pg_notify(%s, json_build_object('entity', 'unit', 'id', id)::text) FROM u
+            ''', (unit_id, unit_id, UNITS_TOMBSTONE_TTL_DAYS, CHANGES_CHANNEL))
+            invalidate('units')
+            _grid.remove(unit_id)
             
             return {
                 'statusCode': 200,
@@ -132,6 +1207,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
     
     except Exception as e:
+        broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -140,11 +1216,29 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     finally:
         cur.close()
-        conn.close()
+        pool.putconn(conn, broken=broken)
     
     return {
         'statusCode': 405,
         'headers': {'Access-Control-Allow-Origin': '*'},
         'body': json.dumps({'error': 'Метод не поддерживается'}),
         'isBase64Encoded': False
-    }
\ No newline at end of file
+    }
+
+
+def warm_up() -> None:
+    '''
+    Подготовка экземпляра при импорте модуля, до первого запроса: пул открывает подключение и готовит
+    на нём горячие запросы - PREPARE разбирает их, и бэкенд Postgres загружает метаданные units и unit_members
+    '''
+    started = time.perf_counter()
+    try:
+        pool = get_pool()
+        pool.putconn(pool.getconn())
+        print(f'[warm-up] {(time.perf_counter() - started) * 1000:.1f}ms')
+    except Exception as e:
+        print(f'[warm-up] skipped: {e}')
+
+
+if DB_WARMUP and os.environ.get('DATABASE_URL'):
+    warm_up()
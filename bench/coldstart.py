@@ -0,0 +1,103 @@
+"""
+Business: Замер cold start backend-функций MDC
+Args: --dsn или DATABASE_URL, --runs - сколько раз запускать каждую функцию в чистом процессе
+Returns: медианы времени импорта модуля, первого и второго запроса - с warm_up и без
+
+Каждый прогон - отдельный интерпретатор, как новый экземпляр функции при масштабировании.
+Импорт включает warm_up (подключение к БД и прогрев запросов), если он не выключен.
+
+Примеры:
+    python bench/coldstart.py --dsn postgresql://localhost/mdc_bench
+    python bench/coldstart.py --runs 10 --importtime
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+from run import BACKEND, with_search_path
+
+# Типичный первый запрос нового экземпляра
+FIRST_REQUESTS: Dict[str, Dict[str, Any]] = {
+    'storage': {'httpMethod': 'GET', 'queryStringParameters': {'key': 'mdc_calls'}, 'headers': {}, 'body': ''},
+    'units': {'httpMethod': 'GET', 'queryStringParameters': {}, 'headers': {}, 'body': ''},
+    'online-users': {'httpMethod': 'GET', 'queryStringParameters': {'resource': 'users'}, 'headers': {}, 'body': ''},
+    'calls': {'httpMethod': 'GET', 'queryStringParameters': {'view': 'queue'}, 'headers': {}, 'body': ''},
+}
+
+# Выполняется в чистом интерпретаторе: время от старта импорта модуля до конца второго запроса
+CHILD = '''
+import importlib.util, json, sys, time, types
+path, event = sys.argv[1], json.loads(sys.argv[2])
+context = types.SimpleNamespace(request_id='coldstart', function_name='coldstart')
+t0 = time.perf_counter()
+spec = importlib.util.spec_from_file_location('coldstart_function', path)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+t1 = time.perf_counter()
+first = module.handler(event, context)
+t2 = time.perf_counter()
+module.handler(event, context)
+t3 = time.perf_counter()
+print(json.dumps({'import_ms': (t1 - t0) * 1000, 'first_ms': (t2 - t1) * 1000,
+                  'second_ms': (t3 - t2) * 1000, 'status': first.get('statusCode')}))
+'''
+
+
+def measure(name: str, dsn: str, warmup: bool) -> Dict[str, Any]:
+    env = dict(os.environ, DATABASE_URL=dsn, DB_WARMUP='1' if warmup else '0', REQUEST_LOG='0')
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD, str(BACKEND / name / 'index.py'), json.dumps(FIRST_REQUESTS[name])],
+        env=env, capture_output=True, text=True, check=True
+    )
+    # Последняя строка - замер, до неё - логи функции ([warm-up] и т.п.)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def import_breakdown(name: str, top: int) -> List[str]:
+    """Самые дорогие импорты верхнего уровня по -X importtime (кумулятивно), без warm_up"""
+    code = (f'import importlib.util as u; s = u.spec_from_file_location("f", {str(BACKEND / name / "index.py")!r}); '
+            's.loader.exec_module(u.module_from_spec(s))')
+    env = {k: v for k, v in os.environ.items() if k != 'DATABASE_URL'}
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            env=dict(env, DB_WARMUP='0'), capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        # Вложенные импорты отмечены отступом в имени модуля
+        if len(parts) == 3 and parts[1].strip().isdigit() and not parts[2].startswith('  '):
+            rows.append((int(parts[1]), parts[2].strip()))
+    return [f'{us / 1000:8.1f}ms  {module}' for us, module in sorted(rows, reverse=True)[:top]]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Замер cold start backend-функций MDC')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL') or os.environ.get('DATABASE_URL'))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--importtime', action='store_true', help='показать самые дорогие импорты')
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+    dsn = with_search_path(args.dsn)
+
+    print(f"{'function':<14}{'warm_up':>9}{'import_ms':>12}{'first_ms':>11}{'second_ms':>11}{'cold_total':>12}")
+    for name in FIRST_REQUESTS:
+        for warmup in (False, True):
+            samples = [measure(name, dsn, warmup) for _ in range(args.runs)]
+            row = {k: statistics.median(s[k] for s in samples) for k in ('import_ms', 'first_ms', 'second_ms')}
+            print(f"{name:<14}{'on' if warmup else 'off':>9}{row['import_ms']:>12.1f}{row['first_ms']:>11.1f}"
+                  f"{row['second_ms']:>11.1f}{row['import_ms'] + row['first_ms']:>12.1f}")
+
+    if args.importtime:
+        for name in FIRST_REQUESTS:
+            print(f'\n{name}: импорты')
+            for line in import_breakdown(name, 10):
+                print(line)
+
+
+if __name__ == '__main__':
+    main()
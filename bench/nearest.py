@@ -0,0 +1,155 @@
+"""
+Business: Замер подбора ближайших свободных юнитов по индексу в памяти (UnitGrid функции units)
+Args: --units - сколько юнитов движется по городу, --queries - число поисков, --k,
+      --moves - сколько юнитов сдвигается между поисками
+Returns: p50/p95/p99 поиска по сетке и полным перебором, время обновления позиции, проверку совпадения;
+         с --dsn - то же для запроса units_nearest (UNITS_GRID=0)
+
+Без --dsn БД не нужна: сетка наполняется и обновляется напрямую, как после PUT и догрузки изменений.
+Полный перебор - те же формулы расстояния без индекса, он же эталон для проверки результатов.
+С --dsn те же юниты и сдвиги пишутся в units базы с db_migrations, и поиск замеряется ещё и запросом
+units_nearest по частичному индексу. Всё - в одной транзакции, которая откатывается: прочие юниты базы
+на время замера становятся недоступными и после него не меняются.
+
+Примеры:
+    python bench/nearest.py
+    python bench/nearest.py --units 20000 --k 10 --cell 0.005
+    python bench/nearest.py --dsn postgresql://localhost/mdc_bench --queries 5000
+"""
+
+import argparse
+import heapq
+import math
+import os
+import random
+import statistics
+import time
+from typing import Dict, List, Tuple
+
+from psycopg2.extras import execute_values
+
+from run import load_function, percentile, with_search_path
+
+# Город ~45 x 30 км
+LAT_RANGE = (55.55, 55.95)
+LON_RANGE = (37.35, 37.85)
+STATUSES = ['available', 'available', 'en-route', 'on-scene', 'unavailable']
+
+
+def brute_force(units: Dict[int, Tuple[str, float, float]], lat: float, lon: float, k: int,
+                meters_per_degree: float) -> List[Tuple[float, int]]:
+    lon_scale = math.cos(math.radians(lat))
+    return heapq.nsmallest(k, (
+        (meters_per_degree * math.hypot(u_lat - lat, (u_lon - lon) * lon_scale), unit_id)
+        for unit_id, (status, u_lat, u_lon) in units.items() if status == 'available'
+    ))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--units', type=int, default=5000)
+    parser.add_argument('--queries', type=int, default=20000)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--moves', type=int, default=25, help='сколько юнитов сдвигается перед каждым поиском')
+    parser.add_argument('--cell', type=float, default=None, help='размер ячейки в градусах (UNITS_GRID_CELL_DEG)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dsn', help='замерить и запрос units_nearest на этой БД (db_migrations накатаны)')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DB_WARMUP', '0')
+    if args.dsn:
+        os.environ['DATABASE_URL'] = with_search_path(args.dsn)
+    units_module = load_function('units')
+    grid = units_module.UnitGrid(args.cell or units_module.UNITS_GRID_CELL_DEG, ttl=math.inf)
+    meters_per_degree = units_module.METERS_PER_DEGREE
+    rng = random.Random(args.seed)
+
+    units: Dict[int, Tuple[str, float, float]] = {}
+    for unit_id in range(1, args.units + 1):
+        units[unit_id] = (rng.choice(STATUSES), rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE))
+        grid.upsert(unit_id, f'U-{unit_id}', *units[unit_id])
+
+    conn = cur = None
+    db_ids: Dict[int, int] = {}  # id юнита замера -> id строки в units
+    if args.dsn:
+        pool = units_module.get_pool()
+        conn = pool.getconn()
+        conn.autocommit = False
+        cur = conn.cursor()
+        cur.execute("UPDATE units SET status = 'unavailable' WHERE status = 'available'")
+        rows = execute_values(cur, 'INSERT INTO units (unit_name, status, lat, lon) VALUES %s RETURNING id', [
+            (f'nearest-bench-{unit_id}', status, lat, lon) for unit_id, (status, lat, lon) in units.items()
+        ], fetch=True)
+        db_ids = {unit_id: row[0] for unit_id, row in zip(units, rows)}
+        cur.execute('ANALYZE units')
+
+    moves_per_query = min(args.moves, args.units)
+    grid_ms: List[float] = []
+    brute_ms: List[float] = []
+    update_ms: List[float] = []
+    sql_ms: List[float] = []
+    sql_update_ms: List[float] = []
+    mismatches = 0
+    sql_mismatches = 0
+
+    for _ in range(args.queries):
+        # Движение: юниты смещаются на десятки метров, часть меняет статус
+        moved = rng.sample(range(1, args.units + 1), moves_per_query)
+        for unit_id in moved:
+            status, lat, lon = units[unit_id]
+            if rng.random() < 0.1:
+                status = rng.choice(STATUSES)
+            units[unit_id] = (status, lat + rng.gauss(0, 0.0003), lon + rng.gauss(0, 0.0005))
+            started = time.perf_counter()
+            grid.upsert(unit_id, f'U-{unit_id}', *units[unit_id])
+            update_ms.append((time.perf_counter() - started) * 1000)
+        if cur is not None and moved:
+            # Сдвиги одним запросом на поиск - в БД их пишут PUT разных терминалов, здесь важен только индекс
+            started = time.perf_counter()
+            execute_values(cur, '''
+                UPDATE units SET status = v.status, lat = v.lat, lon = v.lon
+                FROM (VALUES %s) v(id, status, lat, lon) WHERE units.id = v.id
+            ''', [(db_ids[unit_id], *units[unit_id]) for unit_id in moved])
+            sql_update_ms.append((time.perf_counter() - started) * 1000 / len(moved))
+
+        lat, lon = rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE)
+        started = time.perf_counter()
+        found = grid.nearest(lat, lon, args.k)
+        grid_ms.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        expected = brute_force(units, lat, lon, args.k, meters_per_degree)
+        brute_ms.append((time.perf_counter() - started) * 1000)
+
+        if [unit_id for _, unit_id, *_ in found] != [unit_id for _, unit_id in expected]:
+            mismatches += 1
+
+        if cur is not None:
+            started = time.perf_counter()
+            units_module.execute_prepared(cur, 'units_nearest', {'lat': lat, 'lon': lon, 'k': args.k})
+            rows = cur.fetchall()
+            sql_ms.append((time.perf_counter() - started) * 1000)
+            if [row[0] for row in rows] != [db_ids[unit_id] for _, unit_id in expected]:
+                sql_mismatches += 1
+
+    if conn is not None:
+        cur.close()
+        conn.rollback()
+        pool.putconn(conn)
+
+    available = sum(1 for status, _, _ in units.values() if status == 'available')
+    print(f'{args.units} юнитов ({available} свободны), k={args.k}, {args.queries} поисков, '
+          f'{moves_per_query} сдвигов перед каждым, ячейка {grid.cell_deg}°')
+    print(f"{'':<14}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'mean мс':>10}")
+    for name, values in (('сетка', grid_ms), ('перебор', brute_ms), ('обновление', update_ms),
+                         ('SQL', sql_ms), ('SQL обновление', sql_update_ms)):
+        if values:
+            print(f'{name:<14}{percentile(values, 50):>10.4f}{percentile(values, 95):>10.4f}'
+                  f'{percentile(values, 99):>10.4f}{statistics.mean(values):>10.4f}')
+    print(f'расхождений с перебором: {mismatches}')
+    if args.dsn:
+        print(f'расхождений SQL с перебором: {sql_mismatches}')
+
+
+if __name__ == '__main__':
+    main()
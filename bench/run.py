@@ -0,0 +1,444 @@
+"""
+Business: Нагрузочный прогон backend-функций MDC без облачной платформы
+Args: сценарий, конкурентность и длительность из командной строки; БД - --dsn или DATABASE_URL
+Returns: отчёт о пропускной способности, p50/p95/p99 и числе запросов к БД на HTTP-запрос
+
+Функции вызываются напрямую через handler(event, context) в одном процессе - как тёплый
+экземпляр функции под нагрузкой. Для одноразовой БД схема поднимается из db_migrations (--setup).
+
+Примеры:
+    python bench/run.py --dsn postgresql://localhost/mdc_bench --setup --scenario mixed
+    python bench/run.py --scenario heartbeat-storm --concurrency 32 --duration 20 --save
+    python bench/run.py --scenario storage-poll --compare
+    python bench/run.py --scenario unit-churn --no-cache --no-prepare --save   # базовая линия без PREPARE
+    python bench/run.py --scenario storage-poll --accept-encoding '' --save     # базовая линия без сжатия
+    git worktree add /tmp/mdc-before <коммит>
+    python bench/run.py --root /tmp/mdc-before --setup --scenario mixed --save  # базовая линия старого коммита
+"""
+
+import argparse
+import base64
+import importlib.util
+import json
+import math
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psycopg2
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND = ROOT / 'backend'
+MIGRATIONS = ROOT / 'db_migrations'
+BASELINES = Path(__file__).resolve().parent / 'baselines'
+SCHEMA = 't_p48049793_mobile_digital_compu'
+
+STORAGE_KEYS = ['mdc_calls', 'mdc_crews', 'mdc_users', 'mdc_shift_sessions', 'mdc_system_restrictions']
+UNIT_STATUSES = ['available', 'en-route', 'on-scene', 'unavailable']
+CALL_PRIORITIES = ['code2', 'code3', 'code99']
+# Заголовок Accept-Encoding в запросах прогона (--accept-encoding); пустая строка - без сжатия
+ACCEPT_ENCODING = 'gzip, deflate, br'
+
+
+# ===== ПОДСЧЁТ ЗАПРОСОВ К БД =====
+
+SERVER_TIMING_QUERIES = re.compile(r'db;desc="(\d+) queries"')
+
+
+def query_count(response: Dict[str, Any]) -> int:
+    """Число запросов к БД из заголовка Server-Timing, который выставляет обёртка handler"""
+    match = SERVER_TIMING_QUERIES.search((response.get('headers') or {}).get('Server-Timing', ''))
+    return int(match.group(1)) if match else 0
+
+
+def response_bytes(response: Dict[str, Any]) -> int:
+    """Размер тела ответа, как его передаёт платформа: base64 раскодирован, сжатие остаётся"""
+    body = response.get('body') or ''
+    return len(base64.b64decode(body)) if response.get('isBase64Encoded') else len(body.encode())
+
+
+def response_text(response: Dict[str, Any]) -> str:
+    """Тело ответа как JSON-текст - то, что получит клиент после распаковки"""
+    body = response.get('body') or ''
+    if not response.get('isBase64Encoded'):
+        return body
+    data = base64.b64decode(body)
+    encoding = (response.get('headers') or {}).get('Content-Encoding')
+    if encoding == 'gzip':
+        data = zlib.decompress(data, 47)  # 47 - автоопределение заголовка gzip/zlib
+    elif encoding == 'br':
+        import brotli
+        data = brotli.decompress(data)
+    return data.decode()
+
+
+# ===== ПОДГОТОВКА =====
+
+def with_search_path(dsn: str) -> str:
+    """Функции обращаются к таблицам без схемы - как на платформе, через search_path"""
+    separator = '&' if '?' in dsn else '?'
+    if '://' not in dsn:
+        return f"{dsn} options='-csearch_path={SCHEMA}'"
+    return f'{dsn}{separator}options=-csearch_path%3D{SCHEMA}'
+
+
+def apply_migrations(dsn: str) -> None:
+    """Накатывает db_migrations по порядку на пустую БД"""
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'CREATE SCHEMA IF NOT EXISTS {SCHEMA}')
+        cur.execute(f'SET search_path TO {SCHEMA}')
+        for path in sorted(MIGRATIONS.glob('V*.sql')):
+            print(f'[setup] {path.name}')
+            cur.execute(path.read_text(encoding='utf-8'))
+    conn.close()
+
+
+def load_function(name: str) -> Any:
+    spec = importlib.util.spec_from_file_location(f"bench_{name.replace('-', '_')}", BACKEND / name / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def disable_caches(functions: Dict[str, Any]) -> None:
+    """--no-cache: замер нагрузки на БД без кэша процесса"""
+    for module in functions.values():
+        if hasattr(module, 'CACHE_TTL'):
+            module.CACHE_TTL = 0
+        if hasattr(module, 'CACHE_TTLS'):
+            module.CACHE_TTLS = {k: 0 for k in module.CACHE_TTLS}
+
+
+class Context:
+    """Минимальный аналог context платформы"""
+
+    def __init__(self):
+        self.request_id = str(uuid.uuid4())
+        self.function_name = 'bench'
+
+
+# ===== СЦЕНАРИИ =====
+
+Operation = Tuple[str, str, Dict[str, Any]]  # (операция для отчёта, функция, event)
+
+
+def event(method: str, params: Optional[Dict[str, str]] = None, body: Any = None) -> Dict[str, Any]:
+    return {
+        'httpMethod': method,
+        'queryStringParameters': params or {},
+        'headers': {'Accept-Encoding': ACCEPT_ENCODING} if ACCEPT_ENCODING else {},
+        'body': json.dumps(body) if body is not None else '',
+    }
+
+
+class Workload:
+    '''
+    Генератор операций сценария. Состояние (версии ключей, id юнитов) общее для потоков,
+    поэтому опросы идут с since_version / updated_since, как у реальных клиентов.
+    Args: users - число терминалов, units - размер парка, value_items - элементов в массивах хранилища
+    '''
+
+    def __init__(self, users: int, units: int, value_items: int):
+        self.users = [f'bench-user-{i}' for i in range(users)]
+        self.unit_count = units
+        self.value_items = value_items
+        self.unit_ids: List[int] = []
+        self.versions: Dict[str, int] = {}
+        self.units_since: Optional[str] = None
+        self.lock = threading.Lock()
+
+    def seed(self, call: Callable[[str, Dict[str, Any]], Dict[str, Any]]) -> None:
+        """Стартовые данные: ключи хранилища и парк юнитов"""
+        # Массивы, похожие на вызовы фронтенда: на реальной смене mdc_calls вырастает до сотен КБ
+        items = [{'key': k, 'value': [{
+            'id': i,
+            'callNumber': f'C-{i:05d}',
+            'time': f'2026-01-01T{i // 60 % 24:02d}:{i % 60:02d}:00.000Z',
+            'address': f'ул. Ленина, {random.randint(1, 200)}, кв. {random.randint(1, 120)}',
+            'type': random.choice(['ДТП', 'Пожар', 'Медицинский вызов', 'Кража']),
+            'priority': random.choice(CALL_PRIORITIES),
+            'status': 'pending',
+            'assignedUnit': None,
+        } for i in range(self.value_items)]} for k in STORAGE_KEYS]
+        call('storage', event('POST', body={'items': items}))
+        for i in range(self.unit_count):
+            response = call('units', event('POST', body={
+                'unitName': f'BENCH-{uuid.uuid4().hex[:8]}-{i}',
+                'status': 'available',
+                'location': 'Станция №1',
+                'members': ['Иванов И.И.', 'Петров П.П.'],
+            }))
+            self.unit_ids.append(json.loads(response['body'])['id'])
+
+    def heartbeat(self) -> Operation:
+        user = random.choice(self.users)
+        return 'heartbeat', 'online-users', event('POST', {'resource': 'users'}, {
+            'user_id': user, 'full_name': f'Сотрудник {user}', 'role': 'employee', 'email': f'{user}@mdc.system'
+        })
+
+    def online_list(self) -> Operation:
+        return 'online-list', 'online-users', event('GET', {'resource': 'users'})
+
+    def shifts_list(self) -> Operation:
+        return 'shifts-list', 'online-users', event('GET', {'resource': 'shifts'})
+
+    def unit_update(self) -> Operation:
+        return 'unit-update', 'units', event('PUT', body={
+            'id': random.choice(self.unit_ids),
+            'status': random.choice(UNIT_STATUSES),
+            'location': f'ул. Ленина, {random.randint(1, 200)}',
+        })
+
+    def units_poll(self) -> Operation:
+        params = {'updated_since': self.units_since} if self.units_since else {}
+        return 'units-poll', 'units', event('GET', params)
+
+    def storage_poll(self) -> Operation:
+        key = random.choice(STORAGE_KEYS)
+        params = {'key': key}
+        if key in self.versions:
+            params['since_version'] = str(self.versions[key])
+        return 'storage-poll', 'storage', event('GET', params)
+
+    def storage_write(self) -> Operation:
+        key = random.choice(STORAGE_KEYS)
+        return 'storage-patch', 'storage', event('PATCH', body={
+            'key': key, 'ops': [{'op': 'update', 'id': random.randrange(self.value_items), 'value': {'status': 'dispatched'}}]
+        })
+
+    def observe(self, operation: str, response: Dict[str, Any]) -> None:
+        """Запоминает версии и курсоры из ответов, чтобы следующие опросы были условными"""
+        if response.get('statusCode') != 200 or not response.get('body'):
+            return
+        if operation == 'storage-poll':
+            data = json.loads(response_text(response))
+            with self.lock:
+                self.versions[data['key']] = data['version']
+        elif operation == 'units-poll':
+            with self.lock:
+                self.units_since = json.loads(response_text(response)).get('nextSince')
+
+
+# Сценарии - веса операций
+SCENARIOS: Dict[str, Dict[str, int]] = {
+    'heartbeat-storm': {'heartbeat': 90, 'online_list': 10},
+    'unit-churn': {'unit_update': 30, 'units_poll': 70},
+    'storage-poll': {'storage_poll': 95, 'storage_write': 5},
+    'mixed': {'heartbeat': 30, 'online_list': 10, 'shifts_list': 10, 'unit_update': 5,
+              'units_poll': 15, 'storage_poll': 27, 'storage_write': 3},
+}
+
+
+# ===== ПРОГОН =====
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples: List[Tuple[float, int, int, int]], elapsed: float) -> Dict[str, Any]:
+    """samples: (латентность мс, число запросов к БД, HTTP статус, байт в теле ответа)"""
+    latencies = [s[0] for s in samples]
+    return {
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        'queries_per_request': round(statistics.fmean(s[1] for s in samples), 2) if samples else 0.0,
+        'bytes_per_request': round(statistics.fmean(s[3] for s in samples)) if samples else 0,
+        'errors': sum(1 for s in samples if s[2] >= 500),
+    }
+
+
+def run(functions: Dict[str, Any], workload: Workload, weights: Dict[str, int],
+        concurrency: int, duration: float) -> Dict[str, Any]:
+    names = list(weights)
+    generators = [getattr(workload, name) for name in names]
+    cumulative = [weights[name] for name in names]
+    samples: Dict[str, List[Tuple[float, int, int, int]]] = {}
+    samples_lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker() -> None:
+        local: Dict[str, List[Tuple[float, int, int, int]]] = {}
+        while time.monotonic() < deadline:
+            operation, function, ev = random.choices(generators, weights=cumulative)[0]()
+            started = time.perf_counter()
+            response = functions[function].handler(ev, Context())
+            latency = (time.perf_counter() - started) * 1000
+            workload.observe(operation, response)
+            local.setdefault(operation, []).append((latency, query_count(response), response.get('statusCode', 0),
+                                                    response_bytes(response)))
+        with samples_lock:
+            for operation, values in local.items():
+                samples.setdefault(operation, []).extend(values)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    elapsed = time.monotonic() - started
+
+    everything = [s for values in samples.values() for s in values]
+    return {
+        'total': summarize(everything, elapsed),
+        'operations': {name: summarize(values, elapsed) for name, values in sorted(samples.items())},
+        'pool': {name: dict(module.get_pool().stats) for name, module in functions.items()},
+        # Сколько одинаковых одновременных чтений получили результат чужого запроса к БД
+        'coalescing': {name: dict(module._flights.stats) for name, module in functions.items()
+                       if hasattr(module, '_flights')},
+    }
+
+
+# ===== ОТЧЁТ И БАЗОВЫЕ ЛИНИИ =====
+
+COLUMNS = ['requests', 'throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request', 'bytes_per_request',
+           'errors']
+
+
+def print_report(result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    header = f"{'operation':<16}" + ''.join(f'{c:>20}' for c in COLUMNS)
+    print(header)
+    print('-' * len(header))
+    rows = [('TOTAL', result['total'])] + list(result['operations'].items())
+    for name, row in rows:
+        base = None
+        if baseline:
+            base = baseline['total'] if name == 'TOTAL' else baseline['operations'].get(name)
+        cells = []
+        for column in COLUMNS:
+            cell = f'{row[column]}'
+            if base and base.get(column):
+                cell += f' ({(row[column] - base[column]) / base[column] * 100:+.0f}%)'
+            cells.append(f'{cell:>20}')
+        print(f'{name:<16}' + ''.join(cells))
+    print(f"\npool: {json.dumps(result['pool'], ensure_ascii=False)}")
+    if result.get('coalescing'):
+        print(f"coalescing: {json.dumps(result['coalescing'], ensure_ascii=False)}")
+    rows = result.get('storage_rows')
+    if rows:
+        print(f"storage rows: {rows['stored_bytes']} байт на диске / {rows['json_bytes']} байт JSON "
+              f"({rows['stored_bytes'] / max(rows['json_bytes'], 1) * 100:.0f}%)")
+
+
+def storage_row_sizes(dsn: str) -> Dict[str, int]:
+    """Размер строк хранилища: value на диске (после сжатия TOAST) против длины JSON-текста"""
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute('''
+                SELECT COALESCE(SUM(pg_column_size(value)), 0), COALESCE(SUM(octet_length(value::text)), 0)
+                FROM mdc_storage WHERE key = ANY(%s)
+            ''', (STORAGE_KEYS,))
+            stored, text = cur.fetchone()
+    finally:
+        conn.close()
+    return {'stored_bytes': int(stored), 'json_bytes': int(text)}
+
+
+def source_commit(root: Path) -> Optional[str]:
+    """Коммит копии, из которой взяты функции - чтобы сохранённая базовая линия говорила, что замерено"""
+    try:
+        return subprocess.run(['git', '-C', str(root), 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def baseline_path(args: argparse.Namespace) -> Path:
+    return BASELINES / f'{args.scenario}-c{args.concurrency}.json'
+
+
+def main() -> None:
+    global ACCEPT_ENCODING, BACKEND, MIGRATIONS
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон backend-функций MDC')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL') or os.environ.get('DATABASE_URL'),
+                        help='Postgres для прогона (BENCH_DATABASE_URL / DATABASE_URL)')
+    parser.add_argument('--setup', action='store_true', help='накатить db_migrations на пустую БД')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='mixed')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help='секунд на прогон')
+    parser.add_argument('--users', type=int, default=200, help='терминалов в heartbeat-сценариях')
+    parser.add_argument('--units', type=int, default=100, help='юнитов в парке')
+    parser.add_argument('--value-items', type=int, default=500, help='элементов в каждом массиве хранилища')
+    parser.add_argument('--accept-encoding', default=ACCEPT_ENCODING,
+                        help="Accept-Encoding в запросах; '' - клиент без сжатия")
+    parser.add_argument('--no-cache', action='store_true', help='отключить кэш ответов в функциях')
+    parser.add_argument('--no-prepare', action='store_true', help='горячие запросы текстом, без PREPARE')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', action='store_true', help='сохранить результат как базовую линию')
+    parser.add_argument('--compare', action='store_true', help='сравнить с сохранённой базовой линией')
+    parser.add_argument('--json', action='store_true', help='вывести результат в JSON')
+    parser.add_argument('--root', type=Path, default=ROOT,
+                        help='другая копия репозитория (git worktree): функции и миграции из неё, сценарии - отсюда')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+    random.seed(args.seed)
+    ACCEPT_ENCODING = args.accept_encoding
+    BACKEND = args.root / 'backend'
+    MIGRATIONS = args.root / 'db_migrations'
+
+    dsn = with_search_path(args.dsn)
+    if args.setup:
+        apply_migrations(args.dsn)
+
+    # Окружение читается функциями при импорте
+    os.environ['DATABASE_URL'] = dsn
+    os.environ.setdefault('DB_POOL_MAX', str(args.concurrency))
+    os.environ.setdefault('DB_POOL_MIN', '1')
+    if args.no_prepare:
+        os.environ['DB_PREPARE'] = '0'
+    # Строка лога на каждый запрос заметно искажает замеры под нагрузкой
+    os.environ.setdefault('REQUEST_LOG', '0')
+    functions = {name: load_function(name) for name in ('storage', 'units', 'online-users')}
+    if args.no_cache:
+        disable_caches(functions)
+
+    workload = Workload(args.users, args.units, args.value_items)
+    workload.seed(lambda name, ev: functions[name].handler(ev, Context()))
+
+    result = run(functions, workload, SCENARIOS[args.scenario], args.concurrency, args.duration)
+    result['config'] = {k: getattr(args, k) for k in ('scenario', 'concurrency', 'duration', 'users', 'units',
+                                                      'value_items', 'accept_encoding', 'no_cache', 'no_prepare')}
+    result['config']['commit'] = source_commit(args.root)
+    result['storage_rows'] = storage_row_sizes(dsn)
+
+    baseline = None
+    if args.compare:
+        path = baseline_path(args)
+        if not path.exists():
+            sys.exit(f'Нет базовой линии {path}; сначала запустите с --save')
+        baseline = json.loads(path.read_text(encoding='utf-8'))
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_report(result, baseline)
+
+    if args.save:
+        BASELINES.mkdir(exist_ok=True)
+        baseline_path(args).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f'\nБазовая линия сохранена: {baseline_path(args).relative_to(ROOT)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""
+Business: Нагрузочный прогон локального сервера server/app.py - масштабирование по числу процессов
+Args: --workers - список чисел процессов для прогонов, --clients - терминалов с keep-alive подключением,
+      --interval - пауза терминала между опросами, --watchers - висящих long-poll запросов ?watch=
+Returns: для каждого числа процессов - пропускная способность, p50/p95/p99 и ошибки опросов
+
+Терминал, как фронтенд, опрашивает storage (с since_version), units (с updated_since) и шлёт heartbeat.
+Сервер запускается отдельным процессом на каждый прогон; клиенты - asyncio в этом процессе,
+поэтому при --interval 0 потолок может упереться в сам генератор нагрузки.
+
+Примеры:
+    python bench/server_load.py --dsn postgresql://localhost/mdc_bench --setup
+    python bench/server_load.py --workers 1 2 4 --clients 2000 --interval 1 --watchers 2000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from run import ROOT, STORAGE_KEYS, apply_migrations, percentile, with_search_path
+
+SERVER = ROOT / 'server' / 'app.py'
+
+
+class Client:
+    """Одно keep-alive HTTP/1.1 подключение к серверу"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body: Any = None) -> Tuple[int, bytes]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        data = json.dumps(body).encode() if body is not None else b''
+        self.writer.write(
+            f'{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n'
+            f'Accept-Encoding: gzip\r\nContent-Length: {len(data)}\r\n\r\n'.encode() + data
+        )
+        try:
+            head = await self.reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.close()
+            raise
+        lines = head.decode('latin-1').split('\r\n')
+        status = int(lines[0].split(' ')[1])
+        headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(':') for line in lines[1:] if line)}
+        payload = await self.reader.readexactly(int(headers.get('content-length', 0)))
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        if headers.get('content-encoding') == 'gzip':
+            payload = zlib.decompress(payload, 47)
+        return status, payload
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def terminal(index: int, host: str, port: int, interval: float, deadline: float,
+                   samples: List[Tuple[str, float, int]]) -> None:
+    '''
+    Цикл одного терминала: storage-опрос с since_version, units с updated_since, heartbeat.
+    Первая пауза случайна, чтобы терминалы не опрашивали сервер синхронно
+    '''
+    client = Client(host, port)
+    versions: Dict[str, int] = {}
+    units_since: Optional[str] = None
+    user = f'load-user-{index}'
+    await asyncio.sleep(random.uniform(0, interval))
+    step = 0
+    while time.monotonic() < deadline:
+        step += 1
+        if step % 3 == 0:
+            operation, method, path, body = 'heartbeat', 'POST', '/online-users?resource=users', {
+                'user_id': user, 'full_name': f'Сотрудник {index}', 'role': 'employee', 'email': f'{user}@mdc.system'
+            }
+        elif step % 3 == 1:
+            key = random.choice(STORAGE_KEYS)
+            since = f'&since_version={versions[key]}' if key in versions else ''
+            operation, method, path, body = 'storage-poll', 'GET', f'/storage?key={key}{since}', None
+        else:
+            since = f'?updated_since={quote(units_since)}' if units_since else ''
+            operation, method, path, body = 'units-poll', 'GET', f'/units{since}', None
+
+        started = time.perf_counter()
+        try:
+            status, payload = await client.request(method, path, body)
+        except (OSError, asyncio.IncompleteReadError):
+            status, payload = 599, b''
+        samples.append((operation, (time.perf_counter() - started) * 1000, status))
+
+        if status == 200 and operation == 'storage-poll':
+            data = json.loads(payload)
+            versions[data['key']] = data['version']
+        elif status == 200 and operation == 'units-poll':
+            units_since = json.loads(payload).get('nextSince')
+        if interval:
+            await asyncio.sleep(interval)
+    client.close()
+
+
+async def watcher(host: str, port: int, deadline: float, stats: Dict[str, int]) -> None:
+    """Висящий long-poll, как у открытой вкладки фронтенда: сразу переподписывается после ответа"""
+    client = Client(host, port)
+    while time.monotonic() < deadline:
+        timeout = max(1, min(25, int(deadline - time.monotonic())))
+        try:
+            status, _ = await client.request('GET', f'/storage?watch=unit,storage:mdc_calls&timeout={timeout}')
+        except (OSError, asyncio.IncompleteReadError):
+            status = 599
+        stats['ok' if status == 200 else 'errors'] += 1
+    client.close()
+
+
+async def load(host: str, port: int, clients: int, watchers: int, interval: float,
+               duration: float) -> Dict[str, Any]:
+    samples: List[Tuple[str, float, int]] = []
+    watch_stats = {'ok': 0, 'errors': 0}
+    deadline = time.monotonic() + duration
+    started = time.monotonic()
+    await asyncio.gather(
+        *(terminal(i, host, port, interval, deadline, samples) for i in range(clients)),
+        *(watcher(host, port, deadline, watch_stats) for _ in range(watchers)),
+    )
+    elapsed = time.monotonic() - started
+    latencies = [latency for _, latency, _ in samples]
+    return {
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'mean_ms': round(statistics.fmean(latencies), 2) if latencies else 0.0,
+        'errors': sum(1 for _, _, status in samples if status >= 500),
+        'watch_responses': watch_stats['ok'],
+        'watch_errors': watch_stats['errors'],
+    }
+
+
+def wait_for_port(host: str, port: int, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f'Сервер завершился с кодом {process.returncode}')
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    sys.exit(f'Сервер не открыл порт {port} за {timeout}s')
+
+
+async def seed(host: str, port: int, units: int) -> None:
+    """Стартовые данные через API сервера: ключи хранилища и парк юнитов"""
+    client = Client(host, port)
+    items = [{'key': k, 'value': [{'id': i, 'status': 'pending'} for i in range(50)]} for k in STORAGE_KEYS]
+    await client.request('POST', '/storage', {'items': items})
+    for i in range(units):
+        await client.request('POST', '/units', {'unitName': f'LOAD-{i}', 'status': 'available', 'members': []})
+    client.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL') or os.environ.get('DATABASE_URL'))
+    parser.add_argument('--setup', action='store_true', help='накатить db_migrations на пустую БД')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=32, help='потоков handler в процессе сервера')
+    parser.add_argument('--db-pool', type=int, default=8, help='подключений к БД в процессе сервера')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--watchers', type=int, default=1000)
+    parser.add_argument('--interval', type=float, default=1.0, help='секунд между опросами терминала')
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--units', type=int, default=100)
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+    if args.setup:
+        apply_migrations(args.dsn)
+
+    host = '127.0.0.1'
+    env = dict(os.environ, DATABASE_URL=with_search_path(args.dsn), REQUEST_LOG='0')
+    results = {}
+    for workers in args.workers:
+        process = subprocess.Popen(
+            [sys.executable, str(SERVER), '--host', host, '--port', str(args.port), '--workers', str(workers),
+             '--threads', str(args.threads), '--db-pool', str(args.db_pool)],
+            env=env, stdout=subprocess.DEVNULL
+        )
+        try:
+            wait_for_port(host, args.port, process)
+            if not results:
+                asyncio.run(seed(host, args.port, args.units))
+            results[workers] = asyncio.run(load(host, args.port, args.clients, args.watchers, args.interval,
+                                                args.duration))
+        finally:
+            process.terminate()
+            process.wait()
+        if not args.json:
+            row = results[workers]
+            print(f"workers={workers}: {row['throughput_rps']} rps, p50 {row['p50_ms']}ms, p95 {row['p95_ms']}ms, "
+                  f"p99 {row['p99_ms']}ms, errors {row['errors']}, watch {row['watch_responses']} "
+                  f"(errors {row['watch_errors']})")
+
+    if args.json:
+        print(json.dumps({'config': vars(args), 'results': results}, ensure_ascii=False, indent=2))
+    else:
+        base = results[args.workers[0]]['throughput_rps'] or 1
+        print('\nмасштабирование: ' + ', '.join(
+            f"{w} -> x{results[w]['throughput_rps'] / base:.2f}" for w in args.workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+-- Хранилище ключ-значение для функции storage (раньше создавалось в каждом запросе)
+CREATE TABLE IF NOT EXISTS t_p48049793_mobile_digital_compu.mdc_storage (
+    key TEXT PRIMARY KEY,
+    value JSONB NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,7 @@
+-- Версия значения для условных запросов (ETag / since_version).
+-- Общая последовательность: версия ключа только растёт, и по ней же можно искать изменения
+CREATE SEQUENCE IF NOT EXISTS t_p48049793_mobile_digital_compu.mdc_storage_version_seq;
+
+ALTER TABLE t_p48049793_mobile_digital_compu.mdc_storage
+  ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL
+  DEFAULT nextval('t_p48049793_mobile_digital_compu.mdc_storage_version_seq');
@@ -0,0 +1,11 @@
+-- Инкрементальная выборка юнитов: ?updated_since по last_update и надгробия удалённых юнитов
+CREATE INDEX IF NOT EXISTS idx_units_last_update
+  ON t_p48049793_mobile_digital_compu.units(last_update);
+
+CREATE TABLE IF NOT EXISTS t_p48049793_mobile_digital_compu.unit_tombstones (
+    unit_id INTEGER PRIMARY KEY,
+    deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_unit_tombstones_deleted_at
+  ON t_p48049793_mobile_digital_compu.unit_tombstones(deleted_at);
@@ -0,0 +1,20 @@
+-- Очередь вызовов: ранг приоритета для сортировки (code99 > code3 > code2)
+ALTER TABLE t_p48049793_mobile_digital_compu.calls
+  ADD COLUMN IF NOT EXISTS priority_rank SMALLINT GENERATED ALWAYS AS (
+    CASE priority WHEN 'code99' THEN 3 WHEN 'code3' THEN 2 WHEN 'code2' THEN 1 ELSE 0 END
+  ) STORED;
+
+-- Ожидающие вызовы в порядке выдачи: сначала высокий приоритет, затем самые старые.
+-- Частичный индекс остаётся маленьким, сколько бы ни накопилось завершённых вызовов
+CREATE INDEX IF NOT EXISTS idx_calls_pending_queue
+  ON t_p48049793_mobile_digital_compu.calls(priority_rank DESC, call_time, id)
+  WHERE status = 'pending';
+
+-- Активные вызовы юнита
+CREATE INDEX IF NOT EXISTS idx_calls_dispatched_unit
+  ON t_p48049793_mobile_digital_compu.calls(assigned_crew_id)
+  WHERE status = 'dispatched';
+
+-- Фильтр истории по статусу со страницами по id (новые первыми)
+CREATE INDEX IF NOT EXISTS idx_calls_status_id
+  ON t_p48049793_mobile_digital_compu.calls(status, id DESC);
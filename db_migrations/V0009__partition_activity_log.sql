@@ -0,0 +1,85 @@
+-- activity_log становится секционированной по месяцам log_time; поля - как у ActivityLog во фронтенде.
+-- Старая таблица пуста (в неё никто не писал), но строки всё равно переносятся
+ALTER TABLE t_p48049793_mobile_digital_compu.activity_log RENAME TO activity_log_legacy;
+ALTER SEQUENCE t_p48049793_mobile_digital_compu.activity_log_id_seq RENAME TO activity_log_legacy_id_seq;
+
+CREATE TABLE t_p48049793_mobile_digital_compu.activity_log (
+    id BIGSERIAL,
+    log_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    log_type VARCHAR(50) NOT NULL,
+    message TEXT NOT NULL,
+    user_id VARCHAR(50),
+    user_name VARCHAR(255),
+    crew_id INTEGER,
+    crew_name VARCHAR(50),
+    details TEXT,
+    PRIMARY KEY (log_time, id)
+) PARTITION BY RANGE (log_time);
+
+-- Индексы на родителе создаются в каждой секции; выборка по окну времени идёт по первичному ключу
+CREATE INDEX IF NOT EXISTS idx_activity_log_type_time
+  ON t_p48049793_mobile_digital_compu.activity_log(log_type, log_time DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_activity_log_user_time
+  ON t_p48049793_mobile_digital_compu.activity_log(user_id, log_time DESC, id DESC);
+
+-- Обслуживание секций: месяцы от (сейчас - retention_days) до следующего создаются,
+-- секции целиком старше срока хранения отсоединяются и удаляются. Вызывает функция activity-log
+CREATE OR REPLACE FUNCTION t_p48049793_mobile_digital_compu.activity_log_maintain(retention_days INTEGER)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    horizon TIMESTAMP := CURRENT_TIMESTAMP - make_interval(days => retention_days);
+    month_start DATE := date_trunc('month', horizon)::date;
+    last_month DATE := (date_trunc('month', CURRENT_TIMESTAMP) + INTERVAL '1 month')::date;
+    part_name TEXT;
+    part_month DATE;
+    created TEXT[] := '{}';
+    dropped TEXT[] := '{}';
+BEGIN
+    WHILE month_start <= last_month LOOP
+        part_name := 'activity_log_p' || to_char(month_start, 'YYYYMM');
+        IF to_regclass('t_p48049793_mobile_digital_compu.' || part_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE t_p48049793_mobile_digital_compu.%I PARTITION OF t_p48049793_mobile_digital_compu.activity_log FOR VALUES FROM (%L) TO (%L)',
+                part_name, month_start, (month_start + INTERVAL '1 month')::date
+            );
+            created := created || part_name;
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+
+    FOR part_name IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 't_p48049793_mobile_digital_compu.activity_log'::regclass
+          AND c.relname ~ '^activity_log_p[0-9]{6}$'
+    LOOP
+        part_month := to_date(substr(part_name, 15), 'YYYYMM');
+        IF part_month + INTERVAL '1 month' <= horizon THEN
+            EXECUTE format('ALTER TABLE t_p48049793_mobile_digital_compu.activity_log DETACH PARTITION t_p48049793_mobile_digital_compu.%I', part_name);
+            EXECUTE format('DROP TABLE t_p48049793_mobile_digital_compu.%I', part_name);
+            dropped := dropped || part_name;
+        END IF;
+    END LOOP;
+
+    RETURN json_build_object('created', created, 'dropped', dropped);
+END;
+$$;
+
+-- Секции под перенос старых строк и текущий месяц
+SELECT t_p48049793_mobile_digital_compu.activity_log_maintain(
+    GREATEST(90, COALESCE((
+        SELECT (CURRENT_DATE - MIN(log_time)::date) + 1
+        FROM t_p48049793_mobile_digital_compu.activity_log_legacy
+    ), 0))
+);
+
+INSERT INTO t_p48049793_mobile_digital_compu.activity_log
+    (log_time, log_type, message, user_id, user_name, details)
+SELECT COALESCE(l.log_time, CURRENT_TIMESTAMP), l.log_type, l.message, l.user_id::text, u.full_name, l.details
+FROM t_p48049793_mobile_digital_compu.activity_log_legacy l
+LEFT JOIN t_p48049793_mobile_digital_compu.users u ON u.id = l.user_id;
+
+DROP TABLE t_p48049793_mobile_digital_compu.activity_log_legacy;
@@ -0,0 +1,10 @@
+-- Координаты юнита (WGS84, градусы): обновляются вместе со статусом и location через PUT
+ALTER TABLE t_p48049793_mobile_digital_compu.units
+  ADD COLUMN IF NOT EXISTS lat DOUBLE PRECISION,
+  ADD COLUMN IF NOT EXISTS lon DOUBLE PRECISION;
+
+-- Кандидаты для подбора ближайшего юнита: только свободные и с координатами.
+-- Частичный индекс остаётся маленьким - в него попадают лишь доступные юниты
+CREATE INDEX IF NOT EXISTS idx_units_available_coords
+  ON t_p48049793_mobile_digital_compu.units(lat, lon)
+  WHERE status = 'available' AND lat IS NOT NULL AND lon IS NOT NULL;
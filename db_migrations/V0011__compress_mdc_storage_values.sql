@@ -0,0 +1,14 @@
+-- Большие значения mdc_storage (массивы вызовов, пользователей) хранятся в TOAST сжатыми.
+-- lz4 (PostgreSQL 14+) сжимает и распаковывает в разы быстрее pglz по умолчанию - это заметно
+-- при чтении значения в каждом опросе. Без lz4 в сборке сервера остаётся pglz.
+-- Уже записанные строки пересжимаются при следующей записи ключа
+DO $$
+BEGIN
+    IF current_setting('server_version_num')::int >= 140000 THEN
+        -- EXECUTE: на версиях до 14 синтаксиса SET COMPRESSION нет, и блок не скомпилировался бы
+        EXECUTE 'ALTER TABLE t_p48049793_mobile_digital_compu.mdc_storage ALTER COLUMN value SET COMPRESSION lz4';
+    END IF;
+EXCEPTION WHEN feature_not_supported THEN
+    RAISE NOTICE 'lz4 недоступен, value сжимается pglz: %', SQLERRM;
+END;
+$$;
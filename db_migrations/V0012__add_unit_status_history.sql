@@ -0,0 +1,100 @@
+-- История статусов юнитов и сводки для аналитики "время в статусе".
+-- Переходы пишет триггер на units - для любого писателя (функции units и online-users), без изменения их запросов.
+-- Сводки по дням пополняются в момент перехода, поэтому аналитика читает их, а не историю
+
+-- С какого момента юнит в текущем статусе: начало открытого интервала
+ALTER TABLE t_p48049793_mobile_digital_compu.units
+  ADD COLUMN IF NOT EXISTS status_since TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP;
+UPDATE t_p48049793_mobile_digital_compu.units SET status_since = last_update WHERE last_update IS NOT NULL;
+
+-- Только добавление, без id: строка - переход статуса или смена location
+CREATE TABLE IF NOT EXISTS t_p48049793_mobile_digital_compu.unit_status_history (
+    unit_id INTEGER NOT NULL,
+    changed_at TIMESTAMP NOT NULL,
+    status VARCHAR(50) NOT NULL,
+    prev_status VARCHAR(50),
+    location VARCHAR(255)
+);
+
+-- Строки приходят в порядке времени: BRIN по времени весит килобайты даже на годе истории
+CREATE INDEX IF NOT EXISTS idx_unit_status_history_time
+  ON t_p48049793_mobile_digital_compu.unit_status_history USING brin (changed_at);
+CREATE INDEX IF NOT EXISTS idx_unit_status_history_unit
+  ON t_p48049793_mobile_digital_compu.unit_status_history(unit_id, changed_at);
+
+-- Секунды в статусе по дням; entries - сколько интервалов статуса закончилось в этот день
+CREATE TABLE IF NOT EXISTS t_p48049793_mobile_digital_compu.unit_status_daily (
+    day DATE NOT NULL,
+    unit_id INTEGER NOT NULL,
+    status VARCHAR(50) NOT NULL,
+    seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    entries INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, unit_id, status)
+);
+
+-- Время реагирования (en-route -> on-scene) - гистограмма по дням: 120 логарифмических корзин
+-- от 1 секунды до суток, шаг ~10%. Процентили считаются по сумме корзин за период
+CREATE TABLE IF NOT EXISTS t_p48049793_mobile_digital_compu.unit_response_daily (
+    day DATE NOT NULL,
+    unit_id INTEGER NOT NULL,
+    bucket SMALLINT NOT NULL,
+    responses INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, unit_id, bucket)
+);
+
+CREATE OR REPLACE FUNCTION t_p48049793_mobile_digital_compu.unit_status_track()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    now_ts TIMESTAMP := LOCALTIMESTAMP;
+    new_status VARCHAR(50) := CASE WHEN TG_OP = 'DELETE' THEN 'deleted' ELSE NEW.status END;
+    new_location VARCHAR(255) := CASE WHEN TG_OP = 'DELETE' THEN OLD.location ELSE NEW.location END;
+    elapsed DOUBLE PRECISION;
+BEGIN
+    IF new_status IS DISTINCT FROM OLD.status THEN
+        -- Закрытый интервал OLD.status: его секунды раскладываются по дням сводки
+        INSERT INTO t_p48049793_mobile_digital_compu.unit_status_daily AS s (day, unit_id, status, seconds, entries)
+        SELECT d::date, OLD.id, OLD.status,
+               EXTRACT(EPOCH FROM LEAST(d + INTERVAL '1 day', now_ts) - GREATEST(d, OLD.status_since)),
+               (d = date_trunc('day', now_ts))::int
+        FROM generate_series(date_trunc('day', OLD.status_since), date_trunc('day', now_ts), INTERVAL '1 day') d
+        WHERE OLD.status_since < now_ts
+        ON CONFLICT (day, unit_id, status) DO UPDATE
+        SET seconds = s.seconds + EXCLUDED.seconds, entries = s.entries + EXCLUDED.entries;
+
+        elapsed := EXTRACT(EPOCH FROM now_ts - OLD.status_since);
+        IF OLD.status = 'en-route' AND new_status = 'on-scene' AND elapsed >= 0 THEN
+            INSERT INTO t_p48049793_mobile_digital_compu.unit_response_daily AS r (day, unit_id, bucket, responses)
+            VALUES (now_ts::date, OLD.id, width_bucket(ln(GREATEST(elapsed, 1)), 0, ln(86400), 120), 1)
+            ON CONFLICT (day, unit_id, bucket) DO UPDATE SET responses = r.responses + 1;
+        END IF;
+
+        IF TG_OP = 'UPDATE' THEN
+            NEW.status_since := now_ts;
+        END IF;
+    END IF;
+
+    INSERT INTO t_p48049793_mobile_digital_compu.unit_status_history (unit_id, changed_at, status, prev_status, location)
+    VALUES (OLD.id, now_ts, new_status, OLD.status, new_location);
+
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+-- BEFORE: status_since меняется в той же строке, без второго UPDATE
+DROP TRIGGER IF EXISTS units_status_track ON t_p48049793_mobile_digital_compu.units;
+CREATE TRIGGER units_status_track
+  BEFORE UPDATE OF status, location ON t_p48049793_mobile_digital_compu.units
+  FOR EACH ROW
+  WHEN (OLD.status IS DISTINCT FROM NEW.status OR OLD.location IS DISTINCT FROM NEW.location)
+  EXECUTE FUNCTION t_p48049793_mobile_digital_compu.unit_status_track();
+
+DROP TRIGGER IF EXISTS units_status_track_delete ON t_p48049793_mobile_digital_compu.units;
+CREATE TRIGGER units_status_track_delete
+  AFTER DELETE ON t_p48049793_mobile_digital_compu.units
+  FOR EACH ROW
+  EXECUTE FUNCTION t_p48049793_mobile_digital_compu.unit_status_track();
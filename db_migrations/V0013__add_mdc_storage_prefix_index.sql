@@ -0,0 +1,7 @@
+-- Иерархические ключи mdc_storage (calls/<id>, units/<id>) и постраничный обход по префиксу.
+-- Первичный ключ упорядочен по правилам сортировки базы и для LIKE 'calls/%' не годится;
+-- text_pattern_ops сравнивает строки побайтово: префикс - это диапазон [prefix, следующий префикс),
+-- а страница - продолжение с последнего ключа по тому же индексу.
+-- version в INCLUDE: обход "только ключи, изменённые после версии" идёт index-only scan, без чтения строк
+CREATE INDEX IF NOT EXISTS idx_mdc_storage_key_pattern
+  ON t_p48049793_mobile_digital_compu.mdc_storage (key text_pattern_ops) INCLUDE (version);
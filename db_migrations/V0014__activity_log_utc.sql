@@ -0,0 +1,51 @@
+-- log_time хранится наивным UTC: функция activity-log пишет время событий в UTC.
+-- Значение по умолчанию и границы секций в activity_log_maintain брали CURRENT_TIMESTAMP в часовом поясе
+-- сессии, и при поясе не UTC текущий месяц и срок хранения сдвигались относительно времени строк.
+-- Теперь всё считается в UTC, независимо от настроек сервера и подключения
+ALTER TABLE t_p48049793_mobile_digital_compu.activity_log
+  ALTER COLUMN log_time SET DEFAULT (now() AT TIME ZONE 'UTC');
+
+CREATE OR REPLACE FUNCTION t_p48049793_mobile_digital_compu.activity_log_maintain(retention_days INTEGER)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    now_utc TIMESTAMP := now() AT TIME ZONE 'UTC';
+    horizon TIMESTAMP := now_utc - make_interval(days => retention_days);
+    month_start DATE := date_trunc('month', horizon)::date;
+    last_month DATE := (date_trunc('month', now_utc) + INTERVAL '1 month')::date;
+    part_name TEXT;
+    part_month DATE;
+    created TEXT[] := '{}';
+    dropped TEXT[] := '{}';
+BEGIN
+    WHILE month_start <= last_month LOOP
+        part_name := 'activity_log_p' || to_char(month_start, 'YYYYMM');
+        IF to_regclass('t_p48049793_mobile_digital_compu.' || part_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE t_p48049793_mobile_digital_compu.%I PARTITION OF t_p48049793_mobile_digital_compu.activity_log FOR VALUES FROM (%L) TO (%L)',
+                part_name, month_start, (month_start + INTERVAL '1 month')::date
+            );
+            created := created || part_name;
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+
+    FOR part_name IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 't_p48049793_mobile_digital_compu.activity_log'::regclass
+          AND c.relname ~ '^activity_log_p[0-9]{6}$'
+    LOOP
+        part_month := to_date(substr(part_name, 15), 'YYYYMM');
+        IF part_month + INTERVAL '1 month' <= horizon THEN
+            EXECUTE format('ALTER TABLE t_p48049793_mobile_digital_compu.activity_log DETACH PARTITION t_p48049793_mobile_digital_compu.%I', part_name);
+            EXECUTE format('DROP TABLE t_p48049793_mobile_digital_compu.%I', part_name);
+            dropped := dropped || part_name;
+        END IF;
+    END LOOP;
+
+    RETURN json_build_object('created', created, 'dropped', dropped);
+END;
+$$;
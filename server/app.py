@@ -0,0 +1,558 @@
+"""
+Business: Сервер MDC для установки без облачной платформы - все backend-функции в одном asyncio-процессе
+Args: --host, --port, --workers - процессов (SO_REUSEPORT), --threads - потоков для handler,
+      --db-pool - подключений к БД на процесс; БД - --dsn или DATABASE_URL
+Returns: HTTP API по тем же маршрутам, что в backend/func2url.json, и по /<имя функции>
+
+Функции не меняются: каждый запрос превращается в event платформы и выполняется через
+handler(event, context) в ограниченном пуле потоков. Все функции процесса делят один пул подключений.
+Long-poll storage (?watch=) обслуживается в event loop и не занимает поток на время ожидания,
+поэтому тысячи терминалов, ждущих изменений, не упираются в --threads.
+Функций, которых ещё нет в func2url.json (его пишет платформа при деплое), фронтенд ищет по VITE_API_URL:
+сборка с VITE_API_URL=http://<сервер>:8080 ходит в calls и activity-log по /<имя функции>.
+С SNAPSHOT_TOKEN сервер отдаёт и принимает потоковый снимок всего состояния по /snapshot (server/snapshot.py).
+
+Примеры:
+    python server/app.py --dsn postgresql://mdc@localhost/mdc --schema t_p48049793_mobile_digital_compu
+    python server/app.py --port 8080 --workers 4 --threads 32 --db-pool 16
+    curl --compressed -H "Authorization: Bearer $SNAPSHOT_TOKEN" http://old:8080/snapshot > mdc.ndjson
+    curl -H "Authorization: Bearer $SNAPSHOT_TOKEN" --data-binary @mdc.ndjson 'http://new:8080/snapshot?replace=1'
+"""
+
+import argparse
+import asyncio
+import base64
+import hmac
+import http
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+import psycopg2
+
+from snapshot import CHUNK_BYTES, SNAPSHOT_TABLES, export_snapshot, import_snapshot
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND = ROOT / 'backend'
+FUNC2URL = BACKEND / 'func2url.json'
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = int(os.environ.get('SERVER_MAX_BODY_BYTES', str(10 * 1024 * 1024)))
+KEEP_ALIVE_TIMEOUT = float(os.environ.get('SERVER_KEEP_ALIVE_TIMEOUT', '75'))
+# Заголовки, которые сервер выставляет сам по фактическому телу и соединению
+HOP_HEADERS = {'content-length', 'connection', 'transfer-encoding', 'keep-alive'}
+# Без токена маршрута /snapshot нет: снимок отдаёт и заменяет всё состояние
+SNAPSHOT_TOKEN = os.environ.get('SNAPSHOT_TOKEN', '')
+
+
+# ===== ФУНКЦИИ И МАРШРУТЫ =====
+
+def load_functions() -> Dict[str, Any]:
+    """Все backend/<имя>/index.py как модули; импорт идёт без warm_up - пул подключений ставит сервер"""
+    os.environ['DB_WARMUP'] = '0'
+    functions = {}
+    for path in sorted(BACKEND.glob('*/index.py')):
+        name = path.parent.name
+        spec = importlib.util.spec_from_file_location(f"mdc_{name.replace('-', '_')}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        functions[name] = module
+    return functions
+
+
+def build_routes(functions: Dict[str, Any]) -> Dict[str, str]:
+    '''
+    Путь -> имя функции: /<имя> для каждой функции и путь её URL из func2url.json,
+    так что фронтенд работает, если в func2url.json заменить только хост
+    '''
+    routes = {f'/{name}': name for name in functions}
+    if FUNC2URL.exists():
+        for name, url in json.loads(FUNC2URL.read_text(encoding='utf-8')).items():
+            path = urlsplit(url).path.rstrip('/')
+            if name in functions and path:
+                routes[path] = name
+    return routes
+
+
+def install_shared_pool(functions: Dict[str, Any], dsn: str, size: int) -> Any:
+    '''
+    Один пул подключений на все функции процесса вместо пула в каждой.
+    Пул и обёртка подключений у функций одинаковые, поэтому класс берётся из первой; новое подключение
+    готовит горячие запросы всех функций. Общий thread-local замера запроса нужен, чтобы курсор
+    подключения из чужого модуля писал в Server-Timing и лог медленных запросов текущей функции
+    '''
+    statements: Dict[str, Any] = {}
+    for name, module in functions.items():
+        for statement, definition in module.PREPARED_STATEMENTS.items():
+            if statements.setdefault(statement, definition) != definition:
+                raise SystemExit(f'Запрос {statement} функции {name} по-другому подготовлен в другой функции')
+    base = next(iter(functions.values()))
+
+    class SharedPool(base.ConnectionPool):
+        def _connect(self):
+            conn = super()._connect()
+            for module in functions.values():
+                module.prepare_statements(conn)
+            return conn
+
+        def putconn(self, conn, broken: bool = False) -> None:
+            # online-users работает транзакциями с commit(), остальные функции включают autocommit -
+            # подключение возвращается в режим psycopg2 по умолчанию, как только что открытое
+            if not broken and not conn.closed and conn.autocommit:
+                try:
+                    conn.autocommit = False
+                except Exception:
+                    broken = True
+            super().putconn(conn, broken)
+
+    pool = SharedPool(dsn, base.DB_POOL_MIN, size, base.DB_POOL_TIMEOUT, base.DB_POOL_PING_AFTER)
+    for module in functions.values():
+        module._pool = pool
+        module._request = base._request
+    return pool
+
+
+class Context:
+    """Аналог context платформы"""
+
+    def __init__(self, request_id: str, function_name: str):
+        self.request_id = request_id
+        self.function_name = function_name
+
+
+# ===== HTTP =====
+
+class Server:
+    '''
+    HTTP/1.1 с keep-alive поверх asyncio streams. handler функций выполняется в пуле потоков,
+    long-poll storage - в event loop по уведомлениям ChangeFeed
+    Args: functions - модули функций, routes - путь -> имя функции, threads - размер пула потоков
+    '''
+
+    def __init__(self, functions: Dict[str, Any], routes: Dict[str, str], threads: int):
+        self.functions = functions
+        self.routes = routes
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='mdc-handler')
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.feed_changed: Optional[asyncio.Event] = None
+        self.stats: Dict[str, int] = {'requests': 0, 'watching': 0, 'connections': 0}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.stats['connections'] += 1
+        peer = writer.get_extra_info('peername')
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE_TIMEOUT)
+                except asyncio.LimitOverrunError:
+                    await self.write(writer, error_response(431, 'Слишком большие заголовки'), False)
+                    return
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+
+                try:
+                    method, target, version, headers = parse_head(head)
+                    length = parse_length(headers)
+                except ValueError:
+                    await self.write(writer, error_response(400, 'Некорректный запрос'), False)
+                    return
+                if SNAPSHOT_TOKEN and target.partition('?')[0].rstrip('/') == '/snapshot':
+                    await self.snapshot(method, target, headers, length, reader, writer)
+                    return
+                if header_value(headers, 'Transfer-Encoding'):
+                    await self.write(writer, error_response(411, 'Нужен Content-Length'), False)
+                    return
+                if length > MAX_BODY_BYTES:
+                    await self.write(writer, error_response(413, 'Слишком большое тело запроса'), False)
+                    return
+                body = await reader.readexactly(length) if length else b''
+
+                connection = (header_value(headers, 'Connection') or '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+                response = await self.dispatch(method, target, headers, body, peer)
+                await self.write(writer, response, keep_alive)
+                if not keep_alive:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.stats['connections'] -= 1
+            writer.close()
+
+    async def dispatch(self, method: str, target: str, headers: Dict[str, str], body: bytes,
+                       peer: Any) -> Dict[str, Any]:
+        self.stats['requests'] += 1
+        path, _, query = target.partition('?')
+        name = self.routes.get(path.rstrip('/'))
+        if name is None:
+            return error_response(404, f'Нет функции по пути {path}')
+
+        try:
+            text, is_base64 = body.decode(), False
+        except UnicodeDecodeError:
+            text, is_base64 = base64.b64encode(body).decode('ascii'), True
+        request_id = str(uuid.uuid4())
+        event = {
+            'httpMethod': method,
+            'path': path,
+            'headers': headers,
+            'queryStringParameters': dict(parse_qsl(query, keep_blank_values=True)),
+            'body': text,
+            'isBase64Encoded': is_base64,
+            'requestContext': {'requestId': request_id, 'identity': {'sourceIp': peer[0] if peer else None}},
+        }
+
+        try:
+            if name == 'storage' and method == 'GET' and 'watch' in event['queryStringParameters']:
+                return await self.watch(self.functions[name], event['queryStringParameters'])
+            return await self.loop.run_in_executor(
+                self.executor, self.functions[name].handler, event, Context(request_id, name))
+        except Exception as e:
+            print(f'[server] {name} {method} {path} failed: {e!r}', file=sys.stderr)
+            return error_response(500, str(e))
+
+    async def watch(self, storage: Any, params: Dict[str, str]) -> Dict[str, Any]:
+        '''
+        ?watch= storage без потока на ожидание: подписка и проверка since_version - в пуле потоков,
+        затем запрос ждёт в event loop, пока слушающий поток ChangeFeed не опубликует изменения
+        '''
+        try:
+            topics, timeout, since_version = storage.parse_watch_params(params)
+        except ValueError as e:
+            return error_response(400, str(e))
+
+        feed = storage.get_change_feed()
+        if self.feed_changed is None:
+            self.feed_changed = asyncio.Event()
+            feed.add_listener(lambda: self.loop.call_soon_threadsafe(self.publish))
+        after_seq = await self.loop.run_in_executor(self.executor, feed.subscribe)
+        changes = await self.loop.run_in_executor(self.executor, storage.stored_changes, topics, since_version)
+
+        deadline = self.loop.time() + timeout
+        self.stats['watching'] += 1
+        try:
+            while not changes:
+                # Событие берётся до проверки буфера: публикация между ними разбудит это ожидание
+                changed = self.feed_changed
+                changes = feed.changes_after(topics, after_seq)
+                remaining = deadline - self.loop.time()
+                if changes or remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.stats['watching'] -= 1
+        return storage.watch_response(changes)
+
+    async def snapshot(self, method: str, target: str, headers: Dict[str, str], length: int,
+                       reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        '''
+        GET /snapshot - потоковая выгрузка NDJSON, POST /snapshot[?replace=1] - загрузка тела запроса;
+        ?tables=a,b - часть таблиц (replace требует в списке и таблицы, ссылающиеся на них). Своё подключение к БД и поток вне пула handler, соединение
+        закрывается после ответа
+        '''
+        authorization = (header_value(headers, 'Authorization') or '').encode()
+        if not hmac.compare_digest(authorization, f'Bearer {SNAPSHOT_TOKEN}'.encode()):
+            await self.write(writer, error_response(401, 'Нужен заголовок Authorization: Bearer <SNAPSHOT_TOKEN>'),
+                             False)
+            return
+        params = dict(parse_qsl(target.partition('?')[2]))
+        tables = SNAPSHOT_TABLES
+        if params.get('tables'):
+            tables = [t for t in SNAPSHOT_TABLES if t in params['tables'].split(',')]
+
+        if method == 'GET':
+            compress = 'gzip' in (header_value(headers, 'Accept-Encoding') or '')
+            await self.stream_export(writer, tables, compress)
+            return
+        if method != 'POST':
+            await self.write(writer, error_response(405, 'Метод не поддерживается'), False)
+            return
+        if header_value(headers, 'Transfer-Encoding'):
+            await self.write(writer, error_response(411, 'Нужен Content-Length'), False)
+            return
+
+        stream = io.BufferedReader(StreamBody(reader, length, self.loop), CHUNK_BYTES)
+        try:
+            counts = await self.loop.run_in_executor(None, run_import, stream, params.get('replace') == '1', tables)
+            response = {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'imported': counts}),
+                'isBase64Encoded': False
+            }
+        except ValueError as e:
+            response = error_response(400, str(e))
+        except Exception as e:
+            print(f'[server] snapshot import failed: {e!r}', file=sys.stderr)
+            response = error_response(500, str(e))
+        await self.write(writer, response, False)
+
+    async def stream_export(self, writer: asyncio.StreamWriter, tables: List[str], compress: bool) -> None:
+        """Ответ chunked по мере выгрузки; обрыв выгрузки - ответ без завершающего чанка"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=4)
+        out = ChunkWriter(self.loop, queue, compress)
+        lines = ['HTTP/1.1 200 OK', 'Content-Type: application/x-ndjson', 'Access-Control-Allow-Origin: *',
+                 'Transfer-Encoding: chunked', 'Connection: close']
+        if compress:
+            lines.append('Content-Encoding: gzip')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        export = self.loop.run_in_executor(None, run_export, out, tables)
+        finished = False
+        try:
+            while (chunk := await queue.get()) is not None:
+                writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                await writer.drain()
+            finished = True
+            counts = await export
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+            print(f'[server] snapshot export {json.dumps(counts)}')
+        except ConnectionError:
+            # Клиент отключился: поток выгрузки останавливается на следующей записи
+            out.cancelled = True
+            while not finished and await queue.get() is not None:
+                pass
+            await asyncio.gather(export, return_exceptions=True)
+        except Exception as e:
+            print(f'[server] snapshot export failed: {e!r}', file=sys.stderr)
+
+    def publish(self) -> None:
+        """Новые уведомления: будим всех ждущих одним событием и заводим следующее"""
+        changed, self.feed_changed = self.feed_changed, asyncio.Event()
+        changed.set()
+
+    async def write(self, writer: asyncio.StreamWriter, response: Dict[str, Any], keep_alive: bool) -> None:
+        status = int(response.get('statusCode', 200))
+        body = response.get('body') or ''
+        if response.get('isBase64Encoded'):
+            data = base64.b64decode(body)
+        else:
+            data = body.encode() if isinstance(body, str) else body
+        lines = [f'HTTP/1.1 {status} {http.HTTPStatus(status).phrase}']
+        for name, value in (response.get('headers') or {}).items():
+            if name.lower() not in HOP_HEADERS:
+                lines.append(f'{name}: {value}')
+        lines.append(f'Content-Length: {len(data)}')
+        lines.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1', 'replace') + data)
+        await writer.drain()
+
+
+class ChunkWriter:
+    '''
+    out для export_snapshot в потоке выгрузки: строки COPY копятся до CHUNK_BYTES (и сжимаются gzip,
+    если клиент его принимает) и передаются в event loop через ограниченную очередь -
+    медленный клиент тормозит выгрузку, а не раздувает память
+    '''
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, compress: bool):
+        self.loop = loop
+        self.queue = queue
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        self.parts: List[bytes] = []
+        self.size = 0
+        self.cancelled = False
+
+    def write(self, data: bytes) -> None:
+        if self.cancelled:
+            raise ConnectionError('Клиент отключился')
+        self.parts.append(data)
+        self.size += len(data)
+        if self.size >= CHUNK_BYTES:
+            self.flush()
+
+    def flush(self, final: bool = False) -> None:
+        chunk = b''.join(self.parts)
+        self.parts, self.size = [], 0
+        if self.compressor is not None:
+            chunk = self.compressor.compress(chunk) + (self.compressor.flush() if final else b'')
+        if chunk:
+            self.put(chunk)
+
+    def close(self) -> None:
+        """Остаток буфера и конец потока; None в очереди получает и оборванная выгрузка"""
+        try:
+            if not self.cancelled:
+                self.flush(final=True)
+        finally:
+            self.put(None)
+
+    def put(self, chunk: Optional[bytes]) -> None:
+        asyncio.run_coroutine_threadsafe(self.queue.put(chunk), self.loop).result()
+
+
+class StreamBody(io.RawIOBase):
+    """Тело запроса из asyncio-потока как файл для потока загрузки - читается по мере COPY, а не целиком"""
+
+    def __init__(self, reader: asyncio.StreamReader, length: int, loop: asyncio.AbstractEventLoop):
+        self.reader = reader
+        self.remaining = length
+        self.loop = loop
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        if self.remaining <= 0:
+            return 0
+        data = asyncio.run_coroutine_threadsafe(
+            self.reader.read(min(len(buffer), self.remaining)), self.loop).result()
+        if not data:
+            raise ConnectionError('Тело запроса оборвалось')
+        self.remaining -= len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def run_export(out: ChunkWriter, tables: List[str]) -> Dict[str, int]:
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        return export_snapshot(conn, out, tables)
+    finally:
+        conn.close()
+        out.close()
+
+
+def run_import(stream: io.BufferedReader, replace: bool, tables: List[str]) -> Dict[str, int]:
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        return import_snapshot(conn, stream, replace, tables)
+    finally:
+        conn.close()
+
+
+def parse_head(head: bytes) -> Tuple[str, str, str, Dict[str, str]]:
+    """Строка запроса и заголовки; повторный заголовок перекрывает предыдущий, как у платформы"""
+    lines = head.decode('latin-1').split('\r\n')
+    method, target, version = lines[0].split(' ')
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip()] = value.strip()
+    return method.upper(), target, version, headers
+
+
+def header_value(headers: Dict[str, str], name: str) -> Optional[str]:
+    name = name.lower()
+    for header, value in headers.items():
+        if header.lower() == name:
+            return value
+    return None
+
+
+def parse_length(headers: Dict[str, str]) -> int:
+    '''
+    Content-Length - только десятичные цифры; знак, пробелы внутри и пустое значение - ValueError (ответ 400)
+    '''
+    raw = header_value(headers, 'Content-Length')
+    if raw is None:
+        return 0
+    if not raw.isascii() or not raw.isdigit():
+        raise ValueError(f'Некорректный Content-Length: {raw!r}')
+    return int(raw)
+
+
+def error_response(status: int, message: str) -> Dict[str, Any]:
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': message}),
+        'isBase64Encoded': False
+    }
+
+
+# ===== ЗАПУСК =====
+
+def with_search_path(dsn: str, schema: str) -> str:
+    """Функции обращаются к части таблиц без схемы - как на платформе, через search_path"""
+    if '://' not in dsn:
+        return f"{dsn} options='-csearch_path={schema}'"
+    separator = '&' if '?' in dsn else '?'
+    return f'{dsn}{separator}options=-csearch_path%3D{schema}'
+
+
+async def serve(args: argparse.Namespace, worker: int) -> None:
+    functions = load_functions()
+    routes = build_routes(functions)
+    pool = install_shared_pool(functions, os.environ['DATABASE_URL'], args.db_pool)
+    server = Server(functions, routes, args.threads)
+    server.loop = asyncio.get_running_loop()
+
+    # Прогрев как у warm_up функций: подключение, PREPARE горячих запросов, схема storage
+    started = time.perf_counter()
+    for module in functions.values():
+        await server.loop.run_in_executor(server.executor, module.warm_up)
+    print(f'[server] worker {worker} pid {os.getpid()}: {len(functions)} functions, '
+          f'warm-up {(time.perf_counter() - started) * 1000:.0f}ms')
+
+    listener = await asyncio.start_server(
+        server.handle_connection, args.host, args.port, limit=MAX_HEADER_BYTES,
+        reuse_port=args.workers > 1, backlog=args.backlog
+    )
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        server.loop.add_signal_handler(sig, stop.set)
+    if worker == 0:
+        for path, name in sorted(routes.items(), key=lambda item: item[1]):
+            print(f'[server] {name:<14} http://{args.host}:{args.port}{path}')
+    async with listener:
+        await stop.wait()
+    server.executor.shutdown(wait=False, cancel_futures=True)
+    print(f'[server] worker {worker} stopped, pool={pool.stats}')
+
+
+def run_worker(args: argparse.Namespace, worker: int) -> None:
+    asyncio.run(serve(args, worker))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=1, help='процессов; порт делится через SO_REUSEPORT')
+    parser.add_argument('--threads', type=int, default=32, help='потоков для handler в каждом процессе')
+    parser.add_argument('--db-pool', type=int, default=16, help='подключений к БД в каждом процессе')
+    parser.add_argument('--backlog', type=int, default=4096)
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--schema', help='search_path для подключений, если он не задан в DSN')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+    os.environ['DATABASE_URL'] = with_search_path(args.dsn, args.schema) if args.schema else args.dsn
+
+    if args.workers <= 1:
+        run_worker(args, 0)
+        return
+
+    # spawn: каждый процесс импортирует функции сам и открывает свои подключения
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=run_worker, args=(args, i), name=f'mdc-worker-{i}')
+               for i in range(args.workers)]
+    for process in workers:
+        process.start()
+    signal.signal(signal.SIGTERM, lambda *_: [p.terminate() for p in workers])
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        for process in workers:
+            process.join()
+
+
+if __name__ == '__main__':
+    main()
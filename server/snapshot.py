@@ -0,0 +1,248 @@
+"""
+Business: Потоковый снимок состояния MDC в NDJSON - выгрузка и загрузка с постоянным расходом памяти
+Args: export [--tables ...] [--output файл] | import [--input файл] [--replace] [--tables ...];
+      БД - --dsn или DATABASE_URL; файл *.gz сжимается и читается через gzip
+Returns: NDJSON - по каждой таблице строка-заголовок {"@table": имя, "columns": [...]},
+         затем строки таблицы, по одному JSON-объекту на строку
+
+Выгрузка - COPY (SELECT row_to_json) TO STDOUT по каждой таблице в одной транзакции REPEATABLE READ:
+все таблицы из одного снимка, строки уходят в выход по мере чтения, в памяти - только буфер записи.
+Загрузка - COPY FROM STDIN каждой секции во временную таблицу и INSERT ... SELECT jsonb_populate_record
+в целевую, всё в одной транзакции: при ошибке база остаётся как была. Последовательности id и версий
+storage после загрузки продолжают с максимумов.
+--replace очищает только перечисленные таблицы. Если на них ссылаются внешними ключами таблицы не из списка
+(--replace --tables units без calls), загрузка отклоняется с перечнем этих таблиц: их нужно
+добавить в --tables, иначе они остались бы пустыми - в снимке их секций нет.
+Тот же снимок отдаёт и принимает server/app.py по /snapshot, если задан SNAPSHOT_TOKEN.
+
+Примеры:
+    python server/snapshot.py export --dsn postgresql://mdc@old/mdc --output mdc.ndjson.gz
+    python server/snapshot.py import --dsn postgresql://mdc@new/mdc --input mdc.ndjson.gz
+    python server/snapshot.py import --input mdc.ndjson --replace
+    python server/snapshot.py export --tables mdc_storage units unit_members > storage.ndjson
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from typing import Any, BinaryIO, Dict, List, Optional, Sequence
+import psycopg2
+
+SCHEMA = 't_p48049793_mobile_digital_compu'
+
+# Порядок загрузки - по внешним ключам: units раньше calls
+SNAPSHOT_TABLES = ('users', 'units', 'unit_members', 'unit_tombstones', 'unit_status_history', 'unit_status_daily',
+                   'unit_response_daily', 'calls', 'dispatcher_shifts', 'online_users', 'mdc_storage', 'activity_log')
+SECTION_PREFIX = b'{"@table"'
+CHUNK_BYTES = 256 * 1024
+LOG_RETENTION_DAYS = int(os.environ.get('ACTIVITY_LOG_RETENTION_DAYS', '90'))
+
+# row_to_json экранирует управляющие символы, поэтому с разделителем и кавычкой \x02 / \x01 строка JSON
+# проходит через CSV-режим COPY как есть - без удвоения обратных слэшей текстового формата
+ROW_COPY_OPTIONS = "FORMAT csv, DELIMITER E'\\x02', QUOTE E'\\x01'"
+
+
+def table_columns(cur, table: str) -> List[str]:
+    """Записываемые колонки таблицы, без генерируемых (calls.priority_rank)"""
+    cur.execute('''
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s AND is_generated = 'NEVER'
+        ORDER BY ordinal_position
+    ''', (SCHEMA, table))
+    return [row[0] for row in cur.fetchall()]
+
+
+def export_snapshot(conn, out: BinaryIO, tables: Sequence[str] = SNAPSHOT_TABLES) -> Dict[str, int]:
+    '''
+    Снимок таблиц в out строками NDJSON; conn - отдельное подключение, транзакция завершается здесь
+    Args: out - объект с write(bytes), который COPY вызывает для каждой строки
+    Returns: число выгруженных строк по таблицам
+    '''
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    counts: Dict[str, int] = {}
+    try:
+        with conn.cursor() as cur:
+            for table in tables:
+                out.write(json.dumps({'@table': table, 'columns': table_columns(cur, table)}).encode() + b'\n')
+                cur.copy_expert(
+                    f'COPY (SELECT row_to_json(t) FROM {SCHEMA}.{table} t) TO STDOUT WITH ({ROW_COPY_OPTIONS})', out)
+                counts[table] = cur.rowcount
+    finally:
+        conn.rollback()
+    return counts
+
+
+class SectionReader:
+    '''
+    Файл для copy_expert поверх потока NDJSON: read отдаёт строки текущей секции и останавливается
+    на заголовке следующей, next_section переходит к ней
+    '''
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.header: Optional[bytes] = None
+
+    def next_section(self) -> Optional[Dict[str, Any]]:
+        while self.header is None:
+            line = self.stream.readline()
+            if not line:
+                return None
+            if line.startswith(SECTION_PREFIX):
+                self.header = line
+            elif line.strip():
+                raise ValueError('снимок должен начинаться с заголовка {"@table": ...}')
+        header, self.header = json.loads(self.header), None
+        if header.get('@table') not in SNAPSHOT_TABLES or not isinstance(header.get('columns'), list):
+            raise ValueError(f"Неизвестная таблица в снимке: {header.get('@table')}")
+        return header
+
+    def read(self, size: int = CHUNK_BYTES) -> bytes:
+        lines = []
+        total = 0
+        while self.header is None and total < size:
+            line = self.stream.readline()
+            if not line:
+                break
+            if line.startswith(SECTION_PREFIX):
+                self.header = line
+            elif line.strip():
+                lines.append(line)
+                total += len(line)
+        return b''.join(lines)
+
+
+def referencing_closure(cur, tables: Sequence[str]) -> List[str]:
+    '''
+    tables и все таблицы, ссылающиеся на них внешними ключами, транзитивно - что затронул бы TRUNCATE tables.
+    Returns: полные имена, секции секционированных таблиц - через родителя
+    '''
+    cur.execute('''
+        WITH RECURSIVE t(oid) AS (
+            SELECT c.oid FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = %s AND c.relname = ANY(%s)
+            UNION
+            SELECT con.conrelid FROM pg_constraint con JOIN t ON con.confrelid = t.oid
+            WHERE con.contype = 'f'
+        )
+        SELECT format('%%I.%%I', n.nspname, c.relname)
+        FROM t JOIN pg_class c ON c.oid = t.oid JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE NOT c.relispartition
+        ORDER BY 1
+    ''', (SCHEMA, list(tables)))
+    return [row[0] for row in cur.fetchall()]
+
+
+def import_snapshot(conn, stream: BinaryIO, replace: bool = False,
+                    tables: Sequence[str] = SNAPSHOT_TABLES) -> Dict[str, int]:
+    '''
+    Загрузка снимка NDJSON одной транзакцией
+    Args: replace - сначала очистить tables; если на них ссылаются таблицы не из tables
+          (referencing_closure) - ValueError, ничего не очищается.
+          Без replace строки добавляются и конфликт ключей отменяет загрузку.
+          Секции таблиц не из tables - ошибка
+    Returns: число загруженных строк по таблицам
+    '''
+    reader = SectionReader(stream)
+    counts: Dict[str, int] = {}
+    try:
+        with conn.cursor() as cur:
+            if replace:
+                closure = referencing_closure(cur, tables)
+                extra = [t for t in closure if t not in {f'{SCHEMA}.{name}' for name in tables}]
+                if extra:
+                    raise ValueError(f"На очищаемые таблицы ссылаются {', '.join(extra)}: "
+                                     f"добавьте их в tables, иначе replace оставит их пустыми")
+                cur.execute(f"TRUNCATE {', '.join(closure)}")
+            cur.execute('CREATE TEMP TABLE snapshot_rows (doc JSONB NOT NULL) ON COMMIT DROP')
+            while (header := reader.next_section()) is not None:
+                table = header['@table']
+                if table not in tables or table in counts:
+                    raise ValueError(f'Таблица {table} не ожидается в снимке или встречается дважды')
+                cur.execute('TRUNCATE snapshot_rows')
+                cur.copy_expert(f'COPY snapshot_rows (doc) FROM STDIN WITH ({ROW_COPY_OPTIONS})', reader, CHUNK_BYTES)
+
+                target = table_columns(cur, table)
+                # Колонки, которых нет в снимке (старая версия схемы), получают значения по умолчанию
+                columns = [f'"{c}"' for c in target if c in header['columns']]
+                if not columns:
+                    raise ValueError(f'Нет общих колонок у секции {table} и таблицы в базе')
+                if table == 'activity_log':
+                    # Секции под месяцы загружаемых строк - как при переносе старого журнала в V0009
+                    cur.execute(f'''
+                        SELECT {SCHEMA}.activity_log_maintain(GREATEST(%s, (
+                            SELECT (now() AT TIME ZONE 'UTC')::date - MIN((doc->>'log_time')::timestamp)::date + 1
+                            FROM snapshot_rows
+                        )))
+                    ''', (LOG_RETENTION_DAYS,))
+                cur.execute(f'''
+                    INSERT INTO {SCHEMA}.{table} ({', '.join(columns)})
+                    SELECT {', '.join(f'r.{c}' for c in columns)}
+                    FROM snapshot_rows s, jsonb_populate_record(NULL::{SCHEMA}.{table}, s.doc) r
+                ''')
+                counts[table] = cur.rowcount
+                if 'id' in target:
+                    cur.execute(f'''
+                        SELECT setval(seq, max_id)
+                        FROM (SELECT pg_get_serial_sequence(%s, 'id') AS seq, MAX(id) AS max_id
+                              FROM {SCHEMA}.{table}) s
+                        WHERE seq IS NOT NULL AND max_id IS NOT NULL
+                    ''', (f'{SCHEMA}.{table}',))
+                if table == 'mdc_storage':
+                    # Версии только растут: следующая запись получит номер больше загруженных
+                    cur.execute(f'''
+                        SELECT setval('{SCHEMA}.mdc_storage_version_seq', MAX(version))
+                        FROM {SCHEMA}.mdc_storage HAVING MAX(version) IS NOT NULL
+                    ''')
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return counts
+
+
+def open_file(path: Optional[str], mode: str, default: BinaryIO) -> BinaryIO:
+    if not path or path == '-':
+        return default
+    if path.endswith('.gz'):
+        return gzip.open(path, mode, compresslevel=6)
+    return open(path, mode, buffering=CHUNK_BYTES)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--tables', nargs='+', choices=SNAPSHOT_TABLES, default=list(SNAPSHOT_TABLES),
+                        help='таблицы снимка; при загрузке - допустимые секции и что очищает --replace')
+    parser.add_argument('--output', help='файл выгрузки, по умолчанию stdout')
+    parser.add_argument('--input', help='файл загрузки, по умолчанию stdin')
+    parser.add_argument('--replace', action='store_true',
+                        help='очистить таблицы перед загрузкой; ссылающиеся на них таблицы должны быть в --tables')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+    # Порядок таблиц - всегда по внешним ключам, в каком бы порядке их ни перечислили
+    tables = [t for t in SNAPSHOT_TABLES if t in args.tables]
+
+    started = time.perf_counter()
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.command == 'export':
+            with open_file(args.output, 'wb', sys.stdout.buffer) as out:
+                counts = export_snapshot(conn, out, tables)
+        else:
+            with open_file(args.input, 'rb', sys.stdin.buffer) as stream:
+                counts = import_snapshot(conn, stream, args.replace, tables)
+    except ValueError as e:
+        sys.exit(f'[snapshot] {e}')
+    finally:
+        conn.close()
+    print(json.dumps({args.command: counts, 'seconds': round(time.perf_counter() - started, 1)}), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import type { ActivityLog } from './store';
+import funcUrls from '../../backend/func2url.json';
+
+// func2url.json заполняет платформа при деплое функции. До этого и на своём сервере (server/app.py)
+// адрес берётся из VITE_API_URL: сервер отдаёт функцию по /activity-log
+const ACTIVITY_LOG_API_URL = (funcUrls as any)['activity-log']
+  || (import.meta.env.VITE_API_URL ? `${import.meta.env.VITE_API_URL}/activity-log` : '');
+
+// Событие в формате функции activity-log: id - число из секционированной таблицы
+export interface ActivityLogRecord extends Omit<ActivityLog, 'id'> {
+  id: number;
+}
+
+export interface ActivityLogPage {
+  logs: ActivityLogRecord[];
+  next: { beforeTime: string; beforeId: number } | null;
+}
+
+export interface ActivityLogFilter {
+  from?: string;
+  to?: string;
+  type?: ActivityLog['type'];
+  userId?: string;
+  before?: ActivityLogPage['next'];
+  limit?: number;
+}
+
+const request = async <T>(query: string, init?: RequestInit): Promise<T | null> => {
+  if (!ACTIVITY_LOG_API_URL) {
+    console.error('Activity log API URL not configured');
+    return null;
+  }
+
+  try {
+    const response = await fetch(`${ACTIVITY_LOG_API_URL}${query}`, {
+      ...init,
+      headers: {
+        'Content-Type': 'application/json'
+      }
+    });
+
+    if (!response.ok) {
+      console.error('Activity log API error:', response.status, response.statusText);
+      return null;
+    }
+
+    return await response.json();
+  } catch (error) {
+    console.error('Error calling activity log API:', error);
+    return null;
+  }
+};
+
+// Пакетная запись: события копятся на клиенте и уходят одним запросом
+// rejected - некорректные события пакета (индекс в events и причина), остальные записаны
+export const sendActivityLogs = (
+  events: Omit<ActivityLog, 'id'>[]
+): Promise<{ written: number; expired: number; rejected: { index: number; error: string }[] } | null> =>
+  request('', {
+    method: 'POST',
+    body: JSON.stringify({ events })
+  });
+
+// Окно времени (по умолчанию последние сутки), новые первыми; следующая страница - before = next
+export const fetchActivityLogs = (filter: ActivityLogFilter = {}): Promise<ActivityLogPage | null> => {
+  const params = new URLSearchParams();
+  if (filter.from) params.set('from', filter.from);
+  if (filter.to) params.set('to', filter.to);
+  if (filter.type) params.set('type', filter.type);
+  if (filter.userId) params.set('user_id', filter.userId);
+  if (filter.before) {
+    params.set('before_time', filter.before.beforeTime);
+    params.set('before_id', String(filter.before.beforeId));
+  }
+  if (filter.limit !== undefined) params.set('limit', String(filter.limit));
+  const query = params.toString();
+  return request<ActivityLogPage>(query ? `?${query}` : '');
+};
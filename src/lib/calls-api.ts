@@ -0,0 +1,84 @@
+import type { Call } from './store';
+import funcUrls from '../../backend/func2url.json';
+
+// func2url.json заполняет платформа при деплое функции. До этого и на своём сервере (server/app.py)
+// адрес берётся из VITE_API_URL: сервер отдаёт функцию по /calls
+const CALLS_API_URL = (funcUrls as any).calls
+  || (import.meta.env.VITE_API_URL ? `${import.meta.env.VITE_API_URL}/calls` : '');
+
+// Вызов в формате функции calls: id - число из таблицы calls
+export interface CallRecord {
+  id: number;
+  callNumber: string;
+  time: string;
+  address: string;
+  type: string;
+  priority: Call['priority'];
+  status: Call['status'];
+  assignedCrewId: number | null;
+  completedAt: string | null;
+}
+
+export interface CallsPage {
+  calls: CallRecord[];
+  nextBeforeId?: number | null;
+}
+
+export interface CallsFilter {
+  status?: Call['status'];
+  priority?: Call['priority'];
+  unitId?: number;
+  beforeId?: number;
+  limit?: number;
+}
+
+const request = async <T>(query: string, init?: RequestInit): Promise<T | null> => {
+  if (!CALLS_API_URL) {
+    console.error('Calls API URL not configured');
+    return null;
+  }
+
+  try {
+    const response = await fetch(`${CALLS_API_URL}${query}`, {
+      ...init,
+      headers: {
+        'Content-Type': 'application/json'
+      }
+    });
+
+    if (!response.ok) {
+      console.error('Calls API error:', response.status, response.statusText);
+      return null;
+    }
+
+    return await response.json();
+  } catch (error) {
+    console.error('Error calling calls API:', error);
+    return null;
+  }
+};
+
+// История с фильтрами, новые первыми; следующая страница - beforeId = nextBeforeId
+export const fetchCalls = (filter: CallsFilter = {}): Promise<CallsPage | null> => {
+  const params = new URLSearchParams();
+  if (filter.status) params.set('status', filter.status);
+  if (filter.priority) params.set('priority', filter.priority);
+  if (filter.unitId !== undefined) params.set('unit_id', String(filter.unitId));
+  if (filter.beforeId !== undefined) params.set('before_id', String(filter.beforeId));
+  if (filter.limit !== undefined) params.set('limit', String(filter.limit));
+  const query = params.toString();
+  return request<CallsPage>(query ? `?${query}` : '');
+};
+
+// Ожидающие вызовы в порядке выдачи: высокий приоритет, затем самые старые
+export const fetchCallQueue = (limit = 50): Promise<CallsPage | null> =>
+  request<CallsPage>(`?view=queue&limit=${limit}`);
+
+// Атомарно назначает юниту следующий ожидающий вызов; null - очередь пуста или ошибка
+export const claimNextCall = async (unitId: number, minPriority?: Call['priority']): Promise<CallRecord | null> => {
+  const data = await request<{ call: CallRecord | null }>('?action=claim', {
+    method: 'POST',
+    body: JSON.stringify({ unitId, minPriority })
+  });
+  return data?.call ?? null;
+};
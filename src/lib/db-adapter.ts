@@ -1,8 +1,35 @@
 import { STORAGE_TYPE } from './config';
 
+export interface StorageChange {
+  entity: 'storage' | 'unit' | 'shift';
+  id: string | number;
+  version?: number;
+}
+
+export interface StorageScanItem<T = unknown> {
+  key: string;
+  version: number;
+  value?: T;
+}
+
+export interface StorageScanPage<T = unknown> {
+  prefix: string;
+  items: StorageScanItem<T>[];
+  next: string | null;
+  nextSince: number | null;
+}
+
+export type StoragePatchOp =
+  | { op: 'append'; value: unknown }
+  | { op: 'update'; id: string | number; value: Record<string, unknown> }
+  | { op: 'remove'; id: string | number }
+  | { op: 'set'; path: Array<string | number>; value: unknown };
+
 // Адаптер для работы с хранилищем (localStorage или PostgreSQL)
 class StorageAdapter {
   private apiBaseUrl = '/api/storage'; // URL бэкенд функции для работы с БД
+  // Последние полученные версии ключей: при повторном опросе сервер отвечает "unchanged" без значения
+  private versionCache = new Map<string, { version: number; value: unknown }>();
 
   async get<T>(key: string, defaultValue: T): Promise<T> {
     if (STORAGE_TYPE === 'localStorage') {
@@ -19,6 +46,155 @@ class StorageAdapter {
     await this.setToDatabase(key, value);
   }
 
+  // Пакетное чтение: одним запросом к БД вместо запроса на каждый ключ
+  async getMany<T extends Record<string, unknown>>(defaults: T): Promise<T> {
+    const keys = Object.keys(defaults);
+    if (STORAGE_TYPE === 'localStorage') {
+      return Object.fromEntries(
+        keys.map(key => [key, this.getFromLocalStorage(key, defaults[key])])
+      ) as T;
+    }
+
+    try {
+      const response = await fetch(this.apiBaseUrl, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ keys }),
+      });
+
+      if (!response.ok) {
+        console.warn(`[StorageAdapter] БД вернула ошибку для ключей [${keys.join(', ')}], используем значения по умолчанию`);
+        return defaults;
+      }
+
+      const data = await response.json();
+      const values: Record<string, unknown> = data.values || {};
+      return Object.fromEntries(
+        keys.map(key => [key, values[key] !== null && values[key] !== undefined ? values[key] : defaults[key]])
+      ) as T;
+    } catch (error) {
+      console.error(`[StorageAdapter] Ошибка пакетного запроса к БД [${keys.join(', ')}]:`, error);
+      return defaults;
+    }
+  }
+
+  // Пакетная запись: все ключи одним upsert на стороне БД
+  async setMany(entries: Record<string, unknown>): Promise<void> {
+    const keys = Object.keys(entries);
+    if (STORAGE_TYPE === 'localStorage') {
+      keys.forEach(key => this.setToLocalStorage(key, entries[key]));
+      return;
+    }
+
+    try {
+      const response = await fetch(this.apiBaseUrl, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ items: keys.map(key => ({ key, value: entries[key] })) }),
+      });
+
+      if (!response.ok) {
+        console.error(`[StorageAdapter] Не удалось сохранить в БД [${keys.join(', ')}]`);
+      } else {
+        keys.forEach(key => window.dispatchEvent(new CustomEvent('storage-change', { detail: { key } })));
+      }
+    } catch (error) {
+      console.error(`[StorageAdapter] Ошибка пакетной записи в БД [${keys.join(', ')}]:`, error);
+    }
+  }
+
+  // Частичная запись: операции применяются на сервере, передаётся только изменение.
+  // Возвращает новую версию или null (конфликт версий, нет ключа, ошибка сети)
+  async patch(key: string, ops: StoragePatchOp[], expectedVersion?: number): Promise<number | null> {
+    if (STORAGE_TYPE === 'localStorage') {
+      console.warn(`[StorageAdapter] patch() поддерживается только для БД [${key}]`);
+      return null;
+    }
+
+    try {
+      const response = await fetch(this.apiBaseUrl, {
+        method: 'PATCH',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ key, ops, expected_version: expectedVersion ?? null }),
+      });
+
+      if (!response.ok) {
+        console.warn(`[StorageAdapter] Не удалось применить изменения [${key}]: ${response.status}`);
+        return null;
+      }
+
+      const data = await response.json();
+      window.dispatchEvent(new CustomEvent('storage-change', { detail: { key } }));
+      return data.version;
+    } catch (error) {
+      console.error(`[StorageAdapter] Ошибка частичной записи в БД [${key}]:`, error);
+      return null;
+    }
+  }
+
+  // Long-poll: ждёт NOTIFY по темам (storage:<key>, unit, shift) вместо опроса по таймеру.
+  // Пустой массив - таймаут без изменений
+  async watch(topics: string[], sinceVersion?: number): Promise<StorageChange[]> {
+    if (STORAGE_TYPE === 'localStorage') {
+      return [];
+    }
+
+    try {
+      const since = sinceVersion !== undefined ? `&since_version=${sinceVersion}` : '';
+      const response = await fetch(`${this.apiBaseUrl}?watch=${encodeURIComponent(topics.join(','))}${since}`, {
+        method: 'GET',
+        headers: { 'Content-Type': 'application/json' },
+      });
+
+      if (!response.ok) {
+        console.warn(`[StorageAdapter] Ошибка подписки на изменения [${topics.join(', ')}]`);
+        return [];
+      }
+
+      const data = await response.json();
+      return data.changes || [];
+    } catch (error) {
+      console.error(`[StorageAdapter] Ошибка long-poll запроса [${topics.join(', ')}]:`, error);
+      return [];
+    }
+  }
+
+  // Коллекция по иерархическим ключам (calls/<id>): все страницы обхода по префиксу.
+  // С sinceVersion - только изменённые элементы; nextSince передаётся в следующий вызов
+  async scan<T>(prefix: string, sinceVersion = 0, withValues = true): Promise<{ items: StorageScanItem<T>[]; nextSince: number }> {
+    if (STORAGE_TYPE === 'localStorage') {
+      const items = Object.keys(localStorage)
+        .filter(key => key.startsWith(prefix))
+        .sort()
+        .map(key => ({ key, version: 0, value: withValues ? this.getFromLocalStorage<T | undefined>(key, undefined) : undefined }));
+      return { items, nextSince: 0 };
+    }
+
+    const items: StorageScanItem<T>[] = [];
+    let nextSince = sinceVersion;
+    let after: string | null = null;
+    do {
+      const query = new URLSearchParams({ prefix, since_version: String(sinceVersion), values: withValues ? '1' : '0' });
+      if (after) {
+        query.set('after', after);
+      }
+      const response = await fetch(`${this.apiBaseUrl}?${query}`, {
+        method: 'GET',
+        headers: { 'Content-Type': 'application/json' },
+      });
+      if (!response.ok) {
+        throw new Error(`[StorageAdapter] Ошибка обхода ключей [${prefix}]: ${response.status}`);
+      }
+      const page: StorageScanPage<T> = await response.json();
+      items.push(...page.items);
+      if (page.nextSince !== null) {
+        nextSince = page.nextSince;
+      }
+      after = page.next;
+    } while (after);
+    return { items, nextSince };
+  }
+
   private getFromLocalStorage<T>(key: string, defaultValue: T): T {
     try {
       const item = localStorage.getItem(key);
@@ -40,7 +216,9 @@ class StorageAdapter {
 
   private async getFromDatabase<T>(key: string, defaultValue: T): Promise<T> {
     try {
-      const response = await fetch(`${this.apiBaseUrl}?key=${encodeURIComponent(key)}`, {
+      const cached = this.versionCache.get(key);
+      const sinceVersion = cached ? `&since_version=${cached.version}` : '';
+      const response = await fetch(`${this.apiBaseUrl}?key=${encodeURIComponent(key)}${sinceVersion}`, {
         method: 'GET',
         headers: { 'Content-Type': 'application/json' },
       });
@@ -51,6 +229,12 @@ class StorageAdapter {
       }
 
       const data = await response.json();
+      if (data.unchanged && cached) {
+        return cached.value as T;
+      }
+      if (typeof data.version === 'number') {
+        this.versionCache.set(key, { version: data.version, value: data.value });
+      }
       return data.value !== null && data.value !== undefined ? data.value : defaultValue;
     } catch (error) {
       console.error(`[StorageAdapter] Ошибка запроса к БД [${key}]:`, error);
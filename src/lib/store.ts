@@ -28,6 +28,8 @@ export interface Crew {
   unitName: string;
   status: 'available' | 'en-route' | 'on-scene' | 'unavailable';
   location?: string;
+  lat?: number | null;
+  lon?: number | null;
   lastUpdate: string;
   members: string[];
   panicActive?: boolean;
@@ -34,6 +34,42 @@ export const fetchUnits = async (): Promise<Crew[]> => {
   }
 };
 
+export interface UnitChanges {
+  units: Crew[];
+  deleted: number[];
+  full: boolean;
+  nextSince: string;
+}
+
+// Инкрементальный опрос: только изменённые с updatedSince юниты и id удалённых.
+// full = true - пришёл полный список, локальный нужно заменить
+export const fetchUnitChanges = async (updatedSince?: string): Promise<UnitChanges | null> => {
+  if (!UNITS_API_URL) {
+    console.error('Units API URL not configured');
+    return null;
+  }
+
+  try {
+    const query = updatedSince ? `?updated_since=${encodeURIComponent(updatedSince)}` : '';
+    const response = await fetch(`${UNITS_API_URL}${query}`, {
+      method: 'GET',
+      headers: {
+        'Content-Type': 'application/json'
+      }
+    });
+
+    if (!response.ok) {
+      console.error('Failed to fetch unit changes:', response.status, response.statusText);
+      return null;
+    }
+
+    return await response.json();
+  } catch (error) {
+    console.error('Error fetching unit changes:', error);
+    return null;
+  }
+};
+
 export const createUnitAPI = async (unit: Omit<Crew, 'id' | 'lastUpdate'>): Promise<number | null> => {
   try {
     const response = await fetch(UNITS_API_URL, {
@@ -45,6 +81,8 @@ export const createUnitAPI = async (unit: Omit<Crew, 'id' | 'lastUpdate'>): Prom
         unitName: unit.unitName,
         status: unit.status,
         location: unit.location,
+        lat: unit.lat ?? undefined,
+        lon: unit.lon ?? undefined,
         members: unit.members
       })
     });
@@ -74,6 +112,8 @@ export const updateUnitAPI = async (unit: Crew): Promise<boolean> => {
         unitName: unit.unitName,
         status: unit.status,
         location: unit.location,
+        lat: unit.lat ?? undefined,
+        lon: unit.lon ?? undefined,
         members: unit.members
       })
     });
@@ -109,4 +149,103 @@ export const deleteUnitAPI = async (unitId: number): Promise<boolean> => {
     console.error('Error deleting unit:', error);
     return false;
   }
-};
\ No newline at end of file
+};
+
+export interface NearestUnit {
+  id: number;
+  unitName: string;
+  lat: number;
+  lon: number;
+  distanceM: number;
+}
+
+// k ближайших к точке вызова свободных юнитов, ближайший первым
+export const fetchNearestUnits = async (lat: number, lon: number, k = 5): Promise<NearestUnit[]> => {
+  if (!UNITS_API_URL) {
+    console.error('Units API URL not configured');
+    return [];
+  }
+
+  try {
+    const response = await fetch(`${UNITS_API_URL}?near=${lat},${lon}&k=${k}`, {
+      method: 'GET',
+      headers: {
+        'Content-Type': 'application/json'
+      }
+    });
+
+    if (!response.ok) {
+      console.error('Failed to fetch nearest units:', response.status, response.statusText);
+      return [];
+    }
+
+    const data = await response.json();
+    return data.units || [];
+  } catch (error) {
+    console.error('Error fetching nearest units:', error);
+    return [];
+  }
+};
+
+export interface UnitStatusTime {
+  period: string;
+  unitId: number;
+  seconds: Record<string, number>;
+  entries: Record<string, number>;
+  busyShare: number | null;
+}
+
+export interface ResponseTimeStats {
+  period: string;
+  count: number;
+  p50: number | null;
+  p90: number | null;
+  p95: number | null;
+  p99: number | null;
+}
+
+export interface StatusAnalytics {
+  from: string;
+  to: string;
+  period: 'day' | 'week' | 'month' | 'all';
+  statusTime: UnitStatusTime[];
+  responseTime: ResponseTimeStats[];
+}
+
+// Время в статусах по юнитам и периодам и процентили времени реагирования (секунды).
+// from/to - даты YYYY-MM-DD, to не включается; по умолчанию - последние 30 дней
+export const fetchStatusAnalytics = async (options: {
+  from?: string;
+  to?: string;
+  period?: StatusAnalytics['period'];
+  unitId?: number;
+} = {}): Promise<StatusAnalytics | null> => {
+  if (!UNITS_API_URL) {
+    console.error('Units API URL not configured');
+    return null;
+  }
+
+  const query = new URLSearchParams({ view: 'status-time', period: options.period ?? 'day' });
+  if (options.from) query.set('from', options.from);
+  if (options.to) query.set('to', options.to);
+  if (options.unitId !== undefined) query.set('unit_id', String(options.unitId));
+
+  try {
+    const response = await fetch(`${UNITS_API_URL}?${query}`, {
+      method: 'GET',
+      headers: {
+        'Content-Type': 'application/json'
+      }
+    });
+
+    if (!response.ok) {
+      console.error('Failed to fetch status analytics:', response.status, response.statusText);
+      return null;
+    }
+
+    return await response.json();
+  } catch (error) {
+    console.error('Error fetching status analytics:', error);
+    return null;
+  }
+};
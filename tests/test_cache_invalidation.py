@@ -0,0 +1,134 @@
+"""
+Кэш процесса и схлопывание чтений против записей: чтение, начатое до записи, не должно
+вернуть в кэш строку, которую запись уже сбросила. БД не нужна - запрос заменён блокирующимся курсором.
+
+Запуск: python -m unittest discover -s tests
+"""
+
+import importlib.util
+import os
+import threading
+import unittest
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+
+
+def load_function(name: str):
+    os.environ['DB_WARMUP'] = '0'
+    spec = importlib.util.spec_from_file_location(f"mdc_test_{name.replace('-', '_')}", BACKEND / name / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class BlockingCursor:
+    """Курсор, чей запрос ждёт release - между чтением и записью в кэш успевает пройти запись"""
+
+    def __init__(self, row, started: threading.Event, release: threading.Event):
+        self.connection = object()  # без prepared - execute_prepared идёт обычным execute
+        self.row = row
+        self.started = started
+        self.release = release
+
+    def execute(self, sql, args=None):
+        self.started.set()
+        self.release.wait(5)
+
+    def fetchone(self):
+        return self.row
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class BlockingConnection:
+    def __init__(self, row):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.row = row
+
+    def cursor(self, *args, **kwargs):
+        return BlockingCursor(self.row, self.started, self.release)
+
+
+class ResponseCacheGenerationTest(unittest.TestCase):
+    def test_put_after_invalidate_is_dropped(self):
+        for name in ('storage', 'units', 'online-users'):
+            with self.subTest(function=name):
+                cache = load_function(name).ResponseCache(16, 1024 * 1024)
+                generation = cache.generation()
+                cache.invalidate('key', 'a')
+                cache.put(('key', 'a'), 'old', 3, 60, generation)
+                cache.put(('key', 'b'), 'other', 5, 60, generation)
+                self.assertIsNone(cache.get(('key', 'a')))
+                self.assertEqual(cache.get(('key', 'b')), 'other')
+                self.assertEqual(cache.stats['stale_puts'], 1)
+
+                cache.put(('key', 'a'), 'new', 3, 60, cache.generation())
+                self.assertEqual(cache.get(('key', 'a')), 'new')
+
+    def test_prefix_invalidate_covers_longer_keys(self):
+        cache = load_function('units').ResponseCache(16, 1024 * 1024)
+        generation = cache.generation()
+        cache.invalidate('units')
+        cache.put(('units', None, 0, 100), 'old', 3, 60, generation)
+        self.assertIsNone(cache.get(('units', None, 0, 100)))
+
+    def test_overflowing_invalidations_reject_older_reads(self):
+        cache = load_function('storage').ResponseCache(4, 1024 * 1024)
+        generation = cache.generation()
+        for i in range(10):
+            cache.invalidate('key', f'k{i}')
+        cache.put(('key', 'untouched'), 'old', 3, 60, generation)
+        self.assertIsNone(cache.get(('key', 'untouched')))
+
+
+class ReadInterleavedWithWriteTest(unittest.TestCase):
+    def test_storage_read_key_started_before_write(self):
+        storage = load_function('storage')
+        conn = BlockingConnection((7, '{"old": true}'))
+        reader = threading.Thread(target=storage.read_key, args=(conn, 'mdc_calls', None))
+        reader.start()
+        self.assertTrue(conn.started.wait(5))
+        # Запись закоммичена, пока чтение ещё держит старую строку
+        storage.invalidate('key', 'mdc_calls')
+        conn.release.set()
+        reader.join(5)
+        self.assertIsNone(storage._cache.get(('key', 'mdc_calls')))
+
+        # Следующее чтение, начатое после записи, кэшируется как обычно
+        conn = BlockingConnection((8, '{"new": true}'))
+        conn.release.set()
+        storage.read_key(conn, 'mdc_calls', None)
+        self.assertEqual(storage._cache.get(('key', 'mdc_calls')), (8, '{"new": true}'))
+
+    def test_flight_forgotten_by_write_is_not_joined(self):
+        storage = load_function('storage')
+        flights = storage.SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        loads = []
+
+        def slow_load():
+            loads.append('old')
+            started.set()
+            release.wait(5)
+            return 'old'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flights.do(('key', 'a'), slow_load)))
+        leader.start()
+        self.assertTrue(started.wait(5))
+        flights.forget('key', 'a')
+        # Пришедший после записи запрос не ждёт старое чтение, а делает своё
+        self.assertEqual(flights.do(('key', 'a'), lambda: 'new'), ('new', False))
+        release.set()
+        leader.join(5)
+        self.assertEqual(results, [('old', False)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Общий код функций: платформа деплоит каждую backend/<имя>/index.py отдельно, поэтому пул подключений,
+замер запроса, PREPARE и кэш ответов скопированы в каждую функцию. Копии должны совпадать символ в символ,
+иначе server/app.py (общий пул берётся из первой функции) и функции на платформе ведут себя по-разному.
+БД не нужна - сравниваются исходники.
+
+Запуск: python -m unittest discover -s tests
+"""
+
+import ast
+import unittest
+from pathlib import Path
+from typing import Dict
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+
+# Классы и функции, одинаковые во всех функциях, где они есть. Правка одного - правка всех копий
+SHARED_DEFINITIONS = (
+    'RequestTimer', 'request_phase', 'log_slow_query', 'timed_cursor', 'TimedConnection', 'instrumented',
+    'prepare_sql', 'prepare_statements', 'execute_prepared',
+    'PoolTimeout', 'ConnectionPool', 'get_pool', 'db_connection',
+    'ResponseCache', '_Flight', 'SingleFlight', 'invalidate',
+)
+
+# Настройки пула, замера и PREPARE. Размеры кэша и CACHE_TTL у функций свои и сюда не входят
+SHARED_ASSIGNMENTS = (
+    'DB_POOL_MIN', 'DB_POOL_MAX', 'DB_POOL_TIMEOUT', 'DB_POOL_PING_AFTER', 'DB_WARMUP', 'DB_PREPARE',
+    'REQUEST_LOG', 'SLOW_QUERY_MS', 'CHANGES_CHANNEL',
+    '_request', '_timed_cursors', '_pool', '_pool_lock', '_cache', '_flights',
+)
+
+
+def module_sources() -> Dict[str, Dict[str, str]]:
+    '''Имя функции -> {имя определения или переменной верхнего уровня -> исходник}'''
+    result = {}
+    for path in sorted(BACKEND.glob('*/index.py')):
+        source = path.read_text(encoding='utf-8')
+        definitions = {}
+        for node in ast.parse(source).body:
+            if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+                definitions[node.name] = ast.get_source_segment(source, node)
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+                target = node.targets[0] if isinstance(node, ast.Assign) else node.target
+                if isinstance(target, ast.Name):
+                    definitions[target.id] = ast.get_source_segment(source, node)
+        result[path.parent.name] = definitions
+    return result
+
+
+class SharedCodeTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.modules = module_sources()
+
+    def assert_copies_identical(self, name: str) -> None:
+        copies = {function: sources[name] for function, sources in self.modules.items() if name in sources}
+        self.assertGreater(len(copies), 1, f'{name} есть меньше чем в двух функциях - уберите из списка')
+        reference_function, reference = next(iter(copies.items()))
+        for function, source in copies.items():
+            self.assertEqual(source, reference, f'{name} в {function} отличается от копии в {reference_function}')
+
+    def test_shared_definitions_are_identical(self):
+        for name in SHARED_DEFINITIONS:
+            with self.subTest(name=name):
+                self.assert_copies_identical(name)
+
+    def test_shared_settings_are_identical(self):
+        for name in SHARED_ASSIGNMENTS:
+            with self.subTest(name=name):
+                self.assert_copies_identical(name)
+
+    def test_every_function_has_pool_and_timing(self):
+        required = {'RequestTimer', 'instrumented', 'ConnectionPool', 'get_pool', 'execute_prepared'}
+        for function, sources in self.modules.items():
+            with self.subTest(function=function):
+                self.assertLessEqual(required, set(sources))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+Загрузка снимка с replace по части таблиц: таблицы вне списка, ссылающиеся на очищаемые,
+не должны молча остаться пустыми. БД не нужна - курсор записывает запросы и отдаёт заданное замыкание.
+
+Запуск: python -m unittest discover -s tests
+"""
+
+import io
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'server'))
+
+import snapshot  # noqa: E402
+
+
+class RecordingCursor:
+    def __init__(self, closure):
+        self.closure = closure
+        self.queries = []
+
+    def execute(self, sql, args=None):
+        self.queries.append(' '.join(sql.split()))
+
+    def fetchall(self):
+        return [(name,) for name in self.closure]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class RecordingConnection:
+    def __init__(self, closure):
+        self.cur = RecordingCursor(closure)
+        self.committed = False
+        self.rolled_back = False
+
+    def cursor(self, *args, **kwargs):
+        return self.cur
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+def qualified(*tables):
+    return [f'{snapshot.SCHEMA}.{t}' for t in tables]
+
+
+class ReplaceSubsetTest(unittest.TestCase):
+    def test_referencing_table_outside_subset_is_rejected(self):
+        conn = RecordingConnection(qualified('calls', 'units'))
+        with self.assertRaises(ValueError) as raised:
+            snapshot.import_snapshot(conn, io.BytesIO(b''), replace=True, tables=['units'])
+        self.assertIn(f'{snapshot.SCHEMA}.calls', str(raised.exception))
+        self.assertFalse(any(q.startswith('TRUNCATE') for q in conn.cur.queries))
+        self.assertTrue(conn.rolled_back)
+        self.assertFalse(conn.committed)
+
+    def test_closed_subset_is_truncated(self):
+        conn = RecordingConnection(qualified('calls', 'units'))
+        snapshot.import_snapshot(conn, io.BytesIO(b''), replace=True, tables=['units', 'calls'])
+        self.assertIn(f"TRUNCATE {', '.join(qualified('calls', 'units'))}", conn.cur.queries)
+        self.assertTrue(conn.committed)
+
+
+if __name__ == '__main__':
+    unittest.main()
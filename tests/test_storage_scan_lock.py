@@ -0,0 +1,121 @@
+"""
+Порядок блокировок обхода по префиксу и записей storage: обход не ждёт незакоммиченную запись и не
+задерживает записи, пришедшие после него, а nextSince не перескакивает номер незакоммиченной записи.
+Нужна PostgreSQL с накатанными db_migrations (bench/run.py --setup); без TEST_DATABASE_URL тесты пропускаются.
+
+Запуск: TEST_DATABASE_URL=postgresql://localhost/mdc_test python -m unittest discover -s tests
+"""
+
+import importlib.util
+import json
+import os
+import threading
+import unittest
+import uuid
+from pathlib import Path
+
+import psycopg2
+
+ROOT = Path(__file__).resolve().parent.parent
+SCHEMA = 't_p48049793_mobile_digital_compu'
+DSN = os.environ.get('TEST_DATABASE_URL')
+
+
+def with_search_path(dsn: str) -> str:
+    separator = '&' if '?' in dsn else '?'
+    return f'{dsn}{separator}options=-csearch_path%3D{SCHEMA}'
+
+
+def load_storage():
+    os.environ['DB_WARMUP'] = '0'
+    os.environ['REQUEST_LOG'] = '0'
+    os.environ['DATABASE_URL'] = with_search_path(DSN)
+    spec = importlib.util.spec_from_file_location('mdc_test_storage_scan', ROOT / 'backend' / 'storage' / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Context:
+    request_id = 'scan-lock-test'
+    function_name = 'storage'
+
+
+@unittest.skipUnless(DSN, 'нужен TEST_DATABASE_URL')
+class ScanLockOrderingTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.storage = load_storage()
+
+    def setUp(self):
+        self.prefix = f'scan-lock-{uuid.uuid4().hex[:8]}/'
+        self.write(f'{self.prefix}a', 1)
+
+    def tearDown(self):
+        with psycopg2.connect(with_search_path(DSN)) as conn, conn.cursor() as cur:
+            cur.execute('DELETE FROM mdc_storage WHERE key LIKE %s', (self.prefix + '%',))
+        conn.close()
+
+    def write(self, key: str, value):
+        response = self.storage.handler({
+            'httpMethod': 'POST', 'queryStringParameters': {}, 'headers': {},
+            'body': json.dumps({'key': key, 'value': value})
+        }, Context())
+        self.assertEqual(response['statusCode'], 200)
+        return json.loads(response['body'])['version']
+
+    def scan(self, since: int = 0):
+        response = self.storage.handler({
+            'httpMethod': 'GET', 'queryStringParameters': {'prefix': self.prefix, 'since_version': str(since)},
+            'headers': {}, 'body': ''
+        }, Context())
+        self.assertEqual(response['statusCode'], 200)
+        return json.loads(response['body'])
+
+    def open_write(self, key: str):
+        """Запись, взявшая номер версии и не закоммиченная - как долгая транзакция другого экземпляра"""
+        conn = psycopg2.connect(with_search_path(DSN))
+        cur = conn.cursor()
+        cur.execute(self.storage.SQL_SET_KEY, (key, json.dumps('in-flight'), self.storage.CHANGES_CHANNEL))
+        return conn, cur.fetchone()[0]
+
+    def test_scan_does_not_wait_for_uncommitted_write_or_skip_it(self):
+        writer, in_flight = self.open_write(f'{self.prefix}b')
+        try:
+            result = {}
+            scanner = threading.Thread(target=lambda: result.update(self.scan()))
+            scanner.start()
+            scanner.join(3)
+            self.assertFalse(scanner.is_alive(), 'обход ждёт незакоммиченную запись')
+            self.assertLess(result['nextSince'], in_flight)
+        finally:
+            writer.commit()
+            writer.close()
+        # Запись, закоммиченная после обхода, приходит в следующем
+        keys = [item['key'] for item in self.scan(result['nextSince'])['items']]
+        self.assertIn(f'{self.prefix}b', keys)
+
+    def test_writes_are_not_queued_behind_scan(self):
+        writer, _ = self.open_write(f'{self.prefix}b')
+        try:
+            scanner = threading.Thread(target=self.scan)
+            scanner.start()
+            # Вторая запись приходит, пока первая держит разделяемую блокировку, а обход идёт
+            with psycopg2.connect(with_search_path(DSN)) as conn, conn.cursor() as cur:
+                cur.execute("SET statement_timeout = '3s'")
+                cur.execute(self.storage.SQL_SET_KEY,
+                            (f'{self.prefix}c', json.dumps('second'), self.storage.CHANGES_CHANNEL))
+            conn.close()
+            scanner.join(3)
+            self.assertFalse(scanner.is_alive())
+        finally:
+            writer.commit()
+            writer.close()
+
+    def test_scan_reads_sequence_when_no_write_is_in_flight(self):
+        version = self.write(f'{self.prefix}b', 2)
+        self.assertGreaterEqual(self.scan()['nextSince'], version)
+
+
+if __name__ == '__main__':
+    unittest.main()